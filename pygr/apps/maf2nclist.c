@@ -32,7 +32,8 @@ int findseqID(char seqName[],SeqIDMap seqidmap[],int r)
   return -1;
 }
 
-int save_interval(IntervalMap *im,int start,int stop,int iseq,int istart,int istop)
+int save_interval(IntervalMap *im,IntervalCoord start,IntervalCoord stop,int iseq,
+		  IntervalCoord istart,IntervalCoord istop)
 {
   im->start=start;
   im->end=stop;
@@ -44,8 +45,104 @@ int save_interval(IntervalMap *im,int start,int stop,int iseq,int istart,int ist
 }
 
 
+/* IDENTIFY gzip OR bzip2 COMPRESSED FILES BY THEIR MAGIC NUMBER.
+   RETURNS INPUT_PLAIN, INPUT_GZIP OR INPUT_BZIP2, OR -1 ON ERROR */
+int input_file_compression(char filename[])
+{
+  int n;
+  unsigned char magic[3];
+  FILE *ifile;
+
+  ifile=fopen(filename,"rb"); /* binary file */
+  if (!ifile)
+    return -1;
+  n=fread(magic,1,3,ifile);
+  fclose(ifile);
+  if (n>=2 && 0x1f==magic[0] && 0x8b==magic[1])
+    return INPUT_GZIP;
+  if (n==3 && 'B'==magic[0] && 'Z'==magic[1] && 'h'==magic[2])
+    return INPUT_BZIP2;
+  return INPUT_PLAIN;
+}
+
+
+/* OPEN A MAF OR axtNet TEXT FILE FOR READING.  A gzip OR bzip2 FILE IS
+   DECOMPRESSED AS IT IS READ, THROUGH A PIPE FROM gzip -dc OR bzip2 -dc,
+   SO NO TEMPORARY FILE IS NEEDED.  SETS *p_is_pipe FOR close_input_file() */
+FILE *open_input_file(char filename[],int *p_is_pipe,char err_msg[])
+{
+  int compression;
+  FILE *ifile;
+#ifdef PYGR_HAVE_POPEN
+  int i;
+  char *command=NULL,*p;
+#endif
+
+  *p_is_pipe=0;
+  compression=input_file_compression(filename);
+  if (compression==INPUT_PLAIN)
+    ifile=fopen(filename,"r"); /* text file */
+  else if (compression<0)
+    ifile=NULL;
+  else {
+#ifdef PYGR_HAVE_POPEN
+    i=strlen(filename);
+    CALLOC(command,4*i+32,char);
+    if (compression==INPUT_GZIP)
+      strcpy(command,"gzip -dc '");
+    else
+      strcpy(command,"bzip2 -dc '");
+    p=command+strlen(command);
+    for (i=0;filename[i];i++) { /* QUOTE filename FOR THE SHELL */
+      if ('\''==filename[i]) {
+	strcpy(p,"'\\''");
+	p+=4;
+      }
+      else
+	*p++ = filename[i];
+    }
+    strcpy(p,"'");
+    ifile=popen(command,"r");
+    free(command);
+    if (!ifile) {
+      if (err_msg)
+	sprintf(err_msg,"unable to start decompressing file %s",filename);
+      return NULL;
+    }
+    *p_is_pipe=1;
+#else
+    if (err_msg)
+      sprintf(err_msg,"%s: compressed files are not supported on this platform",
+	      filename);
+    return NULL;
+#endif
+  }
+  if (!ifile && err_msg)
+    sprintf(err_msg,"unable to open file %s",filename);
+  return ifile;
+#ifdef PYGR_HAVE_POPEN
+ handle_malloc_failure:
+  if (err_msg)
+    sprintf(err_msg,"out of memory");
+  return NULL;
+#endif
+}
+
+
+/* CLOSE A FILE OPENED BY open_input_file().  RETURNS NONZERO ON ERROR,
+   e.g. IF THE DECOMPRESSOR FAILED ON A CORRUPTED FILE */
+int close_input_file(FILE *ifile,int is_pipe)
+{
+#ifdef PYGR_HAVE_POPEN
+  if (is_pipe)
+    return pclose(ifile);
+#endif
+  return fclose(ifile);
+}
+
+
 int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
-		  int lpoStart,int *p_block_len,FILE *ifile,int maxseq,
+		  IntervalCoord lpoStart,int *p_block_len,FILE *ifile,int maxseq,
 		  long long linecode_count[],int *p_has_continuation)
 {
   int i,start,seqStart,junk,iseq= -1,max_len=0,seqLength,newline=1,l,extend=0;
@@ -123,13 +220,147 @@ int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
   return n;
 }
 
+/* FIND THE OFFSET OF THE FIRST MAF BLOCK ("a" LINE) STARTING AT OR AFTER
+   offset IN filename, SO THE FILE CAN BE SPLIT INTO RANGES OF WHOLE BLOCKS.
+   RETURNS THE FILE SIZE IF THERE IS NONE, OR -1 ON ERROR */
+long long find_maf_block_start(char filename[],long long offset,char err_msg[])
+{
+  int l,newline=1;
+  long long pos;
+  char tmp[32768];
+  FILE *ifile;
+
+  ifile=fopen(filename,"r"); /* text file */
+  if (!ifile) {
+    if (err_msg)
+      sprintf(err_msg,"unable to open file %s",filename);
+    return -1;
+  }
+  if (offset>0) { /* CHECK IF offset IS AT THE START OF A LINE */
+    PYGR_FSEEK(ifile,offset-1,SEEK_SET);
+    l=fgetc(ifile);
+    newline= (l=='\n' || l=='\r');
+  }
+  while (1) {
+    pos=PYGR_FTELL(ifile);
+    if (!fgets(tmp,32767,ifile)) /* NO MORE BLOCKS */
+      break;
+    if (newline && 'a'==tmp[0]) /* SAME TEST AS readMAFrecord() */
+      break;
+    l=strlen(tmp);
+    newline= (tmp[l-1]=='\n' || tmp[l-1]=='\r');
+  }
+  fclose(ifile);
+  return pos;
+}
+
+
+/* READ THE MAF BLOCKS WHOSE "a" LINES START IN [start,end) OF filename,
+   WHERE start IS THE OFFSET OF AN "a" LINE, AND WRITE EACH TO ofile AS
+   int n, int block_len, IntervalMap im[n], WITH ITS LPO COORDINATES
+   STARTING FROM 0 AND target_id GIVING ITS INDEX IN seqidmap[].  BLOCKS
+   WITH NO INTERVALS ARE SKIPPED.  start=0, end= -1 READS THE WHOLE FILE,
+   WHICH MAY BE COMPRESSED.  RETURNS THE #BLOCKS WRITTEN, OR -1 */
+int write_maf_blocks(char filename[],long long start,long long end,
+		     SeqIDMap seqidmap[],int nseq,FILE *ofile,int maxseq,
+		     long long linecode_count[],char err_msg[])
+{
+  int n,l,block_len,has_continuation,is_pipe,newline=1,nblock=0;
+  char tmp[32768],*p;
+  IntervalMap *im=NULL;
+  FILE *ifile;
+
+  ifile=open_input_file(filename,&is_pipe,err_msg);
+  if (!ifile)
+    return -1;
+  CALLOC(im,maxseq,IntervalMap);
+  if (start>0) {
+    if (is_pipe) { /* CAN'T SEEK IN A PIPE */
+      if (err_msg)
+	sprintf(err_msg,"%s: cannot read a compressed file from offset %lld",
+		filename,start);
+      goto handle_error;
+    }
+    PYGR_FSEEK(ifile,start,SEEK_SET);
+    if (!fgets(tmp,32767,ifile) || 'a'!=tmp[0]) { /* NOT AN "a" LINE! */
+      if (err_msg)
+	sprintf(err_msg,"%s: no MAF block at offset %lld",filename,start);
+      goto handle_error;
+    }
+  }
+  else { /* READ FROM THE START OF THE FILE */
+    if (!fgets(tmp,32767,ifile) || strncmp(tmp,"##maf",4)) { /* HEADER LINE */
+      if (err_msg)
+	sprintf(err_msg,"%s: not a MAF file? Bad format.",filename);
+      goto handle_error;
+    }
+    while ((p=fgets(tmp,32767,ifile)) && !(newline && 'a'==tmp[0])) {
+      l=strlen(tmp); /* SKIP TO THE FIRST "a" LINE */
+      newline= (tmp[l-1]=='\n' || tmp[l-1]=='\r');
+    }
+    if (!p) /* NO BLOCKS IN THIS FILE */
+      goto done;
+  }
+  do { /* READ BLOCKS UNTIL ONE STARTS PAST end */
+    if (end>=0 && PYGR_FTELL(ifile)>end) /* ITS "a" LINE IS IN THE NEXT RANGE */
+      break;
+    n=readMAFrecord(im,0,seqidmap,nseq,0,&block_len,ifile,maxseq,
+		    linecode_count,&has_continuation);
+    if (n<0) {
+      if (err_msg)
+	sprintf(err_msg,"MAF block too long!  Increase max size");
+      goto handle_error;
+    }
+    if (n==0) /* NOTHING TO SAVE */
+      continue;
+    if (1!=fwrite(&n,sizeof(int),1,ofile)
+	|| 1!=fwrite(&block_len,sizeof(int),1,ofile)
+	|| n!=(int)fwrite(im,sizeof(IntervalMap),n,ofile)) {
+      if (err_msg)
+	sprintf(err_msg,"error writing output file! out of disk space?");
+      goto handle_error;
+    }
+    nblock++;
+  } while (has_continuation);
+ done:
+  free(im);
+  if (close_input_file(ifile,is_pipe)) { /* e.g. A CORRUPTED gzip FILE */
+    if (err_msg)
+      sprintf(err_msg,"error reading file %s",filename);
+    return -1;
+  }
+  return nblock;
+ handle_malloc_failure:
+  if (err_msg)
+    sprintf(err_msg,"out of memory");
+ handle_error:
+  close_input_file(ifile,is_pipe);
+  FREE(im);
+  return -1;
+}
+
+
+/* READ ONE BLOCK WRITTEN BY write_maf_blocks() INTO im[].  RETURNS ITS
+   #INTERVALS, 0 AT END OF FILE, OR -1 IF IT IS TRUNCATED OR TOO BIG */
+int read_maf_block(FILE *ifile,IntervalMap im[],int maxseq,int *p_block_len)
+{
+  int n;
+  if (1!=fread(&n,sizeof(int),1,ifile)) /* END OF FILE */
+    return 0;
+  if (n<=0 || n>maxseq || 1!=fread(p_block_len,sizeof(int),1,ifile)
+      || n!=(int)fread(im,sizeof(IntervalMap),n,ifile))
+    return -1;
+  return n;
+}
+
+
 int read_axtnet(IntervalMap im[], SeqIDMap seqidmap[], int nseq,
                 FILE *ifile, int maxseq, int *isrc, char *src_prefix,
                 char *dest_prefix)
 {
   int i,srcStart,srcEnd,destStart,destEnd,junk,junk2,idest=-1;
   int n=0,ivalSrc= -1,ivalDest= -1,lineMax,lineAlloc=0;
-  int srcLength, destLength;
+  int destLength;
   unsigned char tmp[32768];
   char *p, *src_seq=NULL, *dest_seq=NULL, srcName[64], destName[64], oriFlag[8], srcChr[64], destChr[64];
   while ((p=fgets(tmp,32767,ifile))) {
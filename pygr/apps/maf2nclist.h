@@ -8,18 +8,39 @@ typedef struct {
   char *id;
   int length;
   int ns_id;
-  int offset;
+  IntervalCoord offset;
   int nlmsa_id;
 } SeqIDMap;
 
 
 
 
+/* COMPRESSION OF AN INPUT FILE, FROM input_file_compression() */
+#define INPUT_PLAIN 0
+#define INPUT_GZIP 1
+#define INPUT_BZIP2 2
+
+extern int input_file_compression(char filename[]);
+
+extern FILE *open_input_file(char filename[],int *p_is_pipe,char err_msg[]);
+
+extern int close_input_file(FILE *ifile,int is_pipe);
+
 extern int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
-			 int lpoStart,int *p_block_len,FILE *ifile,int maxseq,
+			 IntervalCoord lpoStart,int *p_block_len,FILE *ifile,int maxseq,
 			 long long linecode_count[],int *p_has_continuation)
      ;
 
+extern long long find_maf_block_start(char filename[],long long offset,
+				      char err_msg[]);
+
+extern int write_maf_blocks(char filename[],long long start,long long end,
+			    SeqIDMap seqidmap[],int nseq,FILE *ofile,int maxseq,
+			    long long linecode_count[],char err_msg[]);
+
+extern int read_maf_block(FILE *ifile,IntervalMap im[],int maxseq,
+			  int *p_block_len);
+
 extern int read_axtnet(IntervalMap im[], SeqIDMap seqidmap[], int nseq,
                 FILE *ifile, int maxseq, int *isrc, char *src_prefix,
                 char *dest_prefix)
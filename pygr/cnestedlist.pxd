@@ -31,18 +31,25 @@ cdef extern from "string.h":
   char *strdup(char *)
   char *strcat(char *,char *)
 
+cdef extern from "Python.h":
+  ctypedef void const_void "const void"
+  int PyObject_AsReadBuffer(object obj,const_void **buffer,Py_ssize_t *buffer_len) except -1
+  object PyString_FromStringAndSize(char *s,Py_ssize_t len)
+  FILE *PyFile_AsFile(object f)
+
 cdef extern from "intervaldb.h":
+  ctypedef long IntervalCoord
   ctypedef struct IntervalMap:
-    int start
-    int end
+    IntervalCoord start
+    IntervalCoord end
     int target_id
-    int target_start
-    int target_end
+    IntervalCoord target_start
+    IntervalCoord target_end
     int sublist
 
   ctypedef struct IntervalIndex:
-    int start
-    int end
+    IntervalCoord start
+    IntervalCoord end
 
   ctypedef struct SublistHeader:
     int start
@@ -61,6 +68,10 @@ cdef extern from "intervaldb.h":
     SublistHeader *subheader
     SubheaderFile subheader_file
     FILE *ifile_idb
+    int is_compressed
+    int is_mapped
+    IntervalMap *im_map
+    SublistHeader *subheader_map
 
   ctypedef struct IntervalIterator:
     pass
@@ -72,6 +83,31 @@ cdef extern from "intervaldb.h":
     int ihead
     char *filename
 
+  ctypedef struct FilePoolStats:
+    int nfiles
+    int nopen
+    int max_open
+    long long reopens
+
+  ctypedef struct BuildFile:
+    pass
+
+  ctypedef struct BlockCacheStats:
+    long long hits
+    long long misses
+    long long evictions
+    int nblocks
+    long size
+    long max_size
+
+  ctypedef struct GroupInterval:
+    IntervalCoord start
+    IntervalCoord end
+    IntervalCoord target_start
+    IntervalCoord target_end
+    int ival
+    int clip
+
 
 
   int imstart_qsort_cmp(void *void_a,void *void_b)
@@ -83,16 +119,39 @@ cdef extern from "intervaldb.h":
   IntervalIterator *interval_iterator_alloc() except NULL
   int free_interval_iterator(IntervalIterator *it)
   IntervalIterator *reset_interval_iterator(IntervalIterator *it)
-  int find_intervals(IntervalIterator *it0,int start,int end,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) except -1
+  int find_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) except -1
+  int find_intervals_batch(int nquery,IntervalCoord starts[],IntervalCoord ends[],IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalDBFile *db_file,IntervalMap **p_buf,int *p_nbuf,int offsets[])
+  int interval_coverage(IntervalMap hits[],int nhit,IntervalCoord start,IntervalCoord end,int binsize,int depth[])
+  int find_coverage(IntervalCoord start,IntervalCoord end,int binsize,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalDBFile *db_file,int depth[])
+  int group_sequences(IntervalMap ivals[],int n,int nseq,int sourceOnly,int indelCut,int minAligned,double pMinAligned,GroupInterval **p_result)
   char *write_binary_files(IntervalMap im[],int n,int ntop,int div,SublistHeader *subheader,int nlists,char filestem[])
-  IntervalDBFile *read_binary_files(char filestem[],char err_msg[],int subheader_nblock) except NULL
+  char *build_binary_files_external(char buildfile[],int n,int div,long max_memory,char filestem[])
+  int compress_binary_files(char filestem[],char err_msg[])
+  int append_intervals(char filestem[],IntervalMap im[],int n,char err_msg[])
+  int write_compaction_file(char filestem[],char buildfile[],int *p_format,char err_msg[])
+  IntervalDBFile *read_binary_files(char filestem[],char err_msg[],int subheader_nblock)
+  int read_delta_file(IntervalDBFile *db_file,char filestem[],char err_msg[])
   int free_interval_dbfile(IntervalDBFile *db_file)
-  int find_file_intervals(IntervalIterator *it0,int start,int end,IntervalIndex ii[],int nii,SublistHeader subheader[],int nlists,SubheaderFile *subheader_file,int ntop,int div,FILE *ifile,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) except -1
+  int mmap_binary_files(IntervalDBFile *db_file,char filestem[],char err_msg[])
+  int find_dbfile_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,IntervalDBFile *db_file,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) except -1
+  int find_file_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,IntervalIndex ii[],int nii,SublistHeader subheader[],int nlists,SubheaderFile *subheader_file,int ntop,int div,FILE *ifile,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) except -1
   int write_padded_binary(IntervalMap im[],int n,int div,FILE *ifile)
   int read_imdiv(FILE *ifile,IntervalMap imdiv[],int div,int i_div,int ntop)
   int save_text_file(char filestem[],char basestem[],char err_msg[],FILE *ofile)
   int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
+  int c_set_sort_threads "set_sort_threads" (int nthreads)
+  long c_set_block_cache_size "set_block_cache_size" (long max_size)
+  void c_get_block_cache_stats "get_block_cache_stats" (BlockCacheStats *stats)
+  void c_clear_block_cache "clear_block_cache" ()
+  int c_set_file_pool_size "set_file_pool_size" (int max_open)
+  void c_get_file_pool_stats "get_file_pool_stats" (FilePoolStats *stats)
+  int c_file_pool_after_fork "file_pool_after_fork" ()
+  BuildFile *open_build_file(char filename[],char mode[],char err_msg[])
+  int write_build_file(BuildFile *bf,IntervalMap im[],int n)
+  int close_build_file(BuildFile *bf)
   int C_int_max
+  int IDB_FORMAT_PACKED
+  IntervalCoord C_coord_max
 
 
 
@@ -104,15 +163,25 @@ cdef extern from "apps/maf2nclist.h":
     char *id
     int length
     int ns_id
-    int offset
+    IntervalCoord offset
     int nlmsa_id
 
+  int INPUT_PLAIN
+  int INPUT_GZIP
+  int input_file_compression(char filename[])
+  FILE *open_input_file(char filename[],int *p_is_pipe,char err_msg[])
+  int close_input_file(FILE *ifile,int is_pipe)
   int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
-                    int lpoStart,int *p_block_len,FILE *ifile,int maxseq,
+                    IntervalCoord lpoStart,int *p_block_len,FILE *ifile,int maxseq,
                     long long linecode_count[],int *p_has_continuation)
   int read_axtnet(IntervalMap im[], SeqIDMap seqidmap[], int nseq,
                   FILE *ifile, int maxseq, int *isrc, char *src_prefix,
                   char *dest_prefix)
+  long long find_maf_block_start(char filename[],long long offset,char err_msg[])
+  int write_maf_blocks(char filename[],long long start,long long end,
+                       SeqIDMap seqidmap[],int nseq,FILE *ofile,int maxseq,
+                       long long linecode_count[],char err_msg[])
+  int read_maf_block(FILE *ifile,IntervalMap im[],int maxseq,int *p_block_len)
   int seqnameID_qsort_cmp(void *void_a,void *void_b)
   int seqidmap_qsort_cmp(void *void_a,void *void_b)
 
@@ -127,32 +196,39 @@ cdef class IntervalDB:
   cdef SublistHeader *subheader
 
 
+cdef class IntervalMapBuffer:
+  cdef IntervalMap *im
+  cdef int n
+
 cdef class IntervalDBIterator:
   cdef IntervalIterator *it,*it_alloc
   cdef IntervalMap im_buf[1024]
-  cdef int ihit,nhit,start,end
+  cdef int ihit,nhit
+  cdef IntervalCoord start,end
   cdef IntervalDB db
 
   cdef int cnext(self)
 
 cdef class IntervalFileDB:
   cdef IntervalDBFile *db
+  cdef readonly object filestem
 
 cdef class NLMSASequence
 
 cdef class IntervalFileDBIterator:
   cdef IntervalIterator *it,*it_alloc
   cdef IntervalMap *im_buf
-  cdef int ihit,nhit,start,end,nbuf
+  cdef int ihit,nhit,nbuf
+  cdef IntervalCoord start,end
   cdef IntervalFileDB db
   cdef IntervalDB idb
 
-  cdef int restart(self,int start,int end,IntervalFileDB db,NLMSASequence ns) except -2
+  cdef int restart(self,IntervalCoord start,IntervalCoord end,IntervalFileDB db,NLMSASequence ns) except -2
   cdef int reset(self) except -2
   cdef int cnext(self,int *pkeep)
   cdef int extend(self,int ikeep)
-  cdef int saveInterval(self,int start,int end,int target_id,
-                        int target_start,int target_end)
+  cdef int saveInterval(self,IntervalCoord start,IntervalCoord end,int target_id,
+                        IntervalCoord target_start,IntervalCoord target_end)
   cdef int nextBlock(self,int *pkeep) except -2
   cdef IntervalMap *getIntervalMap(self)
   cdef int loadAll(self) except -1
@@ -169,56 +245,92 @@ cdef class NLMSA:
   cdef int do_build
   cdef readonly object lpoList,maxLPOcoord
   cdef int lpo_id
-  cdef readonly int maxlen,inlmsa,is_bidirectional,pairwiseMode,in_memory_mode
+  cdef readonly IntervalCoord maxlen
+  cdef readonly int inlmsa,is_bidirectional,pairwiseMode,in_memory_mode
+  cdef readonly int useMmap
+  cdef readonly int nWorkers
+  cdef readonly object maxMemory
+  cdef readonly int compress
+  cdef readonly int appendMode
+  cdef readonly object indexCache
+  cdef readonly object projections
   cdef public object _persistent_id,_ignoreShadowAttr,__doc__,_saveLocalBuild
   cdef public object inverseDB
 
   cdef void free_seqidmap(self,int nseq0,SeqIDMap *seqidmap)
   cdef void save_nbuild(self,int nbuild[])
+  cdef int save_maf_block(self,IntervalMap im[],int n,int block_len,
+                          int maxint,SeqIDMap seqidmap[],
+                          BuildFile *build_ifile[],int nbuild[]) except -1
   cdef NLMSASequence add_seqidmap_to_union(self,int j,SeqIDMap seqidmap[],
-                                           NLMSASequence ns,FILE *build_ifile[],
+                                           NLMSASequence ns,
+                                           BuildFile *build_ifile[],
                                            int nbuild[])
 
 cdef class NLMSASequence:
-  cdef readonly int id,length,nbuild,is_lpo,is_union
+  cdef readonly int id,nbuild,is_lpo,is_union
+  cdef readonly IntervalCoord length
   cdef readonly object offset
   cdef readonly object seq
   cdef readonly object name
   cdef IntervalFileDB db
   cdef IntervalDB idb
-  cdef FILE *build_ifile
+  cdef BuildFile *build_ifile
   cdef readonly object filestem
   cdef readonly NLMSA nlmsaLetters
-  cdef readonly object buildList
+  cdef IntervalMap *build_im
+  cdef int build_n,build_nalloc
   
-  cdef int saveInterval(self,IntervalMap im[],int n,int expand_self,FILE *ifile)
+  cdef int saveInterval(self,IntervalMap im[],int n,int expand_self,
+                        BuildFile *ifile) except -1
+  cdef int saveInMemory(self,IntervalMap im[],int n) except -1
+  cdef BuildFile *get_build_file(self) except NULL
 
 cdef class NLMSASlice:
-  cdef readonly int start,stop,id
-  cdef int n,nseqBounds,nrealseq,offset
+  cdef readonly IntervalCoord start,stop
+  cdef readonly int id
+  cdef int n,nseqBounds,nrealseq
+  cdef IntervalCoord offset
   cdef IntervalMap *im
   cdef IntervalMap *seqBounds
   cdef readonly NLMSASequence nlmsaSequence
   cdef readonly NLMSA nlmsa
   cdef readonly object seq
   cdef object weakestLink
-
+  cdef IntervalFileDBIterator lpoHits
+
+  cdef IntervalFileDBIterator join_lpo(self,IntervalFileDBIterator it,
+                                       IntervalFileDBIterator out,targets)
+  cdef int finish_join(self,IntervalFileDBIterator it,IntervalFileDBIterator it2,
+                       NLMSASlice coveringSlice) except -1
+  cdef int join_all(self) except -1
+  cdef NLMSASlice target_slice(self,seqs)
   cdef int findSeqBounds(self,int id,int ori)
-  cdef object get_seq_interval(self, NLMSA nl, int targetID, int start, int stop)
+  cdef object get_seq_interval(self, NLMSA nl, int targetID, IntervalCoord start,
+                               IntervalCoord stop)
 
 cdef class NLMSASliceLetters:
   cdef readonly NLMSASlice nlmsaSlice
 
 
+cdef class NLMSASliceBatch:
+  cdef readonly NLMSA nlmsa
+  cdef int useGetitem,icluster,iresult
+  cdef object clusters,results
+
+  cdef int load_cluster(self) except -1
+
+
 cdef class NLMSANode:
-  cdef readonly int id,ipos
+  cdef readonly IntervalCoord id,ipos
   cdef int istart,istop,n
   cdef readonly NLMSASlice nlmsaSlice
 
-  cdef int check_edge(self,int iseq,int ipos)
+  cdef int check_edge(self,int iseq,IntervalCoord ipos)
 
 
 cdef class NLMSASliceIterator:
-  cdef int ipos,istart,istop
+  cdef IntervalCoord ipos
+  cdef int istart,istop
   cdef NLMSASlice nlmsaSlice
 
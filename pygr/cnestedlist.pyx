@@ -2,8 +2,290 @@ import sequence
 import nlmsa_utils
 import logger
 
+if sizeof(IntervalCoord)==sizeof(int): # array.array TYPECODE FOR COORDINATES
+  coord_typecode='i'
+else: # 64 BIT COORDINATE BUILD
+  coord_typecode='l'
+
+cdef object int_array_copy(int *p,int n):
+  'copy C int array p[0:n] into a new array.array of typecode i'
+  import array
+  if n>0:
+    return array.array('i',PyString_FromStringAndSize(<char *>p,n*sizeof(int)))
+  return array.array('i')
+
+cdef SeqIDMap *new_seqidmap(seqLengths) except NULL:
+  'make SeqIDMap array from list of (id,length), sorted by id for lookup'
+  cdef int i,n
+  cdef SeqIDMap *seqidmap
+  n=len(seqLengths)
+  seqidmap=<SeqIDMap *>calloc(n+1,sizeof(SeqIDMap)) # ALLOCATE ARRAY
+  if seqidmap==NULL:
+    raise MemoryError('unable to allocate seqidmap[%d]' % n)
+  i=0
+  for pythonStr,length in seqLengths:
+    seqidmap[i].id=strdup(pythonStr)
+    try:
+      seqidmap[i].length = length
+    except OverflowError:
+      raise OverflowError('''Sequence too long for 32 bit int: %s, %d
+Something is probably wrong with creation / reading of this sequence.
+Check the input!''' % (pythonStr, length))
+    i=i+1
+  qsort(seqidmap,n,sizeof(SeqIDMap),seqidmap_qsort_cmp) # SORT BY id
+  return seqidmap
+
+cdef void free_seqidmap_array(int nseq,SeqIDMap *seqidmap):
+  'free SeqIDMap array made by new_seqidmap()'
+  cdef int i
+  for i from 0 <= i <nseq: # DUMP STRING STORAGE FOR SEQUENCE IDENTIFIERS
+    free(seqidmap[i].id)
+  free(seqidmap) # WE CAN NOW FREE THE SEQUENCE LOOKUP ARRAY
+
+cdef object coord_array_copy(IntervalCoord *p,int n):
+  'copy C IntervalCoord array p[0:n] into a new array.array of coord_typecode'
+  import array
+  if n>0:
+    return array.array(coord_typecode,
+                       PyString_FromStringAndSize(<char *>p,
+                                                  n*sizeof(IntervalCoord)))
+  return array.array(coord_typecode)
+
+cdef object interval_columns(IntervalMap *im,int n):
+  '''copy im[0:n] into arrays (srcStart,srcEnd,targetID,targetStart,
+  targetEnd,ori), with coordinates on the forward strand of each sequence
+  and ori -1 where source and target have opposite orientation'''
+  cdef int i,*ids,*ori
+  cdef IntervalCoord *c
+  c=<IntervalCoord *>malloc((4*n+1)*sizeof(IntervalCoord))
+  ids=<int *>malloc((2*n+1)*sizeof(int))
+  try:
+    if c==NULL or ids==NULL:
+      raise MemoryError('out of memory')
+    ori=ids+n
+    for i from 0 <= i < n:
+      ori[i]=1
+      ids[i]=im[i].target_id
+      if im[i].start<0: # SOURCE ON REVERSE STRAND
+        c[i]= -(im[i].end)
+        c[n+i]= -(im[i].start)
+        ori[i]= -1
+      else:
+        c[i]=im[i].start
+        c[n+i]=im[i].end
+      if im[i].target_start<0: # TARGET ON REVERSE STRAND
+        c[2*n+i]= -(im[i].target_end)
+        c[3*n+i]= -(im[i].target_start)
+        ori[i]= -ori[i]
+      else:
+        c[2*n+i]=im[i].target_start
+        c[3*n+i]=im[i].target_end
+    result=(coord_array_copy(c,n),coord_array_copy(c+n,n),
+            int_array_copy(ids,n),coord_array_copy(c+2*n,n),
+            coord_array_copy(c+3*n,n),int_array_copy(ori,n))
+  finally:
+    free(c)
+    free(ids)
+  return result
+
+cdef object batch_overlap_query(IntervalDB idb,IntervalFileDB db,starts,ends):
+  'run a batch of queries against idb or db, return (hits,offsets)'
+  cdef int i,nquery,nhit,nbuf,target_id,*offsets
+  cdef IntervalCoord start,end,target_start,target_end
+  cdef IntervalCoord *p_start,*p_end,*hits
+  cdef Py_ssize_t len_start,len_end
+  cdef IntervalMap *buf
+  PyObject_AsReadBuffer(starts,<const_void **>&p_start,&len_start)
+  PyObject_AsReadBuffer(ends,<const_void **>&p_end,&len_end)
+  if len_start!=len_end or len_start%sizeof(IntervalCoord)!=0:
+    raise ValueError('starts and ends must be arrays of typecode %s of the same length'
+                     % coord_typecode)
+  nquery=len_start/sizeof(IntervalCoord)
+  offsets=<int *>malloc((nquery+1)*sizeof(int))
+  if offsets==NULL:
+    raise MemoryError('unable to allocate offsets[%d]' % (nquery+1))
+  buf=NULL
+  nbuf=0
+  if idb is not None: # IN-MEMORY DATABASE
+    nhit=find_intervals_batch(nquery,p_start,p_end,idb.im,idb.ntop,
+                              idb.subheader,idb.nlists,NULL,
+                              &buf,&nbuf,offsets)
+  else: # ON-DISK DATABASE
+    nhit=find_intervals_batch(nquery,p_start,p_end,NULL,0,NULL,0,db.db,
+                              &buf,&nbuf,offsets)
+  if nhit<0:
+    free(offsets)
+    if buf:
+      free(buf)
+    raise MemoryError('out of memory')
+  hits=<IntervalCoord *>buf # PACK 5 COORDS PER HIT IN PLACE, DROPPING sublist
+  for i from 0 <= i < nhit:
+    start=buf[i].start
+    end=buf[i].end
+    target_id=buf[i].target_id
+    target_start=buf[i].target_start
+    target_end=buf[i].target_end
+    hits[5*i]=start
+    hits[5*i+1]=end
+    hits[5*i+2]=target_id
+    hits[5*i+3]=target_start
+    hits[5*i+4]=target_end
+  try:
+    result=(coord_array_copy(hits,5*nhit),int_array_copy(offsets,nquery+1))
+  finally:
+    free(offsets)
+    free(buf)
+  return result
+
+cdef IntervalMapBuffer overlap_buffer_query(IntervalDB idb,IntervalFileDB db,
+                                            IntervalCoord start,
+                                            IntervalCoord end):
+  'run one query against idb or db, returning its hits as IntervalMapBuffer'
+  cdef int nhit,nbuf,offsets[2]
+  cdef IntervalMap *buf,*im
+  cdef IntervalMapBuffer result
+  buf=NULL
+  nbuf=0
+  if idb is not None: # IN-MEMORY DATABASE
+    nhit=find_intervals_batch(1,&start,&end,idb.im,idb.ntop,idb.subheader,
+                              idb.nlists,NULL,&buf,&nbuf,offsets)
+  else: # ON-DISK DATABASE
+    nhit=find_intervals_batch(1,&start,&end,NULL,0,NULL,0,db.db,
+                              &buf,&nbuf,offsets)
+  if nhit<0:
+    if buf:
+      free(buf)
+    raise MemoryError('out of memory')
+  result=IntervalMapBuffer()
+  if nhit>0: # COMPACT TO FINAL SIZE AND HAND STORAGE TO result
+    im=<IntervalMap *>realloc(buf,nhit*sizeof(IntervalMap))
+    if im==NULL: # KEEP THE LARGER BUFFER
+      im=buf
+    result.im=im
+    result.n=nhit
+  else:
+    free(buf)
+  return result
+
+cdef int array_buffer(a,int itemsize,void **p,name) except -1:
+  'get pointer to the data of array a (e.g. array.array), return its #items'
+  cdef Py_ssize_t nbytes
+  PyObject_AsReadBuffer(a,<const_void **>p,&nbytes)
+  if nbytes%itemsize!=0:
+    raise ValueError('%s must be an array of %d byte items' % (name,itemsize))
+  return nbytes/itemsize
+
+cdef int save_lpo_interval(IntervalMap *im,BuildFile *ifile,int *p_nbuild,
+                           IntervalCoord *p_length) except -1:
+  'write one interval to an LPO .build file, expanding the LPO length'
+  if write_build_file(ifile,im,1)!=1:
+    raise IOError('error writing build file! out of disk space?')
+  p_nbuild[0]=p_nbuild[0]+1
+  if im.start>=0:
+    if im.end>p_length[0]:
+      p_length[0]=im.end
+  elif -(im.start)>p_length[0]:
+    p_length[0]= -(im.start) # THIS HANDLES NEGATIVE ORI CASE
+  return 0
+
+cdef int save_projection_interval(BuildFile *ifile,t) except -1:
+  'write one (start,end,target_id,target_start,target_end) to a .build file'
+  cdef IntervalMap im
+  im.start,im.end,im.target_id,im.target_start,im.target_end=t
+  im.sublist= -1
+  if write_build_file(ifile,&im,1)!=1:
+    raise IOError('error writing build file! out of disk space?')
+  return 0
+
+cdef int coverage_nbin(IntervalCoord start,IntervalCoord end,
+                       int binsize) except -1:
+  'get #bins of binsize positions needed to cover [start,end)'
+  if binsize<=0:
+    raise ValueError('binsize must be > 0')
+  if end<start:
+    raise ValueError('end must be >= start')
+  return (end-start+binsize-1)/binsize
+
+cdef object coverage_query(IntervalDB idb,IntervalFileDB db,
+                           IntervalCoord start,IntervalCoord end,int binsize):
+  'get coverage of [start,end) by the hits in idb or db, as array.array i'
+  cdef int nbin,nhit,*depth
+  nbin=coverage_nbin(start,end,binsize)
+  depth=<int *>calloc(nbin+1,sizeof(int)) # ZEROED, AS find_coverage ADDS TO IT
+  if depth==NULL:
+    raise MemoryError('unable to allocate depth[%d]' % nbin)
+  if idb is not None: # IN-MEMORY DATABASE
+    nhit=find_coverage(start,end,binsize,idb.im,idb.ntop,idb.subheader,
+                       idb.nlists,NULL,depth)
+  else: # ON-DISK DATABASE
+    nhit=find_coverage(start,end,binsize,NULL,0,NULL,0,db.db,depth)
+  try:
+    if nhit<0:
+      raise MemoryError('out of memory')
+    result=int_array_copy(depth,nbin)
+  finally:
+    free(depth)
+  return result
+
+
+cdef class IntervalMapBuffer:
+  '''read-only array of interval hits, exposed through the buffer protocol
+  without creating a Python object per hit.  Each record is the C
+  IntervalMap struct (start,end,target_id,target_start,target_end,sublist),
+  where sublist is internal and can be ignored.  Its layout is given by
+  fields, formats, offsets and itemsize, e.g.
+  numpy.frombuffer(buf,dtype=dict(names=buf.fields,formats=buf.formats,
+                   offsets=buf.offsets,itemsize=buf.itemsize))'''
+  property fields:
+    def __get__(self):
+      return ('start','end','target_id','target_start','target_end','sublist')
+  property formats:
+    def __get__(self):
+      coord='i%d' % sizeof(IntervalCoord)
+      i='i%d' % sizeof(int)
+      return [coord,coord,i,coord,coord,i]
+  property offsets:
+    def __get__(self):
+      cdef IntervalMap im
+      cdef long base
+      base=<long>&im
+      return [<long>&im.start-base,<long>&im.end-base,<long>&im.target_id-base,
+              <long>&im.target_start-base,<long>&im.target_end-base,
+              <long>&im.sublist-base]
+  property itemsize:
+    def __get__(self):
+      return sizeof(IntervalMap)
+
+  def __len__(self):
+    return self.n
+
+  def __getitem__(self,int i):
+    'get hit i as a tuple (start,end,target_id,target_start,target_end)'
+    if i<0: # HANDLE NEGATIVE INDEX
+      i=i+self.n
+    if i<0 or i>=self.n:
+      raise IndexError('index out of range')
+    return (self.im[i].start,self.im[i].end,self.im[i].target_id,
+            self.im[i].target_start,self.im[i].target_end)
+
+  def __getsegcount__(self,Py_ssize_t *p):
+    if p!=NULL:
+      p[0]=self.n*sizeof(IntervalMap)
+    return 1
+
+  def __getreadbuffer__(self,Py_ssize_t i,void **p):
+    if i!=0:
+      raise SystemError('accessing non-existent buffer segment')
+    p[0]=<void *>self.im
+    return self.n*sizeof(IntervalMap)
+
+  def __dealloc__(self):
+    'remember: dealloc cannot call other methods!'
+    if self.im:
+      free(self.im)
+
 cdef class IntervalDBIterator:
-  def __new__(self,int start,int end,IntervalDB db not None):
+  def __new__(self,IntervalCoord start,IntervalCoord end,IntervalDB db not None):
     self.it=interval_iterator_alloc()
     self.it_alloc=self.it
     self.start=start
@@ -108,11 +390,11 @@ cdef class IntervalDB:
     self.im=im_new
     self.runBuildMethod(**kwargs)
 
-  def find_overlap(self,int start,int end):
+  def find_overlap(self,IntervalCoord start,IntervalCoord end):
     self.check_nonempty() # RAISE EXCEPTION IF NO DATA
     return IntervalDBIterator(start,end,self)
 
-  def find_overlap_list(self,int start,int end):
+  def find_overlap_list(self,IntervalCoord start,IntervalCoord end):
     cdef int i,nhit
     cdef IntervalIterator *it,*it_alloc
     cdef IntervalMap im_buf[1024]
@@ -128,6 +410,32 @@ cdef class IntervalDB:
         l.append((im_buf[i].start,im_buf[i].end,im_buf[i].target_id,im_buf[i].target_start,im_buf[i].target_end))
     free_interval_iterator(it_alloc)
     return l
+
+  def find_overlaps_batch(self,starts,ends):
+    '''find overlaps for many queries in one call.  starts, ends must be
+    coordinate arrays (e.g. array.array(coord_typecode)).  Queries sorted
+    by start with start>=0 are answered in a single sweep of each nested
+    list, if it is in memory or memory-mapped; otherwise each query is
+    searched separately.  Returns (hits,offsets): hits is an array of
+    typecode coord_typecode holding 5 values (start,end,target_id,
+    target_start,target_end) per hit, and offsets is an array.array('i');
+    the hits for query i are records offsets[i]:offsets[i+1]'''
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    return batch_overlap_query(self,None,starts,ends)
+
+  def find_overlap_buffer(self,IntervalCoord start,IntervalCoord end):
+    '''like find_overlap_list(), but return the hits as a single
+    IntervalMapBuffer, readable via the buffer protocol'''
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    return overlap_buffer_query(self,None,start,end)
+
+  def coverage(self,IntervalCoord start,IntervalCoord end,int binsize=1):
+    '''get the coverage of [start,end) as array.array('i'), one entry per
+    binsize positions.  Each entry is the depth (#intervals covering a
+    position) summed over the positions in its bin, so with binsize=1
+    it is just the depth at each position'''
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    return coverage_query(self,None,start,end,binsize)
         
   def check_nonempty(self):
     if self.im:
@@ -136,12 +444,18 @@ cdef class IntervalDB:
       msg='empty IntervalDB, not searchable!'
       raise IndexError(msg)
 
-  def write_binaries(self,filestem,div=256):
+  def write_binaries(self,filestem,div=256,compress=False):
+    '''save as IntervalFileDB files for filestem.  If compress is True,
+    the .idb file is stored as delta-encoded blocks of div intervals,
+    which is several times smaller but cannot be memory-mapped'''
     cdef char *err_msg
+    cdef char errbuf[1024]
     err_msg=write_binary_files(self.im,self.n,self.ntop,div,
                                self.subheader,self.nlists,filestem)
     if err_msg:
       raise IOError(err_msg)
+    if compress and compress_binary_files(filestem,errbuf)<0:
+      raise IOError(errbuf)
 
   def __dealloc__(self):
     'remember: dealloc cannot call other methods!'
@@ -163,7 +477,7 @@ cdef class IntervalDB:
 
 
 cdef class IntervalFileDBIterator:
-  def __new__(self,int start,int end,IntervalFileDB db=None,
+  def __new__(self,IntervalCoord start,IntervalCoord end,IntervalFileDB db=None,
               NLMSASequence ns=None,
               int nbuffer=1024,rawIvals=None):
     cdef int i
@@ -184,7 +498,7 @@ cdef class IntervalFileDBIterator:
         i=i+1
       self.nhit=i # TOTAL NUMBER OF INTERVALS STORED
 
-  cdef int restart(self,int start,int end,IntervalFileDB db,
+  cdef int restart(self,IntervalCoord start,IntervalCoord end,IntervalFileDB db,
                    NLMSASequence ns) except -2:
     'reuse this iterator for another search without reallocing memory'
     self.nhit=0 # FLUSH ANY EXISTING DATA
@@ -196,6 +510,8 @@ cdef class IntervalFileDBIterator:
         self.idb=ns.idb
       elif ns.db is None:
         ns.forceLoad()
+      elif ns.nlmsaLetters.indexCache is not None: # MARK IT RECENTLY USED
+        ns.nlmsaLetters.indexCache.touch(ns)
       self.db=ns.db
     self.it=self.it_alloc # REUSE OUR CURRENT ITERATOR
     reset_interval_iterator(self.it) # RESET IT FOR REUSE
@@ -223,8 +539,8 @@ cdef class IntervalFileDBIterator:
       self.nbuf=2*self.nbuf
     return istart # RETURN START OF EMPTY BLOCK WHERE WE CAN ADD NEW DATA
 
-  cdef int saveInterval(self,int start,int end,int target_id,
-                        int target_start,int target_end):
+  cdef int saveInterval(self,IntervalCoord start,IntervalCoord end,int target_id,
+                        IntervalCoord target_start,IntervalCoord target_end):
     'save an interval, expanding array if necessary'
     cdef int i
     if self.nhit>=self.nbuf: # EXPAND ARRAY IF NECESSARY
@@ -247,15 +563,10 @@ cdef class IntervalFileDBIterator:
       i=self.extend(pkeep[0]) # MOVE SLICE TO THE FRONT
     else: # WE CAN USE THE WHOLE BUFFER
       i=0
-    if self.db is not None: # ON-DISK DATABASE
-      find_file_intervals(self.it,self.start,self.end,
-                          self.db.db[0].ii,self.db.db[0].nii,
-                          self.db.db[0].subheader,self.db.db[0].nlists,
-                          &(self.db.db[0].subheader_file),
-                          self.db.db[0].ntop,self.db.db[0].div,
-                          self.db.db[0].ifile_idb,
-                          self.im_buf+i,self.nbuf-i,
-                          &(self.nhit),&(self.it)) # GET NEXT BUFFER CHUNK
+    if self.db is not None: # ON-DISK DATABASE, POSSIBLY MEMORY-MAPPED
+      find_dbfile_intervals(self.it,self.start,self.end,self.db.db,
+                            self.im_buf+i,self.nbuf-i,
+                            &(self.nhit),&(self.it)) # GET NEXT BUFFER CHUNK
     elif self.idb is not None: # IN-MEMORY DATABASE
       find_intervals(self.it,self.start,self.end,self.idb.im,self.idb.ntop,
                      self.idb.subheader,self.idb.nlists,self.im_buf+i,self.nbuf-i,
@@ -369,21 +680,29 @@ cdef class IntervalFileDBIterator:
 
       
 cdef class IntervalFileDB:
-  def __new__(self,filestem=None,mode='r'):
+  def __new__(self,filestem=None,mode='r',useMmap=False):
     if filestem is not None and mode=='r':
-      self.open(filestem)
+      self.open(filestem,useMmap)
 
-  def open(self,filestem):
+  def open(self,filestem,useMmap=False):
+    '''open the binary index files for filestem.  If useMmap is True,
+    the .idb and .subhead files are memory-mapped read-only and searched
+    in place, instead of being read block by block'''
     cdef char err_msg[1024]
     self.db=read_binary_files(filestem,err_msg,1024)
     if self.db==NULL:
       raise IOError(err_msg)
+    if useMmap and mmap_binary_files(self.db,filestem,err_msg)<0:
+      free_interval_dbfile(self.db)
+      self.db=NULL
+      raise IOError(err_msg)
+    self.filestem=filestem
 
-  def find_overlap(self,int start,int end):
+  def find_overlap(self,IntervalCoord start,IntervalCoord end):
     self.check_nonempty() # RAISE EXCEPTION IF NO DATA
     return IntervalFileDBIterator(start,end,self)
 
-  def find_overlap_list(self,int start,int end):
+  def find_overlap_list(self,IntervalCoord start,IntervalCoord end):
     cdef int i,nhit
     cdef IntervalIterator *it,*it_alloc
     cdef IntervalMap im_buf[1024]
@@ -392,22 +711,75 @@ cdef class IntervalFileDB:
     it_alloc=it
     l=[] # LIST OF RESULTS TO HAND BACK
     while it:
-      find_file_intervals(it,start,end,self.db[0].ii,self.db[0].nii,
-                          self.db[0].subheader,self.db[0].nlists,
-                          &(self.db[0].subheader_file),
-                          self.db[0].ntop,self.db[0].div,
-                          self.db[0].ifile_idb,im_buf,1024,
-                          &(nhit),&(it)) # GET NEXT BUFFER CHUNK
+      find_dbfile_intervals(it,start,end,self.db,im_buf,1024,
+                            &(nhit),&(it)) # GET NEXT BUFFER CHUNK
       for i from 0 <= i < nhit:
         l.append((im_buf[i].start,im_buf[i].end,im_buf[i].target_id,
                   im_buf[i].target_start,im_buf[i].target_end))
     free_interval_iterator(it_alloc)
     return l
 
+  def find_overlaps_batch(self,starts,ends):
+    'find overlaps for many queries in one pass; see IntervalDB.find_overlaps_batch'
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    return batch_overlap_query(None,self,starts,ends)
+
+  def find_overlap_buffer(self,IntervalCoord start,IntervalCoord end):
+    'return the hits as an IntervalMapBuffer; see IntervalDB.find_overlap_buffer'
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    return overlap_buffer_query(None,self,start,end)
+
+  def coverage(self,IntervalCoord start,IntervalCoord end,int binsize=1):
+    'get coverage of [start,end); see IntervalDB.coverage'
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    return coverage_query(None,self,start,end,binsize)
+
   def check_nonempty(self):
     if self.db==NULL:
       raise IndexError('empty IntervalFileDB, not searchable!')
 
+  def append_intervals(self,ivals):
+    '''append ivals, a list of tuples (start,end,target_id,target_start,
+    target_end), to the .delta file of this database without rebuilding
+    its index.  Queries find them at once; compact() merges them into the
+    index.  Returns the #intervals appended'''
+    cdef int i,n
+    cdef IntervalMap *im
+    cdef char *filestem
+    cdef char err_msg[1024]
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    n=len(ivals)
+    if n==0:
+      return 0
+    filestem=self.filestem
+    im=interval_map_alloc(n)
+    try:
+      i=0
+      for t in ivals:
+        im[i].start,im[i].end,im[i].target_id,im[i].target_start, \
+                     im[i].target_end=t
+        im[i].sublist= -1
+        i=i+1
+      if append_intervals(filestem,im,n,err_msg)<0:
+        raise IOError(err_msg)
+    finally:
+      free(im)
+    if read_delta_file(self.db,filestem,err_msg)<0: # LOAD THE NEW DELTA
+      raise IOError(err_msg)
+    return n
+
+  def compact(self,maxMemory=None,compress=None):
+    '''merge appended intervals into the index files, and reopen them.
+    See compact_index_files()'''
+    cdef int useMmap
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    useMmap=self.db.is_mapped
+    filestem=self.filestem
+    self.close()
+    n=compact_index_files(filestem,maxMemory,compress)
+    self.open(filestem,useMmap)
+    return n
+
   def close(self):
     if self.db:
       free_interval_dbfile(self.db)
@@ -442,13 +814,12 @@ cdef class NLMSASliceLetters:
 
 
 cdef class NLMSASlice:
-  def __new__(self,NLMSASequence ns not None,int start,int stop,
-              int id= -1,int offset=0,seq=None):
-    cdef int i,j,n,start_max,end_min,start2,stop2,nseq,istart,istop,localQuery
-    cdef NLMSASequence ns_lpo
+  def __new__(self,NLMSASequence ns not None,IntervalCoord start,
+              IntervalCoord stop,int id= -1,IntervalCoord offset=0,seq=None,
+              IntervalFileDBIterator joinIt=None,
+              NLMSASlice coveringSlice=None,lazy=False):
+    cdef int i,n,localQuery,projected
     cdef IntervalFileDBIterator it,it2
-    cdef IntervalMap *im,*im2
-    cdef int cacheMax
 
     if seq is None: # GET FROM NLMSASequence
       seq=ns.seq
@@ -458,27 +829,43 @@ cdef class NLMSASlice:
     self.stop=stop
     self.offset=offset # ALWAYS STORE offset IN POSITIVE ORIENTATION
     self.seq=seq
-    try: # USE PYTHON METHOD TO DO QUERY
-      id,ivals=ns.nlmsaLetters.doSlice(seq) # doSlice() RETURNS RAW INTERVALS
-      self.id=id # SAVE OUR SEQUENCE'S nlmsa_id
-      it=IntervalFileDBIterator(start,stop,rawIvals=ivals) # STORE IN BINARY FMT
+    if joinIt is not None: # CALLER ALREADY DID THE JOIN, E.G. slice_many()
+      if id<0:
+        id=ns.id
+      self.id=id
+      it=joinIt
       it2=IntervalFileDBIterator(start,stop) # HOLDER FOR SUBSEQUENT MERGE
-      localQuery=0 # DO NOT PERFORM LOCAL QUERY CODE BELOW!!
-    except AttributeError:
-      localQuery=1
+      localQuery=0
+    else:
+      try: # USE PYTHON METHOD TO DO QUERY
+        id,ivals=ns.nlmsaLetters.doSlice(seq) # doSlice() RETURNS RAW INTERVALS
+        self.id=id # SAVE OUR SEQUENCE'S nlmsa_id
+        it=IntervalFileDBIterator(start,stop,rawIvals=ivals) # STORE IN BINARY FMT
+        it2=IntervalFileDBIterator(start,stop) # HOLDER FOR SUBSEQUENT MERGE
+        localQuery=0 # DO NOT PERFORM LOCAL QUERY CODE BELOW!!
+      except AttributeError:
+        localQuery=1
     if localQuery: ################################## PERFORM LOCAL QUERY
       if id<0:
         id=ns.id
       self.id=id
       it2=None
+      projected=0
       if start<0: # NEED TO TRANSLATE OFFSETS TO MINUS ORIENTATION
         offset= -offset
       if ns.nlmsaLetters.pairwiseMode==1: # TRANSLATE SEQ DIRECTLY TO LPO
         it=IntervalFileDBIterator(start,stop,rawIvals=((start,stop,ns.id-1,
                                                         start+offset,stop+offset),))
         n=1 # JUST THE SINGLE IDENTITY MAPPING FROM SEQ TO LPO
-      else: # PERFORM NORMAL SEQ --> LPO QUERY
-        it=IntervalFileDBIterator(start+offset,stop+offset,ns=ns)
+      else:
+        if not ns.is_lpo and id in ns.nlmsaLetters.projections:
+          # QUERY SEQ --> SEQ MAPPINGS SAVED BY build_projection(), NO JOIN
+          it=IntervalFileDBIterator(start,stop,
+                                    ns.nlmsaLetters.get_projection(id))
+          offset=0 # PROJECTION INDEX IS IN SRC SEQ COORDS
+          projected=1
+        else: # PERFORM NORMAL SEQ --> LPO QUERY
+          it=IntervalFileDBIterator(start+offset,stop+offset,ns=ns)
         n=it.loadAll() # GET ALL OVERLAPPING INTERVALS
         if n<=0:
           raise nlmsa_utils.EmptySliceError('this interval is not aligned!')
@@ -494,43 +881,79 @@ cdef class NLMSASlice:
                                      +start-it.im_buf[i].start
             it.im_buf[i].start=start
 
-      if not ns.is_lpo: # TARGET INTERVALS MUST BE LPO, MUST MAP TO REAL SEQUENCES
-        ns_lpo=ns.nlmsaLetters.seqlist[ns.nlmsaLetters.lpo_id] # DEFAULT LPO
-        for i from 0 <= i < n:
-          if it.im_buf[i].target_id != ns_lpo.id: # SWITCHING TO A DIFFERENT LPO?
-            ns_lpo=ns.nlmsaLetters.seqlist[it.im_buf[i].target_id]
-            if not ns_lpo.is_lpo:
-              raise ValueError('sequence mapped to non-LPO target??')
-          if it2 is None: # NEED TO ALLOCATE NEW ITERATOR
-            it2=IntervalFileDBIterator(it.im_buf[i].target_start,
-                                       it.im_buf[i].target_end,ns=ns_lpo)
-          else: # JUST REUSE THIS ITERATOR WITHOUT REALLOCING MEMORY
-            it2.restart(it.im_buf[i].target_start,
-                        it.im_buf[i].target_end,None,ns_lpo)
-          it2.loadAll() # GET ALL OVERLAPPING INTERVALS
-          if it2.nhit<=0: # NO HITS, SO TRY THE NEXT INTERVAL???
-            continue
-          im2=it2.im_buf # ARRAY FROM THIS ITERATOR
-          for j from 0 <= j < it2.nhit: # MAP EACH INTERVAL BACK TO ns
-            if it.im_buf[i].target_start>im2[j].start: # GET INTERSECTION INTERVAL
-              start_max=it.im_buf[i].target_start
-            else:
-              start_max=im2[j].start
-            if it.im_buf[i].target_end<im2[j].end:
-              end_min=it.im_buf[i].target_end
-            else:
-              end_min=im2[j].end
-            istart=it.im_buf[i].start+start_max-it.im_buf[i].target_start # SRC COORDS
-            istop=it.im_buf[i].start+end_min-it.im_buf[i].target_start
-            start2=im2[j].target_start+start_max-im2[j].start # COORDS IN TARGET
-            stop2=im2[j].target_start+end_min-im2[j].start
-            if im2[j].target_id!=id or istart!=start2 \
-                   or ns.nlmsaLetters.pairwiseMode==1: # DISCARD SELF-MATCH
-              it.saveInterval(istart,istop,im2[j].target_id,start2,stop2) # SAVE IT!
-            assert ns_lpo.id!=im2[j].target_id
+      if not ns.is_lpo and not projected: # MUST MAP LPO TO REAL SEQUENCES
+        if lazy: # JOIN LATER, ONLY FOR THE SEQUENCES ACTUALLY ASKED FOR
+          self.lpoHits=it
+          return
+        it2=self.join_lpo(it,it,None)
 
     if it.nhit<=0:
       raise nlmsa_utils.EmptySliceError('this interval is not aligned!')
+    self.finish_join(it,it2,coveringSlice)
+
+  cdef IntervalFileDBIterator join_lpo(self,IntervalFileDBIterator it,
+                                       IntervalFileDBIterator out,targets):
+    '''join the seq --> LPO intervals in it to the sequences aligned to
+    them, saving the results in out (which may be it).  If targets is
+    not None, only save intervals of the nlmsaIDs in targets.
+    Returns the iterator used to query the LPOs, for reuse'''
+    cdef int i,j,n,id
+    cdef IntervalCoord start_max,end_min,start2,stop2,istart,istop
+    cdef NLMSASequence ns,ns_lpo
+    cdef IntervalFileDBIterator it2
+    cdef IntervalMap *im2
+    ns=self.nlmsaSequence
+    id=self.id
+    n=it.nhit # JUST THE LPO INTERVALS, NOT RESULTS SAVED BELOW
+    it2=None
+    ns_lpo=ns.nlmsaLetters.seqlist[ns.nlmsaLetters.lpo_id] # DEFAULT LPO
+    for i from 0 <= i < n:
+      if it.im_buf[i].target_id != ns_lpo.id: # SWITCHING TO A DIFFERENT LPO?
+        ns_lpo=ns.nlmsaLetters.seqlist[it.im_buf[i].target_id]
+        if not ns_lpo.is_lpo:
+          raise ValueError('sequence mapped to non-LPO target??')
+      if it2 is None: # NEED TO ALLOCATE NEW ITERATOR
+        it2=IntervalFileDBIterator(it.im_buf[i].target_start,
+                                   it.im_buf[i].target_end,ns=ns_lpo)
+      else: # JUST REUSE THIS ITERATOR WITHOUT REALLOCING MEMORY
+        it2.restart(it.im_buf[i].target_start,
+                    it.im_buf[i].target_end,None,ns_lpo)
+      it2.loadAll() # GET ALL OVERLAPPING INTERVALS
+      if it2.nhit<=0: # NO HITS, SO TRY THE NEXT INTERVAL???
+        continue
+      im2=it2.im_buf # ARRAY FROM THIS ITERATOR
+      for j from 0 <= j < it2.nhit: # MAP EACH INTERVAL BACK TO ns
+        if targets is not None and im2[j].target_id not in targets:
+          continue
+        if it.im_buf[i].target_start>im2[j].start: # GET INTERSECTION INTERVAL
+          start_max=it.im_buf[i].target_start
+        else:
+          start_max=im2[j].start
+        if it.im_buf[i].target_end<im2[j].end:
+          end_min=it.im_buf[i].target_end
+        else:
+          end_min=im2[j].end
+        istart=it.im_buf[i].start+start_max-it.im_buf[i].target_start # SRC COORDS
+        istop=it.im_buf[i].start+end_min-it.im_buf[i].target_start
+        start2=im2[j].target_start+start_max-im2[j].start # COORDS IN TARGET
+        stop2=im2[j].target_start+end_min-im2[j].start
+        if im2[j].target_id!=id or istart!=start2 \
+               or ns.nlmsaLetters.pairwiseMode==1: # DISCARD SELF-MATCH
+          out.saveInterval(istart,istop,im2[j].target_id,start2,stop2) # SAVE IT!
+        assert ns_lpo.id!=im2[j].target_id
+    return it2
+
+  cdef int finish_join(self,IntervalFileDBIterator it,IntervalFileDBIterator it2,
+                       NLMSASlice coveringSlice) except -1:
+    '''take the joined intervals from it, sort them by start (longer
+    first), compute their seqBounds and save cache hints.  Other methods,
+    e.g. NLMSASliceBatch.load_cluster(), rely on self.im being sorted'''
+    cdef int i,n
+    cdef int cacheMax
+    cdef NLMSASequence ns
+    ns=self.nlmsaSequence
+    if it2 is None: # HOLDER FOR SUBSEQUENT MERGE
+      it2=IntervalFileDBIterator(self.start,self.stop)
     it2.copy(it) # COPY FULL SET OF SAVED INTERVALS
     self.nseqBounds=it2.mergeSeq() # MERGE TO ONE INTERVAL PER SEQUENCE ORIENTATION
     self.seqBounds=it2.getIntervalMap() # SAVE SORTED ARRAY & DETACH FROM ITERATOR
@@ -553,10 +976,13 @@ cdef class NLMSASlice:
       saveCache=ns.nlmsaLetters.seqDict.cacheHint
     except AttributeError:
       cacheMax=0 # TURN OFF CACHING
+    if coveringSlice is not None: # ITS CACHE HINTS ALREADY COVER US
+      self.weakestLink=coveringSlice.weakestLink # KEEP THEM ALIVE
+      cacheMax=0
     if cacheMax>0: # CONSTRUCT & SAVE DICT OF CACHE HINTS: COVERING INTERVALS
       cacheDict={}
       try: # ADD A CACHE HINT FOR QUERY SEQ IVAL
-        seqID=ns.nlmsaLetters.seqs.getSeqID(seq) # GET FULL-LENGTH ID
+        seqID=ns.nlmsaLetters.seqs.getSeqID(self.seq) # GET FULL-LENGTH ID
         cacheDict[seqID]=(self.start,self.stop)
       except KeyError:
         pass
@@ -567,6 +993,36 @@ cdef class NLMSASlice:
       if cacheDict:
         self.weakestLink = nlmsa_utils.SeqCacheOwner()
         saveCache(cacheDict, self.weakestLink) # SAVE COVERING IVALS AS CACHE HINT
+    return 0
+
+  cdef int join_all(self) except -1:
+    'do the deferred LPO join of a lazy slice, for all sequences'
+    cdef IntervalFileDBIterator it,it2
+    if self.lpoHits is None: # ALREADY JOINED
+      return 0
+    it=self.lpoHits
+    self.lpoHits=None
+    it2=self.join_lpo(it,it,None)
+    self.finish_join(it,it2,None)
+    return 0
+
+  cdef NLMSASlice target_slice(self,seqs):
+    '''get a slice of the same interval, joined only to the sequences in
+    seqs.  Sequences not in the alignment are ignored'''
+    cdef NLMSA nl
+    cdef IntervalFileDBIterator it
+    nl=self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
+    targets={}
+    for seq in seqs:
+      try:
+        targets[nl.seqs.getID(seq)]=None
+      except KeyError: # NOT IN OUR ALIGNMENT
+        pass
+    it=IntervalFileDBIterator(self.start,self.stop)
+    it.copy(self.lpoHits) # KEEP OUR LPO INTERVALS FOR LATER
+    self.join_lpo(it,it,targets)
+    return NLMSASlice(self.nlmsaSequence,self.start,self.stop,self.id,
+                      self.offset,self.seq,it)
 
   def __hash__(self):
     return id(self)
@@ -584,7 +1040,7 @@ cdef class NLMSASlice:
       self.seqBounds=NULL
 
   cdef object get_seq_interval(self, NLMSA nl, int targetID,
-                               int start, int stop):
+                               IntervalCoord start, IntervalCoord stop):
     'get seq interval and ensure cache owner keeps it in the cache'
     if start<stop:
       ival = nl.seqInterval(targetID, start, stop)
@@ -599,6 +1055,9 @@ cdef class NLMSASlice:
   ########################################### ITERATOR METHODS
   def edges(self,mergeAll=False,**kwargs):
     'get list of tuples (srcIval,destIval,edge) aligned in this slice'
+    if self.lpoHits is not None and kwargs.get('filterSeqs') is not None:
+      return self.target_slice(kwargs['filterSeqs']).edges(mergeAll=mergeAll,
+                                                           **kwargs)
     seqIntervals=self.groupByIntervals(mergeAll=mergeAll,**kwargs)
     ivals=self.groupBySequences(seqIntervals,**kwargs)
     l=[]
@@ -615,6 +1074,9 @@ cdef class NLMSASlice:
     return iter(self.items(**kwargs))
   def keys(self,mergeAll=False,**kwargs):
     'get list of intervals aligned to this slice according to groupBy options'
+    if self.lpoHits is not None and kwargs.get('filterSeqs') is not None:
+      return self.target_slice(kwargs['filterSeqs']).keys(mergeAll=mergeAll,
+                                                          **kwargs)
     seqIntervals=self.groupByIntervals(mergeAll=mergeAll,**kwargs)
     ivals=self.groupBySequences(seqIntervals,**kwargs)
     l=[]
@@ -624,11 +1086,14 @@ cdef class NLMSASlice:
   def __iter__(self): # PYREX DOESNT ALLOW ARGS TO __iter__ !
     return iter(self.keys())
   def __getitem__(self,k):
+    if self.lpoHits is not None: # JOIN TO k ONLY
+      return self.target_slice((k,))[k]
     return sequence.Seq2SeqEdge(self,k)
   def __setitem__(self,k,v):
     raise ValueError('''this NLMSA is read-only!  Currently, you cannot add new
 alignment intervals to an NLMSA after calling its build() method.''')
   def __len__(self):
+    self.join_all()
     return self.nrealseq # NUMBER OF NON-LPO SEQUENCE/ORIS ALIGNED HERE
 
 
@@ -639,6 +1104,10 @@ alignment intervals to an NLMSA after calling its build() method.''')
     for that sequence will be included.  No clipping is performed.'''
     cdef int i,target_id
     cdef NLMSA nl
+    if self.lpoHits is not None:
+      if seq is not None: # JOIN TO seq ONLY
+        return self.target_slice((seq,)).matchIntervals(seq)
+      self.join_all()
     nl=self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
     if seq is not None:
       target_id=nl.seqs.getID(seq) # CHECK IF IN OUR ALIGNMENT
@@ -656,6 +1125,104 @@ alignment intervals to an NLMSA after calling its build() method.''')
           l.append((ival1,ival2)) # SAVE THE INTERVAL MATCH
     return l
 
+  def coverage(self,int binsize=1):
+    '''get the #sequence intervals aligned to each position of this slice,
+    as array.array('i').  binsize>1 sums them over each binsize positions,
+    as for IntervalDB.coverage().  LPO mappings are not counted'''
+    cdef int i,n,nbin,*depth
+    cdef IntervalMap *im
+    cdef NLMSA nl
+    self.join_all()
+    nl=self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
+    nbin=coverage_nbin(self.start,self.stop,binsize)
+    im=<IntervalMap *>malloc((self.n+1)*sizeof(IntervalMap))
+    depth=<int *>calloc(nbin+1,sizeof(int))
+    try:
+      if im==NULL or depth==NULL:
+        raise MemoryError('out of memory')
+      n=0
+      for i from 0 <= i < self.n: # COPY ALL NON-LPO INTERVALS
+        if not nl.seqlist.is_lpo(self.im[i].target_id):
+          memcpy(im+n,self.im+i,sizeof(IntervalMap))
+          n=n+1
+      if interval_coverage(im,n,self.start,self.stop,binsize,depth)<0:
+        raise MemoryError('out of memory')
+      result=int_array_copy(depth,nbin)
+    finally:
+      free(im)
+      free(depth)
+    return result
+
+  def raw_table(self,seq=None):
+    '''get the 1:1 match intervals of matchIntervals(seq) as a tuple of
+    arrays (srcStart,srcEnd,targetID,targetStart,targetEnd,ori), without
+    making any sequence interval objects.  See interval_columns()'''
+    cdef int i,n,target_id
+    cdef IntervalMap *im
+    cdef NLMSA nl
+    if self.lpoHits is not None:
+      if seq is not None: # JOIN TO seq ONLY
+        return self.target_slice((seq,)).raw_table(seq)
+      self.join_all()
+    nl=self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
+    if seq is not None:
+      target_id=nl.seqs.getID(seq) # CHECK IF IN OUR ALIGNMENT
+    else:
+      target_id= -1
+    im=<IntervalMap *>malloc((self.n+1)*sizeof(IntervalMap))
+    try:
+      if im==NULL:
+        raise MemoryError('out of memory')
+      n=0
+      for i from 0 <= i < self.n: # COPY THE SAME INTERVALS AS matchIntervals
+        if nl.seqlist.is_lpo(self.im[i].target_id) or \
+               (target_id>=0 and self.im[i].target_id!=target_id):
+          continue
+        if seq is not None and (self.im[i].target_start<0)!=(seq.orientation<0):
+          continue
+        memcpy(im+n,self.im+i,sizeof(IntervalMap))
+        n=n+1
+      result=interval_columns(im,n)
+    finally:
+      free(im)
+    return result
+
+  def to_arrays(self,seqIntervals=None,mergeAll=False,**kwargs):
+    '''get the merged intervals of groupByIntervals() as a tuple of
+    arrays (srcStart,srcEnd,targetID,targetStart,targetEnd,ori), ordered
+    by targetID, without making any sequence interval objects.
+    seqIntervals is a groupByIntervals() result; by default it is computed
+    from the group-by options in kwargs, as for keys()'''
+    cdef int i,n
+    cdef IntervalMap *im
+    if seqIntervals is None:
+      if self.lpoHits is not None and kwargs.get('filterSeqs') is not None:
+        return self.target_slice(kwargs['filterSeqs']).to_arrays(mergeAll=mergeAll,
+                                                                 **kwargs)
+      seqIntervals=self.groupByIntervals(mergeAll=mergeAll,**kwargs)
+    ids=seqIntervals.keys()
+    ids.sort()
+    n=0
+    for l in seqIntervals.itervalues():
+      n=n+len(l)
+    im=<IntervalMap *>malloc((n+1)*sizeof(IntervalMap))
+    try:
+      if im==NULL:
+        raise MemoryError('out of memory')
+      i=0
+      for target_id in ids:
+        for ival in seqIntervals[target_id]:
+          im[i].start=ival[0]
+          im[i].end=ival[1]
+          im[i].target_id=target_id
+          im[i].target_start=ival[2]
+          im[i].target_end=ival[3]
+          i=i+1
+      result=interval_columns(im,n)
+    finally:
+      free(im)
+    return result
+
   ############################## MAXIMUM INTERVAL METHODS
   cdef int findSeqBounds(self,int id,int ori):
     'find the specified sequence / orientation using binary search'
@@ -668,9 +1235,9 @@ alignment intervals to an NLMSA after calling its build() method.''')
         left=mid+1
       elif self.seqBounds[mid].target_id>id:
         right=mid
-      elif ori>0 and seqBounds[mid].target_start<0:
+      elif ori>0 and self.seqBounds[mid].target_start<0:
         left=mid+1
-      elif ori<0 and seqBounds[mid].target_start>=0:
+      elif ori<0 and self.seqBounds[mid].target_start>=0:
         right=mid
       else: # MATCHES BOTH id AND ori
         return mid
@@ -680,6 +1247,8 @@ alignment intervals to an NLMSA after calling its build() method.''')
     'get maximum interval of seq aligned in this interval'
     cdef int i,id
     cdef NLMSA nl
+    if self.lpoHits is not None: # JOIN TO seq ONLY
+      return self.target_slice((seq,)).findSeqEnds(seq)
     nl=self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
     id=nl.seqs.getID(seq) # CHECK IF IN OUR ALIGNMENT
     i=self.findSeqBounds(id,seq.orientation) # FIND THIS id,ORIENTATION
@@ -693,6 +1262,7 @@ alignment intervals to an NLMSA after calling its build() method.''')
     'get list of tuples (ival1,ival2,edge)'
     cdef int i
     cdef NLMSA nl
+    self.join_all()
     nl=self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
     l=[]
     for i from 0 <= i <self.nseqBounds:
@@ -735,8 +1305,10 @@ alignment intervals to an NLMSA after calling its build() method.''')
       - pAlignedMin: a fractional minimum alignment threshold e.g. (0.9)
       - pIdentityMin: a fractional minimum identity threshold e.g. (0.9)
       '''
-    cdef int i,j,n,gap,insert,targetStart,targetEnd,start,end,maskStart,maskEnd
+    cdef int i,j,n
+    cdef IntervalCoord gap,insert,targetStart,targetEnd,start,end,maskStart,maskEnd
     cdef NLMSA nl
+    self.join_all()
     nl=self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
     if mergeMost: # BE REASONABLE: DON'T MERGE A WHOLE CHROMOSOME
       maxgap=10000
@@ -914,18 +1486,19 @@ alignment intervals to an NLMSA after calling its build() method.''')
       seqs is a list of sequences in the group.
       Must return a list of (sourceIval,targetIval).  See the docs.
     '''
-    cdef int i,j,start,end,targetStart,targetEnd,ipos,id
-    cdef float f
+    cdef int i,j,id,n,nresult
+    cdef IntervalMap *im
+    cdef GroupInterval *gi
     cdef NLMSA nl
+    self.join_all()
     nl=self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
     if seqGroups is None:
       seqGroups=[seqIntervals] # JUST USE THE WHOLE SET
     result=[]
-    import mapping # GET ACCESS TO DictQueue CLASS
     for seqs in seqGroups: # PROCESS EACH SEQ GROUP
-      bounds=[]
-      j=0
-      for seq in seqs: # CONSTRUCT INTERVAL BOUNDS LIST
+      seqList=[] # SEQUENCES OF THIS GROUP THAT ARE ALIGNED HERE
+      ivalList=[] # AND THEIR INTERVAL LISTS
+      for seq in seqs:
         if isinstance(seq,int): # seqIntervals USES INT INDEX VALUES
           id=seq # SAVE THE ID
           seq = self.get_seq_interval(nl, id, 0, 0) # GET THE SEQUENCE OBJECT
@@ -936,65 +1509,69 @@ alignment intervals to an NLMSA after calling its build() method.''')
           ivals=seqIntervals[id]
         except KeyError: # SEQUENCE NOT IN THIS ALIGNMENT REGION, SO SKIP
           continue
-        isIndel=False
-        for ival in ivals:
-          bounds.append((ival[1],False,j,seq,isIndel,ival))
-          bounds.append((ival[0],True,j,seq,isIndel,ival))
-          isIndel=True
-        j=j+1 # SEQUENCE COUNTER ENSURES ORDER OF SEQS IN SORTED LIST
-      bounds.sort() # ASCENDING ORDER OF source_pos, SORT stop B4 start
+        seqList.append(seq)
+        ivalList.append(ivals)
       if seqMethod is not None:
+        bounds=[]
+        for j from 0 <= j < len(seqList): # CONSTRUCT INTERVAL BOUNDS LIST
+          isIndel=False
+          for ival in ivalList[j]:
+            bounds.append((ival[1],False,j,seqList[j],isIndel,ival))
+            bounds.append((ival[0],True,j,seqList[j],isIndel,ival))
+            isIndel=True
+        bounds.sort() # ASCENDING ORDER OF source_pos, SORT stop B4 start
         result=result+seqMethod(bounds,seqs,sourceOnly=sourceOnly,
                                 msaSlice=self,minAligned=minAligned,
                                 pMinAligned=pMinAligned,
                                 indelCut=indelCut,**kwargs)
         continue # DON'T USE GENERIC GROUPING METHOD BELOW
-      seqStart=mapping.DictQueue() # setitem PUSHES, delitem POPS
-      maskStart=None
-      for bound in bounds: # GENERIC GROUPING: APPLY MASKING, sourceOnly
-        ipos,isStart,j,seq,isIndel=bound[0:5]
-        if isStart: # INTERVAL START
-          seqStart[seq]=bound[5] # JUST RECORD START OF INTERVAL
-        else: # INTERVAL STOP
-          start,end,targetStart,targetEnd,mergeIntervals=bound[5]
-          if maskStart is not None and not sourceOnly: # SAVE TARGET IVAL
-            if maskStart>start: # TRUNCATE TARGET IVAL START
-              targetStart=targetStart+maskStart-start
-              start=maskStart
-              mergeIntervals = self.clip_interval_list(maskStart,None,mergeIntervals)
-            result.append((sequence.absoluteSlice(self.seq,start,end),
-                           sequence.relativeSlice(seq,targetStart,
-                                                  targetEnd),mergeIntervals))
-          del seqStart[seq] # POP THIS SEQ FROM START DICT
-
-        f=len(seqStart) # #ALIGNED SEQS IN THIS REGION
-        if f<minAligned or f/len(seqs)<pMinAligned: # APPLY MASKING
-          if maskStart is not None:
-            if sourceOnly: # JUST SAVE MERGED SOURCE INTERVAL
-              result.append(sequence.absoluteSlice(self.seq,maskStart,end))
-            else: # REPORT TARGET IVALS WITHIN (maskStart,end) REGION
-              for seq in seqStart: # CANNOT USE items() BECAUSE THIS IS A QUEUE!
-                (start,i,targetStart,targetEnd,mergeIntervals)=seqStart[seq]
-                pleaseClip = False
-                if maskStart>start: # TRUNCATE TARGET IVAL START
-                  targetStart=targetStart+maskStart-start
-                  start=maskStart
-                  pleaseClip = True
-                if end<i: # TRUNCATE TARGET IVAL END
-                  targetEnd=targetEnd+end-i
-                  pleaseClip = True
-                if pleaseClip:
-                  mergeIntervals = self.clip_interval_list(maskStart,end,mergeIntervals)
-                result.append((sequence.absoluteSlice(self.seq,start,end),
-                               sequence.relativeSlice(seq,targetStart,
-                                                      targetEnd),mergeIntervals))
-            maskStart=None # REGION NOW BELOW THRESHOLD
-        elif maskStart is None:
-          maskStart=ipos # START OF REGION ABOVE THRESHOLD
-        if maskStart is not None and sourceOnly and indelCut \
-               and isIndel and maskStart<ipos:
-          result.append(sequence.absoluteSlice(self.seq,maskStart,ipos))
-          maskStart=ipos
+      n=0
+      for ivals in ivalList:
+        n=n+len(ivals)
+      if n==0:
+        continue
+      im=<IntervalMap *>malloc(n*sizeof(IntervalMap))
+      if im==NULL:
+        raise MemoryError('out of memory')
+      gi=NULL
+      try: # GENERIC GROUPING IN C: APPLY MASKING, sourceOnly
+        mergeList=[] # mergeIntervals OF EACH INTERVAL IN im
+        n=0
+        for j from 0 <= j < len(ivalList):
+          for ival in ivalList[j]:
+            im[n].start=ival[0]
+            im[n].end=ival[1]
+            im[n].target_id=j # INDEX IN seqList
+            im[n].target_start=ival[2]
+            im[n].target_end=ival[3]
+            mergeList.append(ival[4])
+            n=n+1
+        nresult=group_sequences(im,n,len(seqs),sourceOnly,indelCut,
+                                minAligned,pMinAligned,&gi)
+        if nresult<0:
+          raise MemoryError('out of memory')
+        for i from 0 <= i < nresult:
+          if gi[i].ival<0: # JUST A MERGED SOURCE INTERVAL
+            result.append(sequence.absoluteSlice(self.seq,gi[i].start,
+                                                 gi[i].end))
+            continue
+          mergeIntervals=mergeList[gi[i].ival]
+          if gi[i].clip==1: # TARGET IVAL START WAS TRUNCATED
+            mergeIntervals = self.clip_interval_list(gi[i].start,None,
+                                                     mergeIntervals)
+          elif gi[i].clip==2: # TRUNCATED TO THE END OF A MASKED REGION
+            mergeIntervals = self.clip_interval_list(gi[i].start,gi[i].end,
+                                                     mergeIntervals)
+          result.append((sequence.absoluteSlice(self.seq,gi[i].start,
+                                                gi[i].end),
+                         sequence.relativeSlice(seqList[im[gi[i].ival].target_id],
+                                                gi[i].target_start,
+                                                gi[i].target_end),
+                         mergeIntervals))
+      finally:
+        free(im)
+        if gi!=NULL:
+          free(gi)
     return result
   def clip_interval_list(self,start,end,l):
     'truncate list of 1:1 intervals using start,end'
@@ -1044,6 +1621,7 @@ alignment intervals to an NLMSA after calling its build() method.''')
     cdef NLMSASequence ns_lpo
     if self.nlmsaSequence.is_lpo: # ALREADY AN LPO REGION!
       return self.split(**kwargs) # JUST APPLY GROUP-BY RULES TO  self
+    self.join_all()
     nl=self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
     l=[]
     for i from 0 <= i <self.nseqBounds:
@@ -1061,6 +1639,7 @@ alignment intervals to an NLMSA after calling its build() method.''')
   property letters:
     'interface to individual LPO letters in this interval'
     def __get__(self):
+      self.join_all()
       return NLMSASliceLetters(self)
 
   def __cmp__(self,other):
@@ -1072,6 +1651,7 @@ alignment intervals to an NLMSA after calling its build() method.''')
   def rawIvals(self):
     'return list of raw numeric intervals in this slice'
     cdef int i
+    self.join_all()
     l=[]
     for i from 0 <= i < self.n:
       l.append((self.im[i].start,self.im[i].end,self.im[i].target_id,
@@ -1082,7 +1662,7 @@ alignment intervals to an NLMSA after calling its build() method.''')
 
 
 
-def advanceStartStop(int ipos,NLMSASlice nlmsaSlice not None,
+def advanceStartStop(IntervalCoord ipos,NLMSASlice nlmsaSlice not None,
                      int istart,int istop):
   cdef int i
   if istop>=nlmsaSlice.n:
@@ -1127,6 +1707,134 @@ cdef class NLMSASliceIterator:
     return NLMSANode(self.ipos,self.nlmsaSlice,self.istart,self.istop)
 
 
+
+cdef class NLMSASliceBatch:
+  '''iterate (ival,NLMSASlice) for a batch of sequence intervals, grouped
+  by sequence and in order of position.  Neighbouring intervals are
+  answered from one join over the region covering them, see
+  NLMSA.slice_many()'''
+  def __new__(self,NLMSA nlmsa not None,intervals,int maxgap=1000,
+              IntervalCoord maxSpan=1000000):
+    cdef int i
+    self.nlmsa=nlmsa
+    self.useGetitem=hasattr(nlmsa,'doSlice') # SUBCLASS DOES ITS OWN QUERY
+    groups={}
+    i=0
+    for ival in intervals: # GROUP BY SEQUENCE, IN FORWARD COORDS
+      if ival.start<0:
+        t=(-ival.stop,-ival.start,i,ival)
+      else:
+        t=(ival.start,ival.stop,i,ival)
+      try:
+        groups[ival.pathForward].append(t)
+      except KeyError:
+        groups[ival.pathForward]=[t]
+      i=i+1
+    self.clusters=[]
+    for seq,l in groups.items():
+      l.sort() # ORDER BY POSITION
+      cluster=None
+      for start,stop,i,ival in l:
+        if cluster is not None and start<=cluster[1]+maxgap \
+               and max(stop,cluster[1])-cluster[0]<=maxSpan: # ADD TO CLUSTER
+          if stop>cluster[1]:
+            cluster[1]=stop
+          cluster[2].append(ival)
+        else: # START A NEW CLUSTER
+          cluster=[start,stop,[ival]]
+          self.clusters.append((seq,cluster))
+    self.icluster=0
+    self.results=[]
+    self.iresult=0
+
+  cdef int load_cluster(self) except -1:
+    'join the next cluster once, then clip the slice of each of its intervals'
+    cdef int i,i0,nhit
+    cdef IntervalCoord qstart,qstop,endMax,s,e,ts,te
+    cdef NLMSASlice covering
+    cdef NLMSASequence ns
+    cdef IntervalFileDBIterator it
+    seq,cluster=self.clusters[self.icluster]
+    self.clusters[self.icluster]=None # RELEASE AS WE GO
+    self.icluster=self.icluster+1
+    self.results=[]
+    self.iresult=0
+    start,stop,ivals=cluster
+    if self.useGetitem:
+      for ival in ivals:
+        self.results.append((ival,self.nlmsa[ival]))
+      return 0
+    id,ns,offset=self.nlmsa.seqs[ivals[0]] # ONE LOOKUP FOR THE CLUSTER
+    try:
+      covering=NLMSASlice(ns,start,stop,id,offset,seq[start:stop])
+    except nlmsa_utils.EmptySliceError:
+      for ival in ivals:
+        self.results.append((ival,nlmsa_utils.EmptySlice(ival)))
+      return 0
+    for i from 1 <= i < covering.n: # finish_join() SORTED THEM BY start
+      assert covering.im[i-1].start<=covering.im[i].start, \
+             'covering slice intervals not sorted by start'
+    i0=0 # covering.im[:i0] ALL END BEFORE THE CURRENT QUERY
+    endMax=start
+    for ival in ivals:
+      if ival.start<0:
+        qstart= -ival.stop
+        qstop= -ival.start
+      else:
+        qstart=ival.start
+        qstop=ival.stop
+      while i0<covering.n and covering.im[i0].end<=qstart \
+                and endMax<=qstart: # QUERIES ARE IN ORDER OF qstart
+        if covering.im[i0].end>endMax:
+          endMax=covering.im[i0].end
+        i0=i0+1
+      nhit=0
+      i=i0
+      while i<covering.n and covering.im[i].start<qstop: # COUNT OVERLAPS
+        if covering.im[i].end>qstart:
+          nhit=nhit+1
+        i=i+1
+      if nhit==0:
+        self.results.append((ival,nlmsa_utils.EmptySlice(ival)))
+        continue
+      it=IntervalFileDBIterator(ival.start,ival.stop,None,None,nhit)
+      i=i0
+      while i<covering.n and covering.im[i].start<qstop: # CLIP TO THE QUERY
+        if covering.im[i].end>qstart:
+          s=covering.im[i].start
+          e=covering.im[i].end
+          ts=covering.im[i].target_start
+          te=covering.im[i].target_end
+          if s<qstart:
+            ts=ts+qstart-s
+            s=qstart
+          if e>qstop:
+            te=te+qstop-e
+            e=qstop
+          if ival.start<0: # REVERSE ORIENTATION, AS find_intervals() DOES
+            it.saveInterval(-e,-s,covering.im[i].target_id,-te,-ts)
+          else:
+            it.saveInterval(s,e,covering.im[i].target_id,ts,te)
+        i=i+1
+      self.results.append((ival,NLMSASlice(ns,ival.start,ival.stop,id,offset,
+                                           ival,it,covering)))
+    return 0
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    cdef object t
+    while self.iresult>=len(self.results):
+      if self.icluster>=len(self.clusters):
+        raise StopIteration
+      self.load_cluster()
+    t=self.results[self.iresult]
+    self.results[self.iresult]=None # RELEASE AS WE GO
+    self.iresult=self.iresult+1
+    return t
+
+
  
 
 
@@ -1134,7 +1842,7 @@ cdef class NLMSASliceIterator:
 
 cdef class NLMSANode:
   'interface to a node in NLMSA storage of LPO alignment'
-  def __new__(self,int ipos,NLMSASlice nlmsaSlice not None,
+  def __new__(self,IntervalCoord ipos,NLMSASlice nlmsaSlice not None,
               int istart=0,int istop= -1):
     cdef int i,n
     cdef NLMSA nl
@@ -1158,7 +1866,8 @@ cdef class NLMSANode:
   def __len__(self):
     return self.n
   def __iter__(self):
-    cdef int i,j
+    cdef int i
+    cdef IntervalCoord j
     cdef NLMSA nl
     nl=self.nlmsaSlice.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
     l=[]
@@ -1172,7 +1881,8 @@ cdef class NLMSANode:
 
   def getSeqPos(self,seq):
     'return seqpos for this seq at this node'
-    cdef int i,j,id
+    cdef int i,id
+    cdef IntervalCoord j
     try:
       id=self.nlmsaSlice.nlmsaSequence.nlmsaLetters.seqs.getID(seq)
     except KeyError:
@@ -1209,7 +1919,7 @@ cdef class NLMSANode:
       return -1
 
   ########################################## NODE-TO-NODE EDGE METHODS
-  cdef int check_edge(self,int iseq,int ipos):
+  cdef int check_edge(self,int iseq,IntervalCoord ipos):
     cdef int i
     for i from self.istart <= i < self.istop:
       if self.nlmsaSlice.im[i].start<=self.ipos \
@@ -1283,6 +1993,7 @@ cdef class NLMSASequence:
   'sequence interface to NLMSA storage of an LPO alignment'
   def __init__(self,NLMSA nl not None,filestem,seq,mode='r',is_union=0,
                length=None):
+    cdef char err_msg[2048]
     self.nlmsaLetters=nl
     self.filestem=filestem
     self.is_union=is_union
@@ -1315,12 +2026,12 @@ cdef class NLMSASequence:
     self.idb=None # DEFAULT: NOT USING IN-MEMORY DATABASE.
     self.db=None # DEFAULT: WAIT TO OPEN DB UNTIL ACTUALLY NEEDED
     if mode=='r': # IMMEDIATELY OPEN DATABASE, UNLIKE onDemand MODE
-      self.db=IntervalFileDB(filestem,mode)
+      self.db=IntervalFileDB(filestem,mode,nl.useMmap)
     elif mode=='memory': # OPEN IN-MEMORY DATABASE
       self.idb=IntervalDB()
-    elif mode=='w': # WRITE .build FILE
+    elif mode=='w': # WRITE .build FILE, THROUGH THE FILE POOL
       filename=filestem+'.build'
-      self.build_ifile=fopen(filename,'wb') # binary file
+      self.build_ifile=open_build_file(filename,'wb',err_msg) # binary file
       if self.build_ifile==NULL:
         errmsg='unable to open in write mode: '+filename
         raise IOError(errmsg)
@@ -1329,53 +2040,107 @@ cdef class NLMSASequence:
   def __dealloc__(self):
     'remember: dealloc cannot call other methods!'
     if self.build_ifile:
-      fclose(self.build_ifile)
+      close_build_file(self.build_ifile)
+    if self.build_im!=NULL:
+      free(self.build_im)
 
   def forceLoad(self):
     'force database to be initialized, if not already open'
-    self.db=IntervalFileDB(self.filestem,'r')
+    self.db=IntervalFileDB(self.filestem,'r',self.nlmsaLetters.useMmap)
+    if self.nlmsaLetters.indexCache is not None: # MAY UNLOAD ANOTHER INDEX
+      self.nlmsaLetters.indexCache.opened(self)
+
+  def unload(self):
+    '''drop our IntervalFileDB, to be reopened when next needed.  Unlike
+    close(), queries still using it can finish'''
+    self.db=None
 
   def close(self):
     'free memory and close files associated with this sequence index'
+    cdef int i
     if self.db is not None:
       self.db.close() # CLOSE THE DATABASE, RELEASE MEMORY
       self.db=None # DISCONNECT FROM DATABASE
     if self.idb is not None:
       self.idb.close() # CLOSE THE DATABASE, RELEASE MEMORY
       self.idb=None # DISCONNECT FROM DATABASE
+    if self.build_im!=NULL: # DISCARD INTERVALS NEVER BUILT
+      free(self.build_im)
+      self.build_im=NULL
+      self.build_n=0
+      self.build_nalloc=0
     if self.build_ifile:
-      fclose(self.build_ifile)
+      i=close_build_file(self.build_ifile)
       self.build_ifile=NULL
+      if i!=0:
+        raise IOError('error writing build file %s! out of disk space?'
+                      % self.filestem)
 
-  def buildFiles(self,**kwargs):
-    'build nested list from saved unsorted alignment data'
-    cdef IntervalDB db
+  def closeBuildFile(self):
+    'close our .build file so its index can be built; return #intervals'
+    cdef int i
     if self.build_ifile==NULL:
       raise IOError('not opened in write mode')
-    fclose(self.build_ifile)
+    i=close_build_file(self.build_ifile)
     self.build_ifile=NULL
-    filename=self.filestem+'.build'
-    db=IntervalDB() # CREATE EMPTY NL IN MEMORY
-    if self.nbuild>0:
-      db.buildFromUnsortedFile(filename,self.nbuild,**kwargs) # BUILD FROM .build
-    db.write_binaries(self.filestem) # SAVE AS IntervalDBFile
-    db.close() # DUMP NESTEDLIST FROM MEMORY
-    import os
-    os.remove(filename) # REMOVE OUR .build FILE, NO LONGER NEEDED
-    self.db=IntervalFileDB(self.filestem) # NOW OPEN THE IntervalFileDB
+    if i!=0:
+      raise IOError('error writing build file %s! out of disk space?'
+                    % self.filestem)
+    return self.nbuild
+
+  def buildFiles(self,**kwargs):
+    'build nested list from saved unsorted alignment data'
+    build_index_files(self.filestem,self.closeBuildFile(),**kwargs)
+    self.forceLoad() # NOW OPEN THE IntervalFileDB
     return self.nbuild # return count of intervals
 
   def buildInMemory(self, **kwargs):
-    try:
-      n = len(self.buildList)
-    except TypeError:
+    'build our IntervalDB in place from the intervals saved in memory'
+    cdef int n
+    cdef IntervalMap *im
+    if self.build_im==NULL:
       return 0
-    else:
-      self.idb.save_tuples(self.buildList,**kwargs)
-      self.buildList = None
-      return n
-
-  cdef int saveInterval(self,IntervalMap im[],int n,int expand_self,FILE *ifile):
+    n=self.build_n
+    im=<IntervalMap *>realloc(self.build_im,n*sizeof(IntervalMap))
+    if im==NULL: # KEEP THE LARGER BUFFER
+      im=self.build_im
+    self.build_im=NULL # HAND OUR BUFFER TO THE IntervalDB
+    self.build_n=0
+    self.build_nalloc=0
+    self.idb.close()
+    self.idb.im=im
+    self.idb.n=n
+    self.idb.runBuildMethod(**kwargs)
+    return n
+
+  cdef int saveInMemory(self,IntervalMap im[],int n) except -1:
+    'append intervals to our in-memory buffer, growing it as needed'
+    cdef int i,nalloc
+    cdef IntervalMap *im_new
+    if self.build_n+n>self.build_nalloc: # DOUBLE OUR BUFFER
+      nalloc=2*self.build_nalloc
+      if nalloc<1024:
+        nalloc=1024
+      if nalloc<self.build_n+n:
+        nalloc=self.build_n+n
+      im_new=<IntervalMap *>realloc(self.build_im,nalloc*sizeof(IntervalMap))
+      if im_new==NULL:
+        raise MemoryError('unable to allocate IntervalMap[%d]' % nalloc)
+      self.build_im=im_new
+      self.build_nalloc=nalloc
+    im_new=self.build_im+self.build_n
+    for i from 0 <= i < n:
+      im_new[i].start=im[i].start
+      im_new[i].end=im[i].end
+      im_new[i].target_id=im[i].target_id
+      im_new[i].target_start=im[i].target_start
+      im_new[i].target_end=im[i].target_end
+      im_new[i].sublist= -1
+    self.build_n=self.build_n+n
+    return n
+
+  cdef int saveInterval(self,IntervalMap im[],int n,int expand_self,
+                        BuildFile *ifile) except -1:
     cdef int i
     if ifile==NULL:
       raise IOError('not opened in write mode')
@@ -1386,29 +2151,41 @@ cdef class NLMSASequence:
             self.length=im[i].end
         elif -(im[i].start)>self.length:
           self.length= -(im[i].start) # THIS HANDLES NEGATIVE ORI CASE
-    i=write_padded_binary(im,n,1,ifile)
+    i=write_build_file(ifile,im,n)
     if i!=n:
-      raise IOError('write_padded_binary failed???')
+      raise IOError('error writing build file %s! out of disk space?'
+                    % self.filestem)
     return i
     
+  cdef BuildFile *get_build_file(self) except NULL:
+    'get the file to save intervals to, opening .delta in append mode'
+    cdef char err_msg[2048]
+    if self.build_ifile==NULL and self.nlmsaLetters.appendMode:
+      filename=self.filestem+'.delta' # APPEND TO OUR BUILT INDEX
+      self.build_ifile=open_build_file(filename,'ab',err_msg) # binary file
+      if self.build_ifile==NULL:
+        errmsg='unable to open in append mode: '+filename
+        raise IOError(errmsg)
+    if self.build_ifile==NULL:
+      raise ValueError('not opened in write mode')
+    return self.build_ifile
+
   def __setitem__(self,k,t): # SAVE TO .build FILE
     'save mapping [k.start:k.stop] --> (id,start,stop)'
     cdef int i
     cdef IntervalMap im_tmp
-    if self.build_ifile: # SAVE TO BUILD FILE
+    if self.build_ifile or self.nlmsaLetters.appendMode: # SAVE TO BUILD FILE
       im_tmp.start,im_tmp.end=(k.start,k.stop)
       im_tmp.target_id,im_tmp.target_start,im_tmp.target_end=t
       im_tmp.sublist= -1
-      i=self.saveInterval(&im_tmp,1,self.is_lpo,self.build_ifile)
+      i=self.saveInterval(&im_tmp,1,self.is_lpo,self.get_build_file())
       #logger.debug('saveInterval: %s %s %s  %s %s %s' % (self.id, im_tmp.start, im_tmp.end,
       #             im_tmp.target_id, im_tmp.target_start, im_tmp.target_end))
       self.nbuild=self.nbuild+i # INCREMENT COUNTER OF INTERVALS SAVED
-    elif self.nlmsaLetters.in_memory_mode:
-      t=(k.start,k.stop)+t
-      try:
-        self.buildList.append(t)
-      except AttributeError:
-        self.buildList=[t]
+    elif self.nlmsaLetters.in_memory_mode: # SAVE TO OUR IntervalMap BUFFER
+      im_tmp.start,im_tmp.end=(k.start,k.stop)
+      im_tmp.target_id,im_tmp.target_start,im_tmp.target_end=t
+      self.saveInMemory(&im_tmp,1)
     else:
       raise ValueError('not opened in write mode')
 
@@ -1458,19 +2235,27 @@ cdef class NLMSA:
                trypath=None,bidirectional=True,pairwiseMode= -1,
                bidirectionalRule=nlmsa_utils.prune_self_mappings,
                use_virtual_lpo=None,maxLPOcoord=None,
-               inverseDB=None, alignedIvals=None, **kwargs):
+               inverseDB=None, alignedIvals=None, useMmap=False,
+               nWorkers=1, maxMemory=None, compress=False,
+               maxOpenIndexes=None, **kwargs):
     try:
       import resource # WE MAY NEED TO OPEN A LOT OF FILES...
-      resource.setrlimit(resource.RLIMIT_NOFILE,(maxOpenFiles,-1))
+      try:
+        resource.setrlimit(resource.RLIMIT_NOFILE,(maxOpenFiles,-1))
+      except: # WE ARE STUCK WITH THE CURRENT LIMIT
+        limit=resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        if limit>0 and limit<maxOpenFiles:
+          maxOpenFiles=limit
     except: # BUT THIS IS OPTIONAL...
       pass
+    c_set_file_pool_size(maxOpenFiles/2) # LEAVE THE REST FOR OTHER FILES
     self.lpoList=[] # EMPTY LIST OF LPO
     self.seqs=nlmsa_utils.NLMSASeqDict(self,pathstem,mode,**kwargs)
     self.seqlist=self.seqs.seqlist
     self.pathstem=pathstem
     self.inverseDB = inverseDB
     if maxlen is None:
-      maxlen=C_int_max-65536 # C_int_max MAXIMUM VALUE REPRESENTABLE BY int
+      maxlen=C_coord_max-65536 # C_coord_max MAXIMUM VALUE OF IntervalCoord
       if axtFiles is not None:
         maxlen = maxlen/2
     self.maxlen=maxlen
@@ -1478,6 +2263,19 @@ cdef class NLMSA:
     self._ignoreShadowAttr={'sourceDB':None,'targetDB':None} # SCHEMA INFO
     self.seqDict=seqDict # SAVE FOR USER TO ACCESS...
     self.in_memory_mode=0
+    if useMmap: # SEARCH MEMORY-MAPPED INDEX FILES INSTEAD OF fread()
+      self.useMmap=1
+    else:
+      self.useMmap=0
+    self.nWorkers=nWorkers # #PROCESSES FOR build(); 0 MEANS ONE PER CPU
+    self.maxMemory=maxMemory # SORT BIGGER INDEXES ON DISK DURING build()
+    self.projections={} # nlmsaID --> PROJECTION IntervalFileDB, OPENED ON DEMAND
+    if maxOpenIndexes is not None: # CLOSE LEAST RECENTLY USED INDEXES
+      self.indexCache=nlmsa_utils.IndexCache(maxOpenIndexes)
+    if compress: # build() SAVES .idb FILES IN COMPRESSED BLOCKS
+      self.compress=1
+    else:
+      self.compress=0
     if bidirectional:
       self.is_bidirectional=1
     else:
@@ -1507,7 +2305,7 @@ cdef class NLMSA:
       self.lpo_id=0
       if mafFiles is not None:
         self.newSequence() # CREATE INITIAL LPO
-        self.readMAFfiles(mafFiles,maxint)
+        self.readMAFfiles(mafFiles,maxint,nWorkers)
       elif axtFiles is not None:
         self.newSequence() # CREATE INITIAL LPO
         self.readAxtNet(axtFiles,bidirectionalRule)
@@ -1535,11 +2333,39 @@ cdef class NLMSA:
     elif mode!='xmlrpc':
       raise ValueError('unknown mode %s' % mode)
 
+  def preload(self):
+    '''open all our indexes now, e.g. before forking worker processes, so
+    that they share the index data loaded by this process instead of
+    each loading its own.  Returns the number of indexes opened'''
+    cdef NLMSASequence ns
+    if self.do_build or self.in_memory_mode:
+      raise ValueError('preload() requires an NLMSA opened in read mode')
+    n=0
+    for ns in self.seqlist:
+      if ns.db is None:
+        ns.forceLoad()
+        n=n+1
+    for id in self.projections.keys():
+      if self.projections[id] is None:
+        self.get_projection(id)
+        n=n+1
+    return n
+
+  def after_fork(self):
+    '''make this NLMSA safe to query in a child process forked after
+    it was opened, by reopening its files in the child'''
+    after_fork()
+    self.seqs.after_fork()
+
   def close(self):
     'close our shelve index files'
     cdef NLMSASequence ns
     for ns in self.seqlist: # tell each seq to close its index files
       ns.close()
+    for id,db in self.projections.items():
+      if db is not None:
+        db.close()
+        self.projections[id]=None
     self.seqs.close()
 
   def __reduce__(self): ############################# SUPPORT FOR PICKLING
@@ -1596,6 +2422,11 @@ cdef class NLMSA:
           self.is_bidirectional = v
         elif k=='pairwiseMode':
           self.pairwiseMode = v
+        elif k=='inlmsa':
+          self.inlmsa = v
+        elif k=='projections': # LIST OF nlmsaIDs WITH A PROJECTION INDEX
+          for id in v:
+            self.projections[id]=None
         else:
           setattr(self,k,v)
     finally:
@@ -1685,6 +2516,46 @@ See the NLMSA documentation for more details.\n''')
       for ns,myslice in l: # ONLY RETURN ONE SLICE OBJECT
           return NLMSASlice(ns,myslice.start,myslice.stop)
 
+  def slice_many(self,intervals,int maxgap=1000,
+                 IntervalCoord maxSpan=1000000):
+    '''get the alignment slice of each sequence interval in intervals, as
+    self[ival] would.  The intervals are grouped by sequence and sorted by
+    position, and neighbouring ones no more than maxgap apart are answered
+    from a single join over the region covering them (at most maxSpan
+    long).  Returns an iterator of (ival,slice) pairs in that order,
+    computed one region at a time.'''
+    if self.do_build:
+      raise ValueError('you must build the NLMSA before querying it')
+    return NLMSASliceBatch(self,intervals,maxgap,maxSpan)
+
+  def lazy_slice(self,k):
+    '''get the alignment slice of sequence interval k, as self[k] would,
+    but only look up the LPO intervals it maps to.  They are joined to
+    the aligned sequences when needed, and only to the sequences asked
+    for by matchIntervals(seq), findSeqEnds(seq), slice[seq] or the
+    filterSeqs option; anything else joins them to all sequences.'''
+    if self.do_build:
+      raise ValueError('you must build the NLMSA before querying it')
+    id,ns,offset=self.seqs[k] # GET UNION INFO FOR THIS SEQ
+    try:
+      return NLMSASlice(ns,k.start,k.stop,id,offset,k,lazy=True)
+    except nlmsa_utils.EmptySliceError:
+      return nlmsa_utils.EmptySlice(k)
+
+  def seq_ids(self,ids):
+    '''get list of the sequence IDs of the nlmsaIDs in ids, e.g. the
+    targetID array from NLMSASlice.raw_table().  Each distinct nlmsaID is
+    looked up only once'''
+    d={}
+    l=[]
+    for id in ids:
+      try:
+        l.append(d[id])
+      except KeyError:
+        d[id]=self.seqlist.getSeqID(id)
+        l.append(d[id])
+    return l
+
   def __iter__(self):
     raise NotImplementedError, 'you cannot iterate over NLMSAs'
 
@@ -1703,12 +2574,182 @@ See the NLMSA documentation for more details.\n''')
   def add_aligned_intervals(self, alignedIvals):
     'add alignedIvals to this alignment'
     nlmsa_utils.add_aligned_intervals(self, alignedIvals)
+  def add_aligned_arrays(self,seqIDs,src,srcStart,srcStop,dest,destStart,
+                         destStop,ori=None):
+    '''add a pairwise alignment given as parallel arrays, one entry per
+    aligned interval pair: src and dest are int arrays of indexes into
+    seqIDs, a list of sequence IDs in seqDict; srcStart,srcStop,destStart,
+    destStop are coordinate arrays (typecode coord_typecode); ori is an
+    optional int array, where ori<0 means dest is aligned in reverse
+    orientation.  Arrays can be any object supporting the buffer interface,
+    e.g. array.array or numpy arrays.  The intervals are written straight
+    to the .build files, without creating sequence objects for them.
+    Returns the #interval pairs saved'''
+    cdef int i,j,a,b,n,nseq,nns,*p_src,*p_dest,*p_ori
+    cdef int *nlmsa_id,*ns_id,*nbuild
+    cdef IntervalCoord *p_srcStart,*p_srcStop,*p_destStart,*p_destStop
+    cdef IntervalCoord *offset,*seq_length,*lpo_length
+    cdef IntervalMap im_tmp
+    cdef BuildFile **build_ifile
+    cdef NLMSASequence ns
+    if not self.do_build:
+      raise ValueError('not opened in write mode')
+    self.init_pairwise_mode() # SRC AND DEST ARE SAVED TO VIRTUAL LPOs
+    nseq=len(seqIDs)
+    nlmsa_id=<int *>calloc(nseq+1,sizeof(int))
+    ns_id=<int *>calloc(nseq+1,sizeof(int))
+    offset=<IntervalCoord *>calloc(nseq+1,sizeof(IntervalCoord))
+    seq_length=<IntervalCoord *>calloc(nseq+1,sizeof(IntervalCoord))
+    build_ifile=NULL
+    nbuild=NULL
+    lpo_length=NULL
+    try:
+      if nlmsa_id==NULL or ns_id==NULL or offset==NULL or seq_length==NULL:
+        raise MemoryError('out of memory')
+      for i from 0 <= i < nseq: # ADD EACH SEQUENCE TO OUR UNION, ONCE
+        seq=self.seqDict[seqIDs[i]]
+        self.seqs.saveSeq(seq)
+        t=self.seqs[seq]
+        nlmsa_id[i]=t[0]
+        ns=t[1]
+        ns_id[i]=ns.id
+        offset[i]=t[2]
+        seq_length[i]=len(seq)
+      nns=len(self.seqlist) # NO NEW UNIONS OR LPOs ARE CREATED BELOW
+      build_ifile=<BuildFile **>calloc(nns,sizeof(BuildFile *))
+      nbuild=<int *>calloc(nns,sizeof(int))
+      lpo_length=<IntervalCoord *>calloc(nns,sizeof(IntervalCoord))
+      if build_ifile==NULL or nbuild==NULL or lpo_length==NULL:
+        raise MemoryError('out of memory')
+      if not self.in_memory_mode:
+        for i from 0 <= i < nseq: # GET THE VIRTUAL LPO FOR EACH UNION
+          ns=self.seqlist[ns_id[i]-1]
+          build_ifile[ns.id]=ns.get_build_file()
+          lpo_length[ns.id]=ns.length
+
+      p_dest=NULL # SET BY array_buffer() BELOW
+      p_srcStart=p_srcStop=p_destStart=p_destStop=NULL
+      n=array_buffer(src,sizeof(int),<void **>&p_src,'src')
+      if array_buffer(dest,sizeof(int),<void **>&p_dest,'dest')!=n \
+         or array_buffer(srcStart,sizeof(IntervalCoord),<void **>&p_srcStart,
+                         'srcStart')!=n \
+         or array_buffer(srcStop,sizeof(IntervalCoord),<void **>&p_srcStop,
+                         'srcStop')!=n \
+         or array_buffer(destStart,sizeof(IntervalCoord),
+                         <void **>&p_destStart,'destStart')!=n \
+         or array_buffer(destStop,sizeof(IntervalCoord),<void **>&p_destStop,
+                         'destStop')!=n:
+        raise ValueError('all arrays must have the same length')
+      p_ori=NULL
+      if ori is not None and array_buffer(ori,sizeof(int),<void **>&p_ori,
+                                          'ori')!=n:
+        raise ValueError('all arrays must have the same length')
+
+      for i from 0 <= i < n:
+        a=p_src[i]
+        b=p_dest[i]
+        if a<0 or a>=nseq or b<0 or b>=nseq:
+          raise IndexError('src or dest index out of range, row %d' % i)
+        if p_srcStart[i]<0 or p_srcStart[i]>=p_srcStop[i] \
+           or p_srcStop[i]>seq_length[a] or p_destStart[i]<0 \
+           or p_destStart[i]>=p_destStop[i] or p_destStop[i]>seq_length[b]:
+          raise ValueError('invalid interval coordinates, row %d' % i)
+        im_tmp.start=p_srcStart[i]+offset[a] # SAVE src --> dest
+        im_tmp.end=p_srcStop[i]+offset[a]
+        im_tmp.target_id=nlmsa_id[b]
+        if p_ori!=NULL and p_ori[i]<0: # REVERSE ORIENTATION
+          im_tmp.target_start= -p_destStop[i]
+          im_tmp.target_end= -p_destStart[i]
+        else:
+          im_tmp.target_start=p_destStart[i]
+          im_tmp.target_end=p_destStop[i]
+        im_tmp.sublist= -1
+        j=ns_id[a]-1 # VIRTUAL LPO OF src UNION
+        if build_ifile[j]==NULL: # IN-MEMORY BUILD
+          ns=self.seqlist[j]
+          ns.saveInMemory(&im_tmp,1)
+        else:
+          save_lpo_interval(&im_tmp,build_ifile[j],nbuild+j,lpo_length+j)
+        if self.is_bidirectional: # SAVE dest --> src
+          if im_tmp.target_start<0: # OFFSET REVERSE ORI
+            im_tmp.start=im_tmp.target_start-offset[b]
+            im_tmp.end=im_tmp.target_end-offset[b]
+          else: # OFFSET FORWARD ORI
+            im_tmp.start=im_tmp.target_start+offset[b]
+            im_tmp.end=im_tmp.target_end+offset[b]
+          im_tmp.target_id=nlmsa_id[a]
+          im_tmp.target_start=p_srcStart[i]
+          im_tmp.target_end=p_srcStop[i]
+          j=ns_id[b]-1 # VIRTUAL LPO OF dest UNION
+          if build_ifile[j]==NULL: # IN-MEMORY BUILD
+            ns=self.seqlist[j]
+            ns.saveInMemory(&im_tmp,1)
+          else:
+            save_lpo_interval(&im_tmp,build_ifile[j],nbuild+j,lpo_length+j)
+    finally:
+      if build_ifile!=NULL: # SAVE COUNTS AND LENGTHS BACK TO THE LPOs
+        for ns in self.seqlist:
+          if ns.id<nns and build_ifile[ns.id]!=NULL:
+            ns.nbuild=ns.nbuild+nbuild[ns.id]
+            ns.length=lpo_length[ns.id]
+      free(nlmsa_id)
+      free(ns_id)
+      free(offset)
+      free(seq_length)
+      free(build_ifile)
+      free(nbuild)
+      free(lpo_length)
+    return n
+  def append_aligned_intervals(self, alignedIvals):
+    '''add alignedIvals to this alignment after it has been built, without
+    rebuilding its indexes.  The new intervals are appended to a .delta
+    file for each index, and queries find them at once.  Call compact()
+    to merge them into the indexes.  New sequences must be in seqDict'''
+    cdef NLMSASequence ns
+    if self.do_build or self.in_memory_mode:
+      raise ValueError('append_aligned_intervals() requires an NLMSA opened in read mode')
+    nseq=len(self.seqlist)
+    for ns in self.seqlist: # NEW SEQUENCES GO IN THE LAST UNION
+      if ns.is_union:
+        self.currentUnion=ns
+    while str(self.inlmsa) in self.seqs.IDdict: # SKIP nlmsaIDs IN USE
+      self.inlmsa=self.inlmsa+1
+    self.seqs.reopenReadOnly('w') # SO WE CAN ADD NEW SEQUENCES
+    self.do_build=1
+    self.appendMode=1
+    try:
+      nlmsa_utils.add_aligned_intervals(self, alignedIvals)
+    finally:
+      self.do_build=0
+      self.appendMode=0
+      self.seqs.reopenReadOnly()
+      for ns in self.seqlist:
+        if ns.id>=nseq: # A NEW UNION OR LPO: BUILD ITS INDEX
+          ns.buildFiles()
+        elif ns.build_ifile: # CLOSE ITS .delta, SO IT RELOADS ON DEMAND
+          ns.close()
+      self.save_index()
+      self.save_attrs()
+  def compact(self,maxMemory=None,compress=None):
+    '''merge intervals added by append_aligned_intervals() into the
+    on-disk indexes.  See compact_index_files().  Returns the #indexes
+    rebuilt'''
+    cdef NLMSASequence ns
+    import os
+    if self.do_build or self.in_memory_mode:
+      raise ValueError('compact() requires an NLMSA opened in read mode')
+    if maxMemory is None:
+      maxMemory=self.maxMemory
+    n=0
+    for ns in self.seqlist:
+      if os.access(ns.filestem+'.delta',os.F_OK):
+        ns.close() # REOPENS ON DEMAND, AFTER THE REBUILD
+        compact_index_files(ns.filestem,maxMemory,compress)
+        n=n+1
+    return n
 
   cdef void free_seqidmap(self,int nseq0,SeqIDMap *seqidmap):
-    cdef int i
-    for i from 0 <= i <nseq0: # DUMP STRING STORAGE FOR SEQUENCE IDENTIFIERS
-      free(seqidmap[i].id)
-    free(seqidmap) # WE CAN NOW FREE THE SEQUENCE LOOKUP ARRAY
+    free_seqidmap_array(nseq0,seqidmap)
 
   cdef void save_nbuild(self,int nbuild[]):
     cdef NLMSASequence ns
@@ -1718,107 +2759,154 @@ See the NLMSA documentation for more details.\n''')
         #logger.debug('nbuild[%d] = %s' % (i, ns.nbuild))
   
 
-  def readMAFfiles(self,mafFiles,maxint):
-    'read alignment from a set of MAF files'
-    cdef int i,j,nseq0,nseq1,n,nseq,block_len
+  cdef int save_maf_block(self,IntervalMap im[],int n,int block_len,
+                          int maxint,SeqIDMap seqidmap[],
+                          BuildFile *build_ifile[],int nbuild[]) except -1:
+    '''save one MAF block read by readMAFrecord() with LPO offset 0, adding
+    its sequences to the current union and its intervals to the last LPO'''
+    cdef int i,j
+    cdef IntervalMap im_tmp
+    cdef NLMSASequence ns_lpo,ns # ns IS OUR CURRENT UNION
+    cdef IntervalCoord lpoOffset
+    ns_lpo=self.lpoList[-1] # OUR CURRENT LPO
+    ns=self.currentUnion
+    im_tmp.sublist= -1 # DEFAULT
+    if self.maxlen-ns_lpo.length<=block_len \
+           or ns_lpo.nbuild>maxint: # TOO BIG! MUST CREATE A NEW LPO
+      ns_lpo=self.newSequence() # CREATE A NEW LPO SEQUENCE
+    lpoOffset=ns_lpo.length # PUT THE BLOCK AT THE END OF THIS LPO
+    for i from 0<= i < n: # TRANSLATE THESE INTERVALS TO THAT OFFSET
+      if im[i].start>=0: # FORWARD INTERVAL
+        im[i].start = im[i].start + lpoOffset
+        im[i].end = im[i].end + lpoOffset
+      else: # REVERSE INTERVAL
+        im[i].start = im[i].start - lpoOffset
+        im[i].end = im[i].end - lpoOffset
+
+    for i from 0 <= i < n: # SAVE EACH INTERVAL IN UNION -> LPO MAP
+      j=im[i].target_id
+      if seqidmap[j].nlmsa_id<=0: # NEW SEQUENCE, NEED TO ADD TO UNION
+        if ns is None or self.maxlen-ns.length<=seqidmap[j].length:
+          ns=self.newSequence(None,is_union=1) # CREATE NEW UNION TO HOLD IT
+          build_ifile[ns.id]=ns.build_ifile # KEEP PTR SO WE CAN WRITE DIRECTLY!
+          nbuild[ns.id]=0
+        seqidmap[j].ns_id=ns.id # SET IDs TO ADD THIS SEQ TO THE UNION
+        seqidmap[j].nlmsa_id=self.inlmsa
+        seqidmap[j].offset=ns.length
+        self.inlmsa=self.inlmsa+1 # ADVANCE SEQUENCE ID COUNTER
+        ns.length=ns.length+seqidmap[j].length # EXPAND UNION SIZE
+
+      im[i].target_id=seqidmap[j].nlmsa_id # USE THE CORRECT ID
+      if im[i].target_start<0: # OFFSET REVERSE ORI
+        im_tmp.start= -seqidmap[j].offset+im[i].target_start
+        im_tmp.end=   -seqidmap[j].offset+im[i].target_end
+      else: # OFFSET FORWARD ORI
+        im_tmp.start= seqidmap[j].offset+im[i].target_start
+        im_tmp.end=   seqidmap[j].offset+im[i].target_end
+      im_tmp.target_id=ns_lpo.id
+      im_tmp.target_start=im[i].start
+      im_tmp.target_end=im[i].end
+      j=seqidmap[j].ns_id # USE NLMSA ID OF THE UNION
+      ns_lpo.saveInterval(&im_tmp,1,0,build_ifile[j]) # SAVE SEQ -> LPO
+      nbuild[j]=nbuild[j]+1
+
+    ns_lpo.saveInterval(im,n,1,ns_lpo.build_ifile) # SAVE LPO -> SEQ
+    ns_lpo.nbuild=ns_lpo.nbuild+n # INCREMENT COUNT OF SAVED INTERVALS
+    return n
+
+  def readMAFfiles(self,mafFiles,maxint,nWorkers=1):
+    '''read alignment from a set of MAF files.  nWorkers!=1 parses them
+    with a pool of processes, see nlmsa_utils.read_maf_files_parallel()'''
+    cdef int i,nseq0,n,block_len
     cdef SeqIDMap *seqidmap
     cdef char tmp[32768],*p,a_header[4]
     cdef FILE *ifile
-    cdef IntervalMap im[4096],im_tmp
-    cdef NLMSASequence ns_lpo,ns # ns IS OUR CURRENT UNION
-    cdef FILE *build_ifile[4096]
-    cdef int nbuild[4096],has_continuation
+    cdef IntervalMap im[4096]
+    cdef BuildFile *build_ifile[4096]
+    cdef int nbuild[4096],has_continuation,is_pipe
     cdef long long linecode_count[256]
+    cdef char err_msg[2048]
 
-    ns_lpo=self.seqlist[self.lpo_id] # OUR INITIAL LPO
     self.pairwiseMode=0 # WE ARE USING A REAL LPO!
     memset(<void *>linecode_count,0,sizeof(linecode_count))
     has_continuation=0
 
-    nseq0=len(self.seqDict) # GET TOTAL #SEQUENCES IN ALL DATABASES
-    seqidmap=<SeqIDMap *>calloc(nseq0,sizeof(SeqIDMap)) # ALLOCATE ARRAY
-    i=0
-    for pythonStr,seqInfo in self.seqDict.seqInfoDict.iteritems():
-      seqidmap[i].id=strdup(pythonStr)
+    seqLengths=nlmsa_utils.get_seq_lengths(self.seqDict)
+    nseq0=len(seqLengths) # GET TOTAL #SEQUENCES IN ALL DATABASES
+    seqidmap=new_seqidmap(seqLengths) # SORTED BY id
+    self.currentUnion=None # CREATED WHEN THE FIRST SEQUENCE IS SEEN
+
+    if nWorkers!=1: # PARSE IN PARALLEL, THEN SAVE THE BLOCKS IN FILE ORDER
       try:
-        seqidmap[i].length = seqInfo.length
-      except OverflowError:
-        raise OverflowError('''Sequence too long for 32 bit int: %s, %d
-Something is probably wrong with creation / reading of this sequence.
-Check the input!''' % (pythonStr, seqInfo.length))
-      i=i+1
-    qsort(seqidmap,nseq0,sizeof(SeqIDMap),seqidmap_qsort_cmp) # SORT BY id
-    ns=None
+        shardFiles,counts=nlmsa_utils.read_maf_files_parallel(mafFiles,
+                                    seqLengths,self.pathstem,nWorkers)
+      except:
+        self.free_seqidmap(nseq0,seqidmap)
+        raise
+      try:
+        try:
+          for shardFile in shardFiles:
+            ifile=fopen(shardFile,'rb') # binary file
+            if ifile==NULL:
+              raise IOError('unable to open file %s' % shardFile)
+            try:
+              while 1:
+                n=read_maf_block(ifile,im,4096,&block_len)
+                if n<0:
+                  raise IOError('%s: truncated or corrupted file' % shardFile)
+                elif n==0: # END OF FILE
+                  break
+                self.save_maf_block(im,n,block_len,maxint,seqidmap,
+                                    build_ifile,nbuild)
+            finally:
+              fclose(ifile)
+        except:
+          self.free_seqidmap(nseq0,seqidmap)
+          self.save_nbuild(nbuild)
+          raise
+      finally:
+        import os
+        for shardFile in shardFiles: # NO LONGER NEEDED
+          os.remove(shardFile)
+      for i from 0 <= i <256:
+        linecode_count[i]=counts[i]
+      mafFiles=() # ALREADY READ THEM ALL
 
-    im_tmp.sublist= -1 # DEFAULT
     strcpy(a_header,"a ") # MAKE C STRING 
     for filename in mafFiles:
       logger.info('Processing MAF file: ' + filename)
-      ifile=fopen(filename,'r') # text file
+      ifile=open_input_file(filename,&is_pipe,err_msg) # MAY BE gzip OR bzip2
       if ifile==NULL:
         self.free_seqidmap(nseq0,seqidmap)
         self.save_nbuild(nbuild)
-        raise IOError('unable to open file %s' % filename)
-      if fgets(tmp,32767,ifile)==NULL or strncmp(tmp,"##maf",4): # HEADER LINE
+        raise IOError(err_msg)
+      p=fgets(tmp,32767,ifile)
+      if p==NULL or strncmp(tmp,"##maf",4): # HEADER LINE
         self.free_seqidmap(nseq0,seqidmap)
         self.save_nbuild(nbuild)
+        if close_input_file(ifile,is_pipe)!=0 and p==NULL: # e.g. BAD gzip FILE
+          raise IOError('error reading file %s' % filename)
         raise IOError('%s: not a MAF file? Bad format.' % filename)
       p=fgets(tmp,32767,ifile) # READ 1ST DATA LINE OF THE MAF FILE
       while p: # GOT ANOTHER LINE TO PROCESS
         if has_continuation or 0==strncmp(tmp,a_header,2): # ALIGNMENT HEADER: READ ALIGNMENT
-          n=readMAFrecord(im,0,seqidmap,nseq0,ns_lpo.length, # READ ONE MAF BLOCK
+          n=readMAFrecord(im,0,seqidmap,nseq0,0, # READ ONE MAF BLOCK
                           &block_len,ifile,4096,linecode_count,&has_continuation)
           if n<0: # UNRECOVERABLE ERROR OCCURRED...
+            close_input_file(ifile,is_pipe)
             self.free_seqidmap(nseq0,seqidmap)
             self.save_nbuild(nbuild)
             raise ValueError('MAF block too long!  Increase max size')
           elif n==0:
             continue
-
-          if self.maxlen-ns_lpo.length<=block_len \
-                 or ns_lpo.nbuild>maxint: # TOO BIG! MUST CREATE A NEW LPO
-            j=ns_lpo.length # RECORD THE OLD OFFSET
-            ns_lpo=self.newSequence() # CREATE A NEW LPO SEQUENCE
-            for i from 0<= i < n: # TRANSLATE THESE INTERVALS BACK TO ZERO OFFSET
-              if im[i].start>=0: # FORWARD INTERVAL
-                im[i].start = im[i].start - j
-                im[i].end = im[i].end - j
-              else: # REVERSE INTERVAL
-                im[i].start = im[i].start + j
-                im[i].end = im[i].end + j
-
-          for i from 0 <= i < n: # SAVE EACH INTERVAL IN UNION -> LPO MAP
-            j=im[i].target_id
-            if seqidmap[j].nlmsa_id<=0: # NEW SEQUENCE, NEED TO ADD TO UNION
-              if ns is None or self.maxlen-ns.length<=seqidmap[j].length:
-                ns=self.newSequence(None,is_union=1) # CREATE NEW UNION TO HOLD IT
-                build_ifile[ns.id]=ns.build_ifile # KEEP PTR SO WE CAN WRITE DIRECTLY!
-                nbuild[ns.id]=0
-              seqidmap[j].ns_id=ns.id # SET IDs TO ADD THIS SEQ TO THE UNION
-              seqidmap[j].nlmsa_id=self.inlmsa
-              seqidmap[j].offset=ns.length
-              self.inlmsa=self.inlmsa+1 # ADVANCE SEQUENCE ID COUNTER
-              ns.length=ns.length+seqidmap[j].length # EXPAND UNION SIZE
-              
-            im[i].target_id=seqidmap[j].nlmsa_id # USE THE CORRECT ID
-            if im[i].target_start<0: # OFFSET REVERSE ORI
-              im_tmp.start= -seqidmap[j].offset+im[i].target_start
-              im_tmp.end=   -seqidmap[j].offset+im[i].target_end
-            else: # OFFSET FORWARD ORI
-              im_tmp.start= seqidmap[j].offset+im[i].target_start
-              im_tmp.end=   seqidmap[j].offset+im[i].target_end
-            im_tmp.target_id=ns_lpo.id
-            im_tmp.target_start=im[i].start
-            im_tmp.target_end=im[i].end
-            j=seqidmap[j].ns_id # USE NLMSA ID OF THE UNION
-            ns_lpo.saveInterval(&im_tmp,1,0,build_ifile[j]) # SAVE SEQ -> LPO
-            nbuild[j]=nbuild[j]+1
-
-          ns_lpo.saveInterval(im,n,1,ns_lpo.build_ifile) # SAVE LPO -> SEQ
-          ns_lpo.nbuild=ns_lpo.nbuild+n # INCREMENT COUNT OF SAVED INTERVALS
+          self.save_maf_block(im,n,block_len,maxint,seqidmap,
+                              build_ifile,nbuild)
         if not has_continuation:
           p=fgets(tmp,32767,ifile) # TRY TO READ ANOTHER LINE...
-      fclose(ifile) # CLOSE THIS MAF FILE
+      if close_input_file(ifile,is_pipe)!=0: # CLOSE THIS MAF FILE
+        self.free_seqidmap(nseq0,seqidmap)
+        self.save_nbuild(nbuild)
+        raise IOError('error reading file %s' % filename)
       #logger.debug('nbuild[0] = ' + ns_lpo.nbuild)
     for i from 0 <= i <256: # PRINT WARNINGS ABOUT NON-ALIGNMENT LINES
       if linecode_count[i]>0:
@@ -1833,7 +2921,8 @@ Check the input!''' % (pythonStr, seqInfo.length))
     self.build() # WILL TAKE CARE OF CLOSING ALL build_ifile STREAMS
 
   cdef NLMSASequence add_seqidmap_to_union(self,int j,SeqIDMap seqidmap[],
-                                           NLMSASequence ns,FILE *build_ifile[],
+                                           NLMSASequence ns,
+                                           BuildFile *build_ifile[],
                                            int nbuild[]):
     cdef NLMSASequence ns_lpo
     if ns is None or self.maxlen-ns.length<=seqidmap[j].length:
@@ -1859,8 +2948,9 @@ Check the input!''' % (pythonStr, seqInfo.length))
     cdef FILE *ifile
     cdef IntervalMap im[4096],im_tmp
     cdef NLMSASequence ns_src # SOURCE UNION VS DEST UNION
-    cdef FILE *build_ifile[4096]
-    cdef int nbuild[4096],has_continuation
+    cdef BuildFile *build_ifile[4096]
+    cdef int nbuild[4096],has_continuation,is_pipe
+    cdef char err_msg[2048]
 
     self.pairwiseMode = 1 # WE ARE USING pairwiseMode
 
@@ -1880,11 +2970,15 @@ Check the input!''' % (pythonStr, seqInfo.length))
     import os.path
     for filename in axtFiles:
       logger.info('Processing axtnet file: ' + filename)
+      basename = os.path.basename(filename)
+      for suffix in ('.gz', '.bz2'): # COMPRESSED FILES ARE READ DIRECTLY
+        if basename.endswith(suffix):
+          basename = basename[:-len(suffix)]
       try:
-        if filename[-8:] == '.net.axt':
-          t = string.split(os.path.basename(filename)[:-8], '.')[-2:]
-        elif filename[-4:] == '.axt':
-          t = string.split(os.path.basename(filename)[:-4], '.')[-2:]
+        if basename[-8:] == '.net.axt':
+          t = string.split(basename[:-8], '.')[-2:]
+        elif basename[-4:] == '.axt':
+          t = string.split(basename[:-4], '.')[-2:]
       except:
         raise IOError('%s is not correct axtNet file name. Correct name is (chrid.)source.target.net.axt.' % filename)
       #t = prefix_fun(filename) # CALL PYTHON FUNCTION TO OBTAIN PREFIXES
@@ -1894,14 +2988,15 @@ Check the input!''' % (pythonStr, seqInfo.length))
         is_bidirectional = bidirectionalRule(t[0],t[1],self.is_bidirectional)
       strcpy(src_prefix,t[0]) # KEEP THEM IN STATIC C STRINGS FOR SPEED
       strcpy(dest_prefix,t[1])
-      ifile=fopen(filename,'r') # text file
+      ifile=open_input_file(filename,&is_pipe,err_msg) # MAY BE gzip OR bzip2
       if ifile==NULL:
         self.free_seqidmap(nseq0,seqidmap)
         self.save_nbuild(nbuild)
-        raise IOError('unable to open file %s' % filename)
+        raise IOError(err_msg)
       while True:
         n = read_axtnet(im,seqidmap,nseq0,ifile,4096,&isrc,src_prefix,dest_prefix)
         if n<0: # UNRECOVERABLE ERROR OCCURRED...
+          close_input_file(ifile,is_pipe)
           self.free_seqidmap(nseq0,seqidmap)
           self.save_nbuild(nbuild)
           raise ValueError('axtNet block too long!  Increase max size')
@@ -1960,7 +3055,10 @@ Check the input!''' % (pythonStr, seqInfo.length))
         ns_src.saveInterval(im,n,0,build_ifile[j]) # SAVE SRC -> DEST
         nbuild[j]=nbuild[j]+n # INCREMENT COUNT OF SAVED INTERVALS
 
-      fclose(ifile) # CLOSE THIS AXTNET FILE
+      if close_input_file(ifile,is_pipe)!=0: # CLOSE THIS AXTNET FILE
+        self.free_seqidmap(nseq0,seqidmap)
+        self.save_nbuild(nbuild)
+        raise IOError('error reading file %s' % filename)
 
     for i from 0 <= i <nseq0: # INDEX SEQUENCES THAT WERE ALIGNED
       if seqidmap[i].nlmsa_id>0: # ALIGNED, SO RECORD IT
@@ -1971,15 +3069,136 @@ Check the input!''' % (pythonStr, seqInfo.length))
     self.build() # WILL TAKE CARE OF CLOSING ALL build_ifile STREAMS
 
     
-  def buildFiles(self, saveSeqDict=False, **kwargs):
-    'build nestedlist databases on-disk, and .seqDict index if desired'
+  def buildFiles(self, saveSeqDict=False, nWorkers=1, projectionSeqs=(),
+                 **kwargs):
+    '''build nestedlist databases on-disk, and .seqDict index if desired.
+    nWorkers!=1 builds the indexes concurrently, see
+    nlmsa_utils.build_index_files_parallel().
+    projectionSeqs: sequences to build a projection index for,
+    see build_projection()'''
     cdef NLMSASequence ns
     self.seqs.reopenReadOnly() # SAVE INDEXES AND OPEN READ-ONLY
     ntotal = 0
+    if nWorkers!=1: # BUILD ALL THE INDEXES AT ONCE
+      ntotal = nlmsa_utils.build_index_files_parallel(self.seqlist,nWorkers,
+                                                      **kwargs)
+    for ns in self.seqlist: # BUILD EACH IntervalFileDB ONE BY ONE
+      if nWorkers!=1: # ALREADY BUILT, JUST OPEN IT
+        ns.forceLoad()
+      else:
+        ntotal = ntotal + ns.buildFiles(**kwargs)
+    self.save_index()
+    if ntotal==0:
+      raise nlmsa_utils.EmptyAlignmentError('empty alignment!')
+    self.save_attrs()
+    for seq in projectionSeqs: # SAVES attrDict AGAIN
+      self.build_projection(seq,**kwargs)
+    logger.info('Index files saved.')
+    if saveSeqDict:
+      self.save_seq_dict()
+    else:
+      logger.info('''Note: the NLMSA.seqDict was not saved to a file.
+This is not necessary if you intend to save the NLMSA to worldbase.
+But if you wish to open this NLMSA independently of worldbase,
+you should call NLMSA.save_seq_dict() to save the seqDict info to a file,
+or in the future pass the saveSeqDict=True option to NLMSA.build().''')
+
+  def build_projection(self,seq,IntervalCoord windowSize=1000000,**kwargs):
+    '''save the mappings of seq to every sequence aligned to it in an index
+    of its own, so slices of seq are found by a single query instead of a
+    join through the LPO.  The join is done in windows of windowSize
+    letters.  kwargs are passed to build_index_files().
+    Returns the number of intervals saved'''
+    cdef int i,nbuild
+    cdef IntervalCoord wstart,wstop,seqlen
+    cdef NLMSASequence ns
+    cdef NLMSASlice nlmsaSlice
+    cdef BuildFile *ifile
+    cdef char err_msg[2048]
+    if self.in_memory_mode or self.pairwiseMode==1:
+      raise ValueError('projection index requires an on-disk LPO alignment')
+    if windowSize<=0:
+      raise ValueError('windowSize must be > 0')
+    seq=seq.pathForward # PROJECT THE ENTIRE SEQUENCE
+    id,ns,offset=self.seqs[seq]
+    if id in self.projections: # REBUILD FROM THE LPO, NOT THE OLD PROJECTION
+      db=self.projections.pop(id)
+      if db is not None:
+        db.close()
+    filestem=self.pathstem+'.proj'+str(id)
+    filename=filestem+'.build'
+    ifile=open_build_file(filename,'wb',err_msg)
+    if ifile==NULL:
+      raise IOError(err_msg)
+    nbuild=0
+    pending={} # INTERVALS REACHING THE END OF THE LAST WINDOW, BY TARGET END
+    try:
+      try:
+        seqlen=len(seq)
+        wstart=0
+        while wstart<seqlen:
+          wstop=wstart+windowSize
+          if wstop>seqlen:
+            wstop=seqlen
+          nextPending={}
+          try:
+            nlmsaSlice=NLMSASlice(ns,wstart,wstop,id,offset,seq)
+          except nlmsa_utils.EmptySliceError:
+            nlmsaSlice=None
+          if nlmsaSlice is not None:
+            for i from 0 <= i < nlmsaSlice.n:
+              if self.seqlist.is_lpo(nlmsaSlice.im[i].target_id):
+                continue # ONLY PROJECT ONTO REAL SEQUENCES
+              t=(nlmsaSlice.im[i].start,nlmsaSlice.im[i].end,
+                 nlmsaSlice.im[i].target_id,nlmsaSlice.im[i].target_start,
+                 nlmsaSlice.im[i].target_end)
+              if t[0]==wstart: # JOIN TO ITS PIECE FROM THE LAST WINDOW
+                l=pending.get((t[2],t[3]),())
+                if l:
+                  t2=l.pop()
+                  t=(t2[0],t[1],t[2],t2[3],t[4])
+              if t[1]==wstop and wstop<seqlen: # MAY CONTINUE IN NEXT WINDOW
+                nextPending.setdefault((t[2],t[4]),[]).append(t)
+              else:
+                save_projection_interval(ifile,t)
+                nbuild=nbuild+1
+          for l in pending.values(): # NOT CONTINUED, SO SAVE AS IS
+            for t in l:
+              save_projection_interval(ifile,t)
+              nbuild=nbuild+1
+          pending=nextPending
+          wstart=wstop
+      except:
+        close_build_file(ifile)
+        ifile=NULL
+        import os
+        os.remove(filename)
+        raise
+    finally:
+      if ifile!=NULL:
+        i=close_build_file(ifile)
+        if i!=0:
+          raise IOError('error writing build file %s! out of disk space?'
+                        % filename)
+    build_index_files(filestem,nbuild,**kwargs)
+    self.projections[id]=None # OPEN IT WHEN FIRST QUERIED
+    self.save_attrs()
+    return nbuild
+
+  def get_projection(self,int id):
+    'get IntervalFileDB projection index for sequence nlmsaID id'
+    db=self.projections[id]
+    if db is None: # OPEN IT NOW
+      db=IntervalFileDB(self.pathstem+'.proj'+str(id),'r',self.useMmap)
+      self.projections[id]=db
+    return db
+
+  def save_index(self):
+    'save the id, name and length of each coordinate system to .NLMSAindex'
+    cdef NLMSASequence ns
     ifile=file(self.pathstem+'.NLMSAindex','w') # text file
     try:
-      for ns in self.seqlist: # BUILD EACH IntervalFileDB ONE BY ONE
-        ntotal = ntotal + ns.buildFiles(**kwargs)
+      for ns in self.seqlist:
         if ns.is_lpo:
           ifile.write('%d\t%s\t%d\t%d\n' %(ns.id,'NLMSA_LPO_Internal',0,ns.length))
         elif ns.is_union:
@@ -1988,31 +3207,32 @@ Check the input!''' % (pythonStr, seqInfo.length))
           ifile.write('%d\t%s\t%d\t%d\n' %(ns.id,ns.name,0,ns.length))
     finally:
       ifile.close()
-    if ntotal==0:
-      raise nlmsa_utils.EmptyAlignmentError('empty alignment!')
-    import sys,pickle
+
+  def save_attrs(self):
+    'save attributes restored by read_attrs() to .attrDict'
+    import pickle
     ifile = file(self.pathstem+'.attrDict','wb') # pickle is binary file!
     try:
       pickle.dump(dict(is_bidirectional=self.is_bidirectional,
-                       pairwiseMode=self.pairwiseMode),ifile)
+                       pairwiseMode=self.pairwiseMode,
+                       inlmsa=self.inlmsa,
+                       projections=self.projections.keys()),ifile)
     finally:
       ifile.close()
-    logger.info('Index files saved.')
-    if saveSeqDict:
-      self.save_seq_dict()
-    else:
-      logger.info('''Note: the NLMSA.seqDict was not saved to a file.
-This is not necessary if you intend to save the NLMSA to worldbase.
-But if you wish to open this NLMSA independently of worldbase,
-you should call NLMSA.save_seq_dict() to save the seqDict info to a file,
-or in the future pass the saveSeqDict=True option to NLMSA.build().''')
 
   def save_seq_dict(self):
     'save seqDict to a worldbase-aware pickle file'
     nlmsa_utils.save_seq_dict(self.pathstem,self.seqDict)
 
-  def build(self,**kwargs):
-    'build nestedlist databases from saved mappings and initialize for use'
+  def build(self,nWorkers=None,maxMemory=None,compress=None,**kwargs):
+    '''build nestedlist databases from saved mappings and initialize for use.
+    nWorkers: #processes for building on-disk indexes (default: the
+    nWorkers value passed to the constructor; 0 means one per CPU).
+    maxMemory: bytes each on-disk index build may use for sorting;
+    bigger indexes are sorted on disk (default: the maxMemory value
+    passed to the constructor).
+    compress: if True, save the on-disk indexes in compressed blocks
+    (default: the compress value passed to the constructor)'''
     if self.do_build==0:
       raise ValueError('not opened in write mode')
     try: # TURN OFF AUTOMATIC ADDING OF SEQUENCES TO OUR SEQDICT...
@@ -2026,7 +3246,14 @@ or in the future pass the saveSeqDict=True option to NLMSA.build().''')
       if ntotal==0:
         raise nlmsa_utils.EmptyAlignmentError('empty alignment!')
     else:
-      self.buildFiles(**kwargs)
+      if nWorkers is None:
+        nWorkers=self.nWorkers
+      if maxMemory is None:
+        maxMemory=self.maxMemory
+      if compress is None:
+        compress=self.compress
+      self.buildFiles(nWorkers=nWorkers,maxMemory=maxMemory,
+                      compress=compress,**kwargs)
     self.do_build=0
 
   def seqInterval(self,int iseq,int istart,int istop):
@@ -2044,16 +3271,171 @@ or in the future pass the saveSeqDict=True option to NLMSA.build().''')
 
 
 
-def dump_textfile(pathstem, outfilename=None):
-  'dump NLMSA binary files to a text file'
-  cdef int n,nlmsaID,nsID,offset,is_bidirectional,pairwiseMode,nprefix
+def build_index_files(filestem,int nbuild,maxMemory=None,compress=False,
+                      **kwargs):
+  '''build IntervalFileDB files for filestem from its unsorted filestem.build
+  file, then remove the .build file.  Returns nbuild.
+  If loading the intervals would take more than maxMemory bytes, sort them
+  on disk instead, in runs of at most maxMemory bytes.
+  If compress is True, store the .idb file in compressed blocks'''
+  cdef IntervalDB db
+  cdef char *err_msg
+  cdef char errbuf[1024]
+  filename=filestem+'.build'
+  if maxMemory is not None and nbuild>maxMemory/sizeof(IntervalMap):
+    err_msg=build_binary_files_external(filename,nbuild,256,maxMemory,filestem)
+    if err_msg:
+      raise IOError(err_msg)
+  else:
+    db=IntervalDB() # CREATE EMPTY NL IN MEMORY
+    if nbuild>0:
+      db.buildFromUnsortedFile(filename,nbuild,**kwargs) # BUILD FROM .build
+    db.write_binaries(filestem) # SAVE AS IntervalDBFile
+    db.close() # DUMP NESTEDLIST FROM MEMORY
+  if compress and compress_binary_files(filestem,errbuf)<0:
+    raise IOError(errbuf)
+  import os
+  os.remove(filename) # REMOVE OUR .build FILE, NO LONGER NEEDED
+  return nbuild
+
+def compact_index_files(filestem,maxMemory=None,compress=None):
+  '''merge the intervals appended to filestem.delta into the IntervalFileDB
+  files for filestem, by rebuilding them with build_index_files(), then
+  remove the .delta file.  compress=None keeps the current .idb format.
+  Close any IntervalFileDB open on filestem first.  Returns the total
+  #intervals, or None if there was nothing to merge'''
+  cdef int n,format
+  cdef char *c_filestem,*c_buildfile
+  cdef char errbuf[1024]
+  import os
+  if not os.access(filestem+'.delta',os.F_OK): # NOTHING APPENDED
+    return None
+  buildfile=filestem+'.build'
+  c_filestem=filestem
+  c_buildfile=buildfile
+  n=write_compaction_file(c_filestem,c_buildfile,&format,errbuf)
+  if n<0:
+    raise IOError(errbuf)
+  if compress is None: # KEEP THE CURRENT FORMAT
+    compress=(format==IDB_FORMAT_PACKED)
+  build_index_files(filestem,n,maxMemory,compress)
+  os.remove(filestem+'.delta') # NOW MERGED INTO THE INDEX
+  return n
+
+def find_maf_block(filename,long long offset):
+  '''get the file offset of the first MAF block starting at or after
+  offset in filename, or its size if there is none'''
+  cdef long long pos
+  cdef char err_msg[2048]
+  pos=find_maf_block_start(filename,offset,err_msg)
+  if pos<0:
+    raise IOError(err_msg)
+  return pos
+
+def is_compressed_file(filename):
+  'True if filename is gzip or bzip2 compressed'
+  cdef int compression
+  compression=input_file_compression(filename)
+  if compression<0:
+    raise IOError('unable to open file %s' % filename)
+  return compression!=INPUT_PLAIN
+
+def write_maf_shard(filename,long long start,long long end,seqLengths,
+                    shardFile):
+  '''parse the MAF blocks of filename whose "a" lines start in the byte
+  range [start,end), and save them to shardFile in a binary format read
+  by NLMSA.readMAFfiles().  start must be the offset of a block, e.g.
+  from find_maf_block(), or start=0, end= -1 to read the whole file,
+  which may be gzip or bzip2 compressed.  seqLengths is the list of (id,length) of all
+  the sequences.  Returns a list of the count of unexpected lines for
+  each line prefix character code'''
+  cdef int i,nseq,nblock
+  cdef SeqIDMap *seqidmap
+  cdef FILE *ofile
+  cdef long long linecode_count[256]
+  cdef char err_msg[2048]
+  memset(<void *>linecode_count,0,sizeof(linecode_count))
+  nseq=len(seqLengths)
+  seqidmap=new_seqidmap(seqLengths)
+  ofile=fopen(shardFile,'wb') # binary file
+  if ofile==NULL:
+    free_seqidmap_array(nseq,seqidmap)
+    raise IOError('unable to open file %s' % shardFile)
+  nblock=write_maf_blocks(filename,start,end,seqidmap,nseq,ofile,4096,
+                          linecode_count,err_msg)
+  free_seqidmap_array(nseq,seqidmap)
+  if fclose(ofile)!=0 and nblock>=0:
+    raise IOError('error writing file %s! out of disk space?' % shardFile)
+  if nblock<0:
+    raise IOError(err_msg)
+  l=[]
+  for i from 0 <= i <256:
+    l.append(linecode_count[i])
+  return l
+
+def set_sort_threads(int nthreads):
+  '''set #threads used to sort very large nested list builds (a million
+  or more intervals) in this process.  Returns the previous setting'''
+  return c_set_sort_threads(nthreads)
+
+def set_block_cache_size(long nbytes):
+  '''set the #bytes of IntervalFileDB blocks cached in memory, shared by
+  all on-disk databases (and so all NLMSA) in this process.  Least recently
+  used blocks are evicted first; 0 disables the cache.  Returns the
+  previous setting'''
+  if nbytes<0:
+    raise ValueError('cache size must be >= 0')
+  return c_set_block_cache_size(nbytes)
+
+def get_block_cache_stats():
+  'get dict of block cache hits, misses, evictions, nblocks, size and maxSize'
+  cdef BlockCacheStats stats
+  c_get_block_cache_stats(&stats)
+  return dict(hits=stats.hits,misses=stats.misses,evictions=stats.evictions,
+              nblocks=stats.nblocks,size=stats.size,maxSize=stats.max_size)
+
+def clear_block_cache():
+  'empty the block cache and reset its counters'
+  c_clear_block_cache()
+
+def set_file_pool_size(int maxOpen):
+  '''set the maximum #files kept open by the file pool shared by all
+  IntervalFileDB and NLMSA .build files in this process.  Least recently
+  used files are closed first, and reopened when needed; 0 means no
+  limit.  Returns the previous setting'''
+  if maxOpen<0:
+    raise ValueError('file pool size must be >= 0')
+  return c_set_file_pool_size(maxOpen)
+
+def after_fork():
+  '''close the files open in the file pool, to be reopened when needed.
+  Call this in a child process after fork() if the C library could not
+  arrange it automatically (it does wherever pthread_atfork() exists).
+  Returns the number of files closed'''
+  return c_file_pool_after_fork()
+
+def get_file_pool_stats():
+  'get dict of file pool nfiles, nopen, maxOpen and reopens'
+  cdef FilePoolStats stats
+  c_get_file_pool_stats(&stats)
+  return dict(nfiles=stats.nfiles,nopen=stats.nopen,maxOpen=stats.max_open,
+              reopens=stats.reopens)
+
+
+def dump_textfile(pathstem, outfilename=None, compress=None):
+  '''dump NLMSA binary files to a text file.  The offset of each
+  NLMSASequence section is saved in outfilename.sections, so that
+  textfile_to_binaries() can convert them in parallel.  compress='gzip'
+  or 'bzip2' compresses each section as a separate stream.'''
+  cdef int n,nlmsaID,nsID,is_bidirectional,pairwiseMode,nprefix
+  cdef long long offset
   cdef FILE *outfile
   cdef char err_msg[2048],tmp[2048],seqDictID[256]
   err_msg[0] = 0 # ENSURE STRING IS EMPTY
   if outfilename is None:
     outfilename = pathstem+'.txt' # DEFAULT TEXTFILE NAME
-  import classutil,pickle,sys # NEED TO COPY THE WHOLE seqIDdict
-  seqIDdict = classutil.open_shelve(pathstem+'.seqIDdict','r')
+  import pickle,sys # NEED TO COPY THE WHOLE seqIDdict
+  seqIDdict = nlmsa_utils.open_seq_id_dict(pathstem)
   n = len(seqIDdict)
   seqDict = nlmsa_utils.read_seq_dict(pathstem) 
   try: # OBTAIN PREFIX INFO FOR SEQDICT
@@ -2080,13 +3462,14 @@ seqDict argument to textfile_to_binaries() on the destination machine.''')
     d = {}
   is_bidirectional = d.get('is_bidirectional',-1)
   pairwiseMode = d.get('pairwiseMode',-1)
-  outfile=fopen(outfilename,"w") # text file
-  import os.path
+  import os
+  if os.access(outfilename+'.sections',os.F_OK): # DON'T LEAVE A STALE LIST
+    os.remove(outfilename+'.sections')
+  writer=nlmsa_utils.TextfileSectionWriter(outfilename,compress)
   basestem=os.path.basename(pathstem) # GET RID OF PATH INFO
   strcpy(tmp,basestem) # COPY TO C STRING SO WE CAN fprintf
-  if outfile==NULL:
-    raise IOError('unable to open file %s' %outfilename)
   try:
+    outfile=PyFile_AsFile(writer.start())
     if fprintf(outfile,"PATHSTEM\t%s\t%d\t%d\t%d\t%d\t%s\n",tmp,n,
                is_bidirectional,pairwiseMode,nprefix,seqDictID)<0:
       raise IOError('error writing to file %s' %outfilename)
@@ -2113,7 +3496,7 @@ to textfile_to_binaries() on the destination machine.''')
       nlmsaID=t[0]
       nsID=t[1]
       offset=t[2]
-      if fprintf(outfile,"SEQID\t%s\t%d\t%d\t%d\n",tmp,
+      if fprintf(outfile,"SEQID\t%s\t%d\t%d\t%lld\n",tmp,
                  nlmsaID,nsID,offset)<0:
         raise IOError('error writing to file %s' %outfilename)
     try:
@@ -2121,36 +3504,90 @@ to textfile_to_binaries() on the destination machine.''')
     except IOError:
       ifile = file(pathstem+'NLMSAindex', 'rU')
   except:
-    fclose(outfile)
+    writer.abort()
     raise
+  sections=[]
   try:
-    for line in ifile:  # NOW SAVE THE NLMSA DATA
-      id,name,is_union,length=line.strip().split('\t')
-      strcpy(tmp,line) # COPY TO C STRING SO WE CAN fprintf
-      if fprintf(outfile,"NLMSASequence\t%s",tmp)<0:
-        raise IOError('error writing file %s'%outfilename)
-      mypath=pathstem+id
-      mybase=basestem+id
-      if save_text_file(mypath,mybase,err_msg,outfile)!=0:
-        raise IOError(err_msg)
+    try:
+      for line in ifile:  # NOW SAVE THE NLMSA DATA
+        id,name,is_union,length=line.strip().split('\t')
+        outfile=PyFile_AsFile(writer.start()) # EACH IN ITS OWN SECTION
+        sections.append((writer.offsets[-1],line))
+        strcpy(tmp,line) # COPY TO C STRING SO WE CAN fprintf
+        if fprintf(outfile,"NLMSASequence\t%s",tmp)<0:
+          raise IOError('error writing file %s'%outfilename)
+        mypath=pathstem+id
+        mybase=basestem+id
+        if save_text_file(mypath,mybase,err_msg,outfile)!=0:
+          raise IOError(err_msg)
+      writer.close()
+    except:
+      writer.abort()
+      raise
   finally:
-    fclose(outfile)
     ifile.close()
+  nlmsa_utils.write_textfile_sections(outfilename,sections)
+
 
+cdef object open_textfile_section(filename,long long offset,length=None):
+  '''open NLMSA textfile filename for reading from offset, decompressing
+  its next length bytes (None: to the end of the file) if it is
+  compressed.  Returns (ifile,proc), where proc is the decompressing
+  process or None.'''
+  cdef int compression
+  compression=input_file_compression(filename)
+  if compression<0:
+    raise IOError('unable to open file %s' %filename)
+  if compression==INPUT_PLAIN:
+    ifile=file(filename,'rb')
+    ifile.seek(offset)
+    return ifile,None
+  if compression==INPUT_GZIP:
+    proc=nlmsa_utils.decompress_from(filename,offset,'gzip',length)
+  else:
+    proc=nlmsa_utils.decompress_from(filename,offset,'bzip2',length)
+  return proc.stdout,proc
 
-def textfile_to_binaries(filename,seqDict=None,prefixDict=None,buildpath=''):
-  'convert pathstem.txt textfile to NLMSA binary files'
-  cdef int i,n,nlmsaID,nsID,offset,is_bidirectional,pairwiseMode,nprefix
+cdef int close_textfile_section(ifile,proc) except -1:
+  ifile.close()
+  if proc is not None: # WE MAY STOP READING BEFORE THE END OF ITS OUTPUT,
+    proc.wait() # SO IGNORE ITS EXIT STATUS
+    import os
+    os.waitpid(proc.feederPid,0)
+  return 0
+
+
+def textfile_to_binaries(filename,seqDict=None,prefixDict=None,buildpath='',
+                         nWorkers=1):
+  '''convert pathstem.txt textfile to NLMSA binary files.  The textfile
+  may be gzip or bzip2 compressed.  If it has a .sections list (see
+  dump_textfile()), nWorkers processes (0 means one per CPU) convert
+  its NLMSASequence sections in parallel.'''
+  cdef int i,n,nlmsaID,nsID,is_bidirectional,pairwiseMode,nprefix,is_pipe
+  cdef long long offset
   cdef FILE *infile
   cdef char err_msg[2048],line[32768],tmp[2048],basestem[2048],seqDictID[2048]
+  n=nlmsaID=nsID=0 # SET BY sscanf() BELOW
+  offset=0
   if seqDict is not None:
     ignorePrefix = True
   else:
     ignorePrefix = False
   err_msg[0]=0 # ENSURE STRING IS EMPTY
-  infile=fopen(filename,"r") # text file
-  if infile==NULL:
-    raise IOError('unable to open file %s' %filename)
+  import os
+  if nWorkers!=1 and os.access(filename+'.sections',os.R_OK):
+    sections=nlmsa_utils.read_textfile_sections(filename)
+    headerLength=None
+    if sections: # THE HEADER ENDS WHERE THE FIRST SECTION STARTS
+      headerLength=sections[0][0]
+    headerFile,proc=open_textfile_section(filename,0,headerLength)
+    infile=PyFile_AsFile(headerFile)
+  else: # READ THE WHOLE FILE IN THIS PROCESS
+    sections=None
+    infile=open_input_file(filename,&is_pipe,err_msg) # text file
+    if infile==NULL:
+      raise IOError(err_msg)
+  i=0
   try:
     if fgets(line,32767,infile)==NULL:
       raise IOError('error or EOF reading %s'%filename)
@@ -2173,9 +3610,8 @@ def textfile_to_binaries(filename,seqDict=None,prefixDict=None,buildpath=''):
     elif 0!=strcmp(tmp,"None"): # try obtaining as worldbase ID
       from pygr import worldbase
       seqDict = worldbase(tmp)
-    import classutil,pickle # CREATE THE seqIDdict
-    seqIDdict = classutil.open_shelve(basestem+'.seqIDdict','n')
-    IDdict = classutil.open_shelve(basestem+'.idDict','n')
+    import pickle
+    seqIDdict = {} # SAVED AS THE .seqIndex BELOW
     d = {}
     if is_bidirectional != -1:
       d['is_bidirectional'] = is_bidirectional
@@ -2213,13 +3649,11 @@ dictionary argument: %s''' % missing)
     for i from 0 <= i <n: # seqIDDict READING
       if fgets(line,32767,infile)==NULL:
         raise IOError('error or EOF reading %s'%filename)
-      if 4!=sscanf(line,"SEQID\t%s\t%d %d %d",tmp,
+      if 4!=sscanf(line,"SEQID\t%s\t%d %d %lld",tmp,
                    &nlmsaID,&nsID,&offset):
         raise IOError('bad format in %s'%filename)
       seqIDdict[tmp]=(nlmsaID,nsID,offset) # SAVE THIS ENTRY
-      IDdict[str(nlmsaID)]=(tmp,nsID)
-    seqIDdict.close() # DONE WRITING THE seqIDdict
-    IDdict.close() # DONE WRITING THE seqIDdict
+    nlmsa_utils.write_seq_index(basestem+'.seqIndex',seqIDdict)
 
     NLMSAindexText = ''
     if buildpath!='': # USER-SPECIFIED PATH FOR BINARIES
@@ -2228,18 +3662,55 @@ dictionary argument: %s''' % missing)
       strcpy(basestem,buildpath2) # COPY BACK TO C STRING USABLE IN C FUNCTIONS
     else:
       strcpy(basestem,'') # JUST USE BLANK STRING TO SAVE IN CURRENT DIRECTORY
-    import sys
-    while fgets(line,32767,infile)!=NULL:
-      s=line # CONVERT STRING TO PYTHON OBJECT
-      if not s.startswith('NLMSASequence'):
-        raise IOError('bad format in file %s'%filename)
-      NLMSAindexText = NLMSAindexText + s[14:] # JUST SAVE THE DATA FIELDS
-      logger.info('Saving NLMSA binary index: ' + s[14:] + '...')
-      if text_file_to_binaries(infile,basestem,err_msg)<0:
-        raise IOError(err_msg)
+    if sections is not None: # CONVERT EACH SECTION IN A WORKER PROCESS
+      offsets=[]
+      for offset,s in sections:
+        offsets.append(offset)
+        NLMSAindexText = NLMSAindexText + s
+      nlmsa_utils.textfile_sections_to_binaries(filename,offsets,basestem,
+                                                nWorkers)
+    else:
+      while fgets(line,32767,infile)!=NULL:
+        s=line # CONVERT STRING TO PYTHON OBJECT
+        if not s.startswith('NLMSASequence'):
+          raise IOError('bad format in file %s'%filename)
+        NLMSAindexText = NLMSAindexText + s[14:] # JUST SAVE THE DATA FIELDS
+        logger.info('Saving NLMSA binary index: ' + s[14:] + '...')
+        if text_file_to_binaries(infile,basestem,err_msg)<0:
+          raise IOError(err_msg)
     ifile = file(buildpath1+'.NLMSAindex',"w") # text file
     ifile.write(NLMSAindexText) # LAST, WRITE TOP INDEX FILE
     ifile.close()
   finally:
-    fclose(infile)
+    if sections is None:
+      i=close_input_file(infile,is_pipe)
+    else:
+      i=close_textfile_section(headerFile,proc)
+  if i!=0:
+    raise IOError('error reading file %s' % filename)
   return buildpath1 # ACTUAL PATH TO NLMSA INDEX FILESET
+
+
+def textfile_section_to_binaries(filename,long long offset,buildpath,
+                                 length=None):
+  '''convert the NLMSASequence section starting at offset in NLMSA
+  textfile filename to binary index files in directory buildpath
+  (which must be '' or end in a directory separator).  A compressed
+  section is decompressed from offset, reading only its length bytes
+  (None: to the end of the file).'''
+  cdef FILE *infile
+  cdef char err_msg[2048],line[32768]
+  err_msg[0]=0 # ENSURE STRING IS EMPTY
+  ifile,proc=open_textfile_section(filename,offset,length)
+  try:
+    infile=PyFile_AsFile(ifile)
+    if fgets(line,32767,infile)==NULL or \
+           strncmp(line,"NLMSASequence\t",14)!=0:
+      raise IOError('bad format in file %s at offset %d'%(filename,offset))
+    s=line # CONVERT STRING TO PYTHON OBJECT
+    logger.info('Saving NLMSA binary index: ' + s[14:] + '...')
+    if text_file_to_binaries(infile,buildpath,err_msg)<0:
+      raise IOError(err_msg)
+  finally:
+    close_textfile_section(ifile,proc)
+  return s[14:]
@@ -10,10 +10,43 @@
    back to regular fseek version.  On other platforms use POSIX fseeko */
 #ifdef __MSVCRT__
 #define PYGR_FSEEK(IFILE,OFFSET,WHENCE) fseeko64(IFILE,OFFSET,WHENCE)
+#define PYGR_FTELL(IFILE) ftello64(IFILE)
 #elif defined(_WIN32)
 #define PYGR_FSEEK(IFILE,OFFSET,WHENCE) fseek(IFILE,OFFSET,WHENCE)
+#define PYGR_FTELL(IFILE) ftell(IFILE)
 #else
 #define PYGR_FSEEK(IFILE,OFFSET,WHENCE) fseeko(IFILE,OFFSET,WHENCE)
+#define PYGR_FTELL(IFILE) ftello(IFILE)
+#endif
+
+/* READ-ONLY MEMORY MAPPING OF DATABASE FILES IS AVAILABLE ON POSIX ONLY */
+#ifndef _WIN32
+#define PYGR_HAVE_MMAP 1
+#endif
+
+/* READING COMPRESSED MAF / axtNet FILES THROUGH gzip / bzip2: POSIX ONLY */
+#ifndef _WIN32
+#define PYGR_HAVE_POPEN 1
+#endif
+
+/* fork() SHARES OPEN FILE POSITIONS WITH THE CHILD: POSIX ONLY */
+#ifndef _WIN32
+#define PYGR_HAVE_FORK 1
+#endif
+
+/* THREADED SORTING FOR LARGE NESTED LIST BUILDS: POSIX ONLY */
+#ifndef _WIN32
+#define PYGR_HAVE_PTHREAD 1
+#endif
+
+/* CUSTOM STDIO STREAMS, USED TO READ COMPRESSED .idb FILES TRANSPARENTLY */
+#if defined(__linux__)
+#ifndef _GNU_SOURCE
+#define _GNU_SOURCE 1
+#endif
+#define PYGR_HAVE_FOPENCOOKIE 1
+#elif defined(__APPLE__) || defined(__FreeBSD__) || defined(__NetBSD__) || defined(__OpenBSD__)
+#define PYGR_HAVE_FUNOPEN 1
 #endif
 
 #ifdef BUILD_C_LIBRARY
@@ -1,14 +1,29 @@
 
 #include "intervaldb.h"
+#ifdef PYGR_HAVE_MMAP
+#include <sys/types.h>
+#include <sys/stat.h>
+#include <sys/mman.h>
+#include <fcntl.h>
+#include <unistd.h>
+#endif
+#ifdef PYGR_HAVE_FORK
+#include <unistd.h>
+#endif
+#ifdef PYGR_HAVE_PTHREAD
+#include <pthread.h>
+#endif
 
 int C_int_max=INT_MAX; /* KLUDGE TO LET PYREX CODE ACCESS VALUE OF INT_MAX MACRO */
+IntervalCoord C_coord_max=INTERVAL_COORD_MAX; /* LARGEST REPRESENTABLE COORDINATE */
 
 IntervalMap *read_intervals(int n,FILE *ifile)
 {
   int i=0;
   IntervalMap *im=NULL;
   CALLOC(im,n,IntervalMap); /* ALLOCATE THE WHOLE ARRAY */
-  while (i<n && fscanf(ifile," %d %d %d %d %d",&im[i].start,&im[i].end,
+  while (i<n && fscanf(ifile," "COORD_FMT" "COORD_FMT" %d "COORD_FMT" "COORD_FMT,
+		       &im[i].start,&im[i].end,
 		       &im[i].target_id,&im[i].target_start,
 		       &im[i].target_end)==5) {
     im[i].sublist= -1; /* DEFAULT: NO SUBLIST */
@@ -48,7 +63,7 @@ int imstart_qsort_cmp(const void *void_a,const void *void_b)
 #ifdef MERGE_INTERVAL_ORIENTATIONS
 int im_qsort_cmp(const void *void_a,const void *void_b)
 { /* MERGE FORWARD AND REVERSE INTERVALS AS IF THEY WERE ALL IN FORWARD ORI */
-  int a_start,a_end,b_start,b_end;
+  IntervalCoord a_start,a_end,b_start,b_end;
   IntervalMap *a=(IntervalMap *)void_a,*b=(IntervalMap *)void_b;
   SET_INTERVAL_POSITIVE(*a,a_start,a_end);
   SET_INTERVAL_POSITIVE(*b,b_start,b_end);
@@ -98,6 +113,110 @@ int target_qsort_cmp(const void *void_a,const void *void_b)
 }
 
 
+
+static int C_sort_nthreads=1; /* #THREADS sort_intervals() MAY USE */
+#define PARALLEL_SORT_MIN 1000000 /* BELOW THIS SIZE PLAIN qsort IS FASTER */
+
+int set_sort_threads(int nthreads)
+{ /* SET #THREADS FOR SORTING LARGE BUILDS, RETURN THE OLD SETTING */
+  int old=C_sort_nthreads;
+  C_sort_nthreads = nthreads>1 ? nthreads : 1;
+  return old;
+}
+
+
+#ifdef PYGR_HAVE_PTHREAD
+typedef struct {
+  IntervalMap *im; /* BLOCK TO SORT, OR TWO SORTED RUNS TO MERGE */
+  IntervalMap *tmp; /* MERGE SPACE, SAME SIZE AS im; NULL MEANS SORT */
+  int n;
+  int nleft; /* LENGTH OF THE FIRST RUN WHEN MERGING */
+  int (*cmp)(const void *,const void *);
+} SortTask;
+
+static void *run_sort_task(void *arg)
+{
+  SortTask *t=(SortTask *)arg;
+  int i=0,j,k=0;
+  if (t->tmp==NULL) { /* SORT ONE BLOCK */
+    qsort(t->im,t->n,sizeof(IntervalMap),t->cmp);
+    return NULL;
+  }
+  j=t->nleft; /* MERGE im[0:nleft] WITH im[nleft:n] */
+  while (i<t->nleft && j<t->n) {
+    if ((t->cmp)(t->im+j,t->im+i)<0)
+      t->tmp[k++]=t->im[j++];
+    else
+      t->tmp[k++]=t->im[i++];
+  }
+  while (i<t->nleft)
+    t->tmp[k++]=t->im[i++];
+  while (j<t->n)
+    t->tmp[k++]=t->im[j++];
+  memcpy(t->im,t->tmp,t->n*sizeof(IntervalMap));
+  return NULL;
+}
+
+static int run_sort_tasks(SortTask task[],int ntask)
+{ /* RUN TASKS IN THREADS, RUNNING ANY WE CAN'T START IN THIS THREAD */
+  int i;
+  pthread_t thread[64];
+  int started[64];
+  for (i=1;i<ntask;i++)
+    started[i]= (0==pthread_create(thread+i,NULL,run_sort_task,task+i));
+  run_sort_task(task);
+  for (i=1;i<ntask;i++) {
+    if (started[i])
+      pthread_join(thread[i],NULL);
+    else
+      run_sort_task(task+i);
+  }
+  return ntask;
+}
+#endif
+
+
+int sort_intervals(IntervalMap im[],int n,
+		   int (*cmp)(const void *,const void *))
+{ /* qsort im[0:n], SPLITTING LARGE ARRAYS ACROSS C_sort_nthreads THREADS:
+     EACH THREAD SORTS ONE BLOCK, THEN BLOCKS ARE MERGED PAIRWISE */
+#ifdef PYGR_HAVE_PTHREAD
+  int i,nblock,width,ntask,start[65];
+  IntervalMap *tmp=NULL;
+  SortTask task[64];
+  nblock=C_sort_nthreads;
+  if (nblock>64)
+    nblock=64;
+  if (nblock>1 && n>=PARALLEL_SORT_MIN
+      && (tmp=(IntervalMap *)malloc(n*sizeof(IntervalMap)))) {
+    for (i=0;i<=nblock;i++) /* BLOCK BOUNDARIES */
+      start[i]=(int)(((long long)n*i)/nblock);
+    for (i=0;i<nblock;i++) {
+      task[i].im=im+start[i];
+      task[i].tmp=NULL;
+      task[i].n=start[i+1]-start[i];
+      task[i].cmp=cmp;
+    }
+    run_sort_tasks(task,nblock);
+    for (width=1;width<nblock;width*=2) { /* MERGE PAIRS OF SORTED RUNS */
+      for (i=ntask=0;i+width<nblock;i+=2*width,ntask++) {
+	task[ntask].im=im+start[i];
+	task[ntask].tmp=tmp+start[i];
+	task[ntask].nleft=start[i+width]-start[i];
+	task[ntask].n=start[(i+2*width<nblock) ? i+2*width : nblock]-start[i];
+	task[ntask].cmp=cmp;
+      }
+      run_sort_tasks(task,ntask);
+    }
+    free(tmp);
+    return n;
+  }
+#endif
+  qsort(im,n,sizeof(IntervalMap),cmp); /* SINGLE THREADED */
+  return n;
+}
+
+
 SublistHeader *build_nested_list_inplace(IntervalMap im[],int n,
 					 int *p_n,int *p_nlists)
 {
@@ -108,9 +227,9 @@ SublistHeader *build_nested_list_inplace(IntervalMap im[],int n,
   reorient_intervals(n,im,1); /* FORCE ALL INTERVALS INTO POSITIVE ORI */
 #endif
 #ifdef MERGE_INTERVAL_ORIENTATIONS
-  qsort(im,n,sizeof(IntervalMap),im_qsort_cmp); /* SORT BY start, CONTAINMENT */
+  sort_intervals(im,n,im_qsort_cmp); /* SORT BY start, CONTAINMENT */
 #else
-  qsort(im,n,sizeof(IntervalMap),imstart_qsort_cmp); /* SORT BY start, CONTAINMENT */
+  sort_intervals(im,n,imstart_qsort_cmp); /* SORT BY start, CONTAINMENT */
 #endif
   nlists=1;
   for(i=1;i<n;++i){
@@ -186,7 +305,7 @@ SublistHeader *build_nested_list_inplace(IntervalMap im[],int n,
 
   /* SUBHEADER.START IS NOW ABS POSITION OF PARENT */
 
-  qsort(im,n,sizeof(IntervalMap),sublist_qsort_cmp);
+  sort_intervals(im,n,sublist_qsort_cmp);
   /* AT THIS POINT SUBLISTS ARE GROUPED TOGETHER, READY TO PACK */
 
   isublist=0;
@@ -230,9 +349,9 @@ SublistHeader *build_nested_list(IntervalMap im[],int n,
   reorient_intervals(n,im,1); /* FORCE ALL INTERVALS INTO POSITIVE ORI */
 #endif
 #ifdef MERGE_INTERVAL_ORIENTATIONS
-  qsort(im,n,sizeof(IntervalMap),im_qsort_cmp); /* SORT BY start, CONTAINMENT */
+  sort_intervals(im,n,im_qsort_cmp); /* SORT BY start, CONTAINMENT */
 #else
-  qsort(im,n,sizeof(IntervalMap),imstart_qsort_cmp); /* SORT BY start, CONTAINMENT */
+  sort_intervals(im,n,imstart_qsort_cmp); /* SORT BY start, CONTAINMENT */
 #endif
   while (i<n) { /* TOP LEVEL LIST SCAN */
     parent=i;
@@ -316,7 +435,7 @@ IntervalMap *interval_map_alloc(int n)
 
 
 
-int find_overlap_start(int start,int end,IntervalMap im[],int n)
+int find_overlap_start(IntervalCoord start,IntervalCoord end,IntervalMap im[],int n)
 {
   int l=0,mid,r;
 
@@ -337,7 +456,7 @@ int find_overlap_start(int start,int end,IntervalMap im[],int n)
 
 
 
-int find_index_start(int start,int end,IntervalIndex im[],int n)
+int find_index_start(IntervalCoord start,IntervalCoord end,IntervalIndex im[],int n)
 {
   int l=0,mid,r;
 
@@ -354,7 +473,7 @@ int find_index_start(int start,int end,IntervalIndex im[],int n)
 
 
 
-int find_suboverlap_start(int start,int end,int isub,IntervalMap im[],
+int find_suboverlap_start(IntervalCoord start,IntervalCoord end,int isub,IntervalMap im[],
 			  SublistHeader subheader[],int nlists)
 {
   int i;
@@ -391,13 +510,15 @@ IntervalIterator *reset_interval_iterator(IntervalIterator *it)
 {
   ITERATOR_STACK_TOP(it);
   it->n=0;
+  it->in_delta=0;
   return it;
 }
 
 
 void reorient_intervals(int n,IntervalMap im[],int ori_sign)
 {
-  int i,tmp;
+  int i;
+  IntervalCoord tmp;
   for (i=0;i<n;i++) {
     if ((im[i].start>=0 ? 1:-1)!=ori_sign) { /* ORIENTATION MISMATCH */
       tmp=im[i].start; /* SO REVERSE THIS INTERVAL MAPPING */
@@ -410,7 +531,7 @@ void reorient_intervals(int n,IntervalMap im[],int ori_sign)
   }
 }
 
-int find_intervals(IntervalIterator *it0,int start,int end,
+int find_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,
 		   IntervalMap im[],int n,
 		   SublistHeader subheader[],int nlists,
 		   IntervalMap buf[],int nbuf,
@@ -418,6 +539,7 @@ int find_intervals(IntervalIterator *it0,int start,int end,
 {
   IntervalIterator *it=NULL,*it2=NULL;
   int ibuf=0,j,k,ori_sign=1;
+  IntervalCoord tmp;
   if (!it0) { /* ALLOCATE AN ITERATOR IF NOT SUPPLIED*/
     CALLOC(it,1,IntervalIterator);
   }
@@ -426,9 +548,9 @@ int find_intervals(IntervalIterator *it0,int start,int end,
 
 #if defined(ALL_POSITIVE_ORIENTATION) || defined(MERGE_INTERVAL_ORIENTATIONS)
   if (start<0) { /* NEED TO CONVERT TO POSITIVE ORIENTATION */
-    j=start;
+    tmp=start;
     start= -end;
-    end= -j;
+    end= -tmp;
     ori_sign = -1;
   }
 #endif
@@ -471,6 +593,445 @@ int find_intervals(IntervalIterator *it0,int start,int end,
 
 
 
+/* FIRST INDEX i>=lo IN im[] WHOSE END LIES ABOVE start */
+static int find_end_above(IntervalCoord start,IntervalMap im[],int lo,int n)
+{
+  int mid,r=n;
+  while (lo<r) {
+    mid=(lo+r)/2;
+    if (END_POSITIVE(im[mid])<=start)
+      lo=mid+1;
+    else
+      r=mid;
+  }
+  return lo;
+}
+
+
+/* APPEND ALL HITS OF [start,end) (start>=0) IN im[] TO *p_buf[nhit:],
+   GROWING *p_buf AS NEEDED.  *p_lo AND sub_lo[k] ARE THE FIRST INDEX THAT
+   CAN STILL OVERLAP IN THE TOP-LEVEL LIST AND IN SUBLIST k; THEY ONLY MOVE
+   FORWARD, SO QUERIES SORTED BY start SWEEP EACH LIST ONCE.
+   RETURNS THE NEW #HITS, OR -1 ON MEMORY ERROR */
+static int find_intervals_sweep(IntervalCoord start,IntervalCoord end,
+				IntervalMap im[],int n,
+				SublistHeader subheader[],int *p_lo,int sub_lo[],
+				IntervalIterator *it,IntervalMap **p_buf,
+				int *p_nbuf,int nhit)
+{
+  IntervalIterator *it2=NULL;
+  int i,k,nsub,nhit0=nhit;
+
+  *p_lo=find_end_above(start,im,*p_lo,n);
+  it->i= *p_lo;
+  it->n=n;
+  do {
+    while (it->i<it->n && HAS_OVERLAP_POSITIVE(im[it->i],start,end)) {
+      if (nhit>= *p_nbuf) { /* MAKE ROOM FOR MORE HITS */
+	*p_nbuf= 2 * *p_nbuf;
+	REALLOC(*p_buf,*p_nbuf,IntervalMap);
+      }
+      (*p_buf)[nhit++]=im[it->i]; /* SAVE THIS HIT */
+      k=im[it->i].sublist; /* GET SUBLIST OF i IF ANY */
+      it->i++; /* ADVANCE TO NEXT INTERVAL */
+      if (k>=0) {
+	nsub=subheader[k].start+subheader[k].len; /* END OF SUBLIST */
+	i=sub_lo[k]=find_end_above(start,im,sub_lo[k],nsub);
+	if (i<nsub && HAS_OVERLAP_POSITIVE(im[i],start,end)) {
+	  PUSH_ITERATOR_STACK(it,it2,IntervalIterator); /* RECURSE TO SUBLIST */
+	  it2->i=i;
+	  it2->n=nsub;
+	  it=it2; /* PUSH THE ITERATOR STACK */
+	}
+      }
+    }
+  } while (POP_ITERATOR_STACK(it));  /* IF STACK EXHAUSTED,  EXIT */
+#if defined(ALL_POSITIVE_ORIENTATION) || defined(MERGE_INTERVAL_ORIENTATIONS)
+  reorient_intervals(nhit-nhit0,*p_buf+nhit0,1); /* MATCH QUERY ORI */
+#endif
+  return nhit;
+ handle_malloc_failure:
+  return -1;
+}
+
+
+/* RUN nquery QUERIES, REUSING A SINGLE ITERATOR STACK.  SEARCHES im[] IF
+   db_file IS NULL, OTHERWISE db_file.  IF THE SEARCH IS IN MEMORY (OR
+   MEMORY-MAPPED) AND THE QUERIES ARE ON THE FORWARD STRAND, SORTED BY
+   start, THEY ARE ANSWERED IN ONE SWEEP OF EACH NESTED LIST (SEE
+   find_intervals_sweep()); OTHERWISE EACH QUERY IS SEARCHED SEPARATELY.
+   HITS ARE APPENDED TO *p_buf (GROWN AS NEEDED, CALLER MUST FREE);
+   HITS FOR QUERY i ARE (*p_buf)[offsets[i]:offsets[i+1]].
+   RETURNS TOTAL #HITS, OR -1 ON MEMORY ERROR */
+int find_intervals_batch(int nquery,IntervalCoord starts[],IntervalCoord ends[],
+			 IntervalMap im[],int n,
+			 SublistHeader subheader[],int nlists,
+			 IntervalDBFile *db_file,
+			 IntervalMap **p_buf,int *p_nbuf,int offsets[])
+{
+  int iq,k,nhit=0,nreturn,lo=0,nbuf,sweep=0;
+  int *sub_lo=NULL;
+  IntervalIterator *it_alloc=NULL,*it=NULL;
+  IntervalMap *buf;
+
+  if (db_file && db_file->is_mapped && !db_file->delta_im) { /* MAPPED FILE: SEARCH LIKE IN-MEMORY */
+    im=db_file->im_map;
+    n=db_file->ntop;
+    subheader=db_file->subheader_map;
+    nlists=db_file->nlists;
+    db_file=NULL;
+  }
+  buf= *p_buf;
+  nbuf= *p_nbuf;
+  if (!buf || nbuf<=0) {
+    nbuf=1024;
+    CALLOC(buf,nbuf,IntervalMap);
+  }
+  CALLOC(it_alloc,1,IntervalIterator);
+
+  if (!db_file) { /* CAN SWEEP IF SORTED ON THE FORWARD STRAND */
+    sweep=1;
+    for (iq=0;iq<nquery;iq++)
+      if (starts[iq]<0 || (iq>0 && starts[iq]<starts[iq-1]))
+	sweep=0;
+    if (sweep && nlists>0) {
+      CALLOC(sub_lo,nlists,int);
+      for (k=0;k<nlists;k++) /* EACH SUBLIST CURSOR STARTS AT ITS FIRST ITEM */
+	sub_lo[k]=subheader[k].start;
+    }
+  }
+
+  for (iq=0;iq<nquery;iq++) {
+    offsets[iq]=nhit;
+    if (sweep) {
+      nhit=find_intervals_sweep(starts[iq],ends[iq],im,n,subheader,&lo,sub_lo,
+				it_alloc,&buf,&nbuf,nhit);
+      if (nhit<0)
+	goto handle_malloc_failure;
+      continue;
+    }
+    it=reset_interval_iterator(it_alloc);
+    do { /* GET ALL HITS FOR THIS QUERY */
+      if (nbuf-nhit<1024) { /* MAKE ROOM FOR ANOTHER CHUNK OF HITS */
+	nbuf=2*nbuf;
+	REALLOC(buf,nbuf,IntervalMap);
+      }
+      if (db_file) {
+	if (find_dbfile_intervals(it,starts[iq],ends[iq],db_file,buf+nhit,
+				  nbuf-nhit,&nreturn,&it))
+	  goto handle_malloc_failure;
+      }
+      else if (find_intervals(it,starts[iq],ends[iq],im,n,subheader,nlists,
+			      buf+nhit,nbuf-nhit,&nreturn,&it))
+	goto handle_malloc_failure;
+      nhit+=nreturn;
+    } while (it);
+  }
+  offsets[nquery]=nhit;
+  free_interval_iterator(it_alloc);
+  FREE(sub_lo);
+  *p_buf=buf;
+  *p_nbuf=nbuf;
+  return nhit;
+ handle_malloc_failure:
+  free_interval_iterator(it_alloc);
+  FREE(sub_lo);
+  *p_buf=buf; /* CALLER MUST STILL FREE THIS */
+  *p_nbuf=nbuf;
+  return -1;
+}
+
+
+
+static int coord_qsort_cmp(const void *void_a,const void *void_b)
+{
+  IntervalCoord a= *(IntervalCoord *)void_a,b= *(IntervalCoord *)void_b;
+  if (a<b)
+    return -1;
+  else if (a>b)
+    return 1;
+  else
+    return 0;
+}
+
+
+/* ADD d TO EVERY POSITION OF [a,b), GIVEN AS OFFSETS FROM THE START OF
+   THE REGION, IN THE binsize BINS OF depth[] */
+static void add_coverage_segment(IntervalCoord a,IntervalCoord b,int d,
+				 int binsize,int depth[])
+{
+  IntervalCoord ia,ib,k;
+  ia=a/binsize;
+  ib=(b-1)/binsize;
+  if (ia==ib) { /* SEGMENT INSIDE A SINGLE BIN */
+    depth[ia]+=d*(int)(b-a);
+    return;
+  }
+  depth[ia]+=d*(int)((ia+1)*binsize-a); /* PARTIAL FIRST BIN */
+  for (k=ia+1;k<ib;k++) /* WHOLE BINS */
+    depth[k]+=d*binsize;
+  depth[ib]+=d*(int)(b-ib*binsize); /* PARTIAL LAST BIN */
+}
+
+
+/* ADD THE COVERAGE OF hits[0:nhit] OVER [start,end) TO depth[], ONE ENTRY
+   PER binsize POSITIONS, BY SWEEPING OVER THE SORTED START AND END POINTS
+   OF THE HITS.  EACH ENTRY IS THE SUM OF THE DEPTH OVER ITS POSITIONS, SO
+   WITH binsize==1 IT IS THE #HITS COVERING THAT POSITION.  RETURNS THE
+   #HITS OVERLAPPING [start,end), OR -1 IF OUT OF MEMORY */
+int interval_coverage(IntervalMap hits[],int nhit,IntervalCoord start,
+		      IntervalCoord end,int binsize,int depth[])
+{
+  int i,j,n=0,d=0;
+  IntervalCoord x,next,*starts=NULL,*ends=NULL;
+
+  if (nhit<=0)
+    return 0;
+  CALLOC(starts,nhit,IntervalCoord);
+  CALLOC(ends,nhit,IntervalCoord);
+  for (i=0;i<nhit;i++) { /* CLIP EACH HIT TO [start,end) */
+    starts[n]= (hits[i].start>start) ? hits[i].start : start;
+    ends[n]= (hits[i].end<end) ? hits[i].end : end;
+    if (starts[n]<ends[n]) /* SKIP HITS OUTSIDE THE REGION */
+      n++;
+  }
+  qsort(starts,n,sizeof(IntervalCoord),coord_qsort_cmp);
+  qsort(ends,n,sizeof(IntervalCoord),coord_qsort_cmp);
+  i=j=0;
+  x=start;
+  while (j<n) { /* EVERY HIT ENDS AFTER IT STARTS, SO ends[] FINISHES LAST */
+    next= (i<n && starts[i]<ends[j]) ? starts[i] : ends[j];
+    if (d>0 && next>x) /* DEPTH d OVER [x,next) */
+      add_coverage_segment(x-start,next-start,d,binsize,depth);
+    for (;i<n && starts[i]==next;i++) /* APPLY ALL EVENTS AT next */
+      d++;
+    for (;j<n && ends[j]==next;j++)
+      d--;
+    x=next;
+  }
+  free(starts);
+  free(ends);
+  return n;
+ handle_malloc_failure:
+  FREE(starts);
+  return -1;
+}
+
+
+/* QUERY [start,end) IN AN IN-MEMORY NESTED LIST im (OR IN db_file IF IT IS
+   NOT NULL), AND ADD THE COVERAGE OF THE HITS TO depth[] AS FOR
+   interval_coverage() */
+int find_coverage(IntervalCoord start,IntervalCoord end,int binsize,
+		  IntervalMap im[],int n,
+		  SublistHeader subheader[],int nlists,
+		  IntervalDBFile *db_file,int depth[])
+{
+  int nhit,nbuf=0,offsets[2];
+  IntervalMap *buf=NULL;
+  nhit=find_intervals_batch(1,&start,&end,im,n,subheader,nlists,db_file,
+			    &buf,&nbuf,offsets);
+  if (nhit>0)
+    nhit=interval_coverage(buf,nhit,start,end,binsize,depth);
+  FREE(buf);
+  return nhit;
+}
+
+
+
+typedef struct { /* START OR END POINT OF AN INTERVAL, FOR group_sequences() */
+  IntervalCoord ipos;
+  int is_start;
+  int iseq;
+  int is_indel;
+  int ival;
+} GroupBound;
+
+static int group_bound_qsort_cmp(const void *void_a,const void *void_b)
+{ /* BY POSITION, ENDS BEFORE STARTS, THEN BY SEQUENCE AND INTERVAL */
+  GroupBound *a=(GroupBound *)void_a,*b=(GroupBound *)void_b;
+  if (a->ipos<b->ipos)
+    return -1;
+  else if (a->ipos>b->ipos)
+    return 1;
+  else if (a->is_start!=b->is_start)
+    return a->is_start-b->is_start;
+  else if (a->iseq!=b->iseq)
+    return a->iseq-b->iseq;
+  else if (a->is_indel!=b->is_indel)
+    return a->is_indel-b->is_indel;
+  else
+    return a->ival-b->ival;
+}
+
+
+static int save_group_interval(GroupInterval **p_result,int *p_nalloc,int n,
+			       IntervalCoord start,IntervalCoord end,
+			       IntervalCoord target_start,
+			       IntervalCoord target_end,int ival,int clip)
+{ /* APPEND ONE INTERVAL TO *p_result, GROWING IT AS NEEDED */
+  GroupInterval *g;
+  if (n>= *p_nalloc) {
+    *p_nalloc= (*p_nalloc>0) ? 2 * *p_nalloc : 64;
+    REALLOC(*p_result,*p_nalloc,GroupInterval);
+  }
+  g= *p_result+n;
+  g->start=start;
+  g->end=end;
+  g->target_start=target_start;
+  g->target_end=target_end;
+  g->ival=ival;
+  g->clip=clip;
+  return n+1;
+ handle_malloc_failure:
+  return -1;
+}
+
+
+/* GROUP THE ALIGNED INTERVALS OF nseq SEQUENCES BY SWEEPING OVER THEIR
+   SOURCE COORDINATES.  ivals[0:n] HOLDS EACH SEQUENCE'S INTERVALS IN TURN,
+   WITH target_id GIVING ITS INDEX IN THE GROUP.  REGIONS WHERE FEWER THAN
+   minAligned SEQUENCES (OR A FRACTION pMinAligned) ARE ALIGNED ARE MASKED
+   OUT.  REPORTS THE TARGET INTERVALS IN THE UNMASKED REGIONS (CLIPPED TO
+   THEM), OR IF sourceOnly, THE UNMASKED SOURCE REGIONS THEMSELVES (SPLIT AT
+   EACH INDEL IF indelCut), IN *p_result, WHICH THE CALLER MUST FREE.
+   RETURNS THE #INTERVALS REPORTED, OR -1 IF OUT OF MEMORY */
+int group_sequences(IntervalMap ivals[],int n,int nseq,int sourceOnly,
+		    int indelCut,int minAligned,double pMinAligned,
+		    GroupInterval **p_result)
+{
+  int i,j,k,nbound,nopen=0,nresult=0,nalloc=0,clip,has_mask=0;
+  int *first=NULL,*last=NULL,*nqueue=NULL,*next=NULL;
+  IntervalCoord mask_start=0,start,end=0,target_start,target_end;
+  GroupBound *bound=NULL;
+  IntervalMap *im;
+
+  *p_result=NULL;
+  if (n<=0)
+    return 0;
+  CALLOC(bound,2*n,GroupBound);
+  CALLOC(first,nseq,int);
+  CALLOC(last,nseq,int);
+  CALLOC(nqueue,nseq,int);
+  CALLOC(next,n,int);
+  for (i=0;i<n;i++) {
+    bound[2*i].ipos=ivals[i].end;
+    bound[2*i].is_start=0;
+    bound[2*i+1].ipos=ivals[i].start;
+    bound[2*i+1].is_start=1;
+    for (j=2*i;j<2*i+2;j++) {
+      bound[j].iseq=ivals[i].target_id;
+      bound[j].is_indel= (i>0 && ivals[i-1].target_id==ivals[i].target_id);
+      bound[j].ival=i;
+    }
+  }
+  nbound=2*n;
+  qsort(bound,nbound,sizeof(GroupBound),group_bound_qsort_cmp);
+
+  for (i=0;i<nbound;i++) {
+    j=bound[i].iseq;
+    if (bound[i].is_start) { /* PUSH ONTO THIS SEQUENCE'S QUEUE */
+      k=bound[i].ival;
+      next[k]= -1;
+      if (nqueue[j]++ >0)
+	next[last[j]]=k;
+      else {
+	first[j]=k;
+	nopen++;
+      }
+      last[j]=k;
+    }
+    else { /* INTERVAL END: REPORT IT, THEN POP THIS SEQUENCE'S QUEUE */
+      im=ivals+bound[i].ival;
+      start=im->start;
+      end=im->end;
+      target_start=im->target_start;
+      if (has_mask && !sourceOnly) {
+	clip=0;
+	if (mask_start>start) { /* TRUNCATE TARGET INTERVAL START */
+	  target_start+=mask_start-start;
+	  start=mask_start;
+	  clip=1;
+	}
+	nresult=save_group_interval(p_result,&nalloc,nresult,start,end,
+				    target_start,im->target_end,bound[i].ival,
+				    clip);
+	if (nresult<0)
+	  goto handle_malloc_failure;
+      }
+      if (nqueue[j]>0) {
+	if (--nqueue[j]>0)
+	  first[j]=next[first[j]];
+	else
+	  nopen--;
+      }
+    }
+
+    if (nopen<minAligned || nopen/(double)nseq<pMinAligned) { /* MASK */
+      if (has_mask) {
+	if (sourceOnly) { /* JUST SAVE MERGED SOURCE INTERVAL */
+	  nresult=save_group_interval(p_result,&nalloc,nresult,mask_start,end,
+				      0,0,-1,0);
+	  if (nresult<0)
+	    goto handle_malloc_failure;
+	}
+	else /* REPORT TARGET INTERVALS WITHIN [mask_start,end) */
+	  for (j=0;j<nseq;j++) {
+	    if (nqueue[j]<=0)
+	      continue;
+	    im=ivals+first[j];
+	    start=im->start;
+	    target_start=im->target_start;
+	    target_end=im->target_end;
+	    clip=0;
+	    if (mask_start>start) { /* TRUNCATE TARGET INTERVAL START */
+	      target_start+=mask_start-start;
+	      start=mask_start;
+	      clip=2;
+	    }
+	    if (end<im->end) { /* TRUNCATE TARGET INTERVAL END */
+	      target_end+=end-im->end;
+	      clip=2;
+	    }
+	    nresult=save_group_interval(p_result,&nalloc,nresult,start,end,
+					target_start,target_end,first[j],clip);
+	    if (nresult<0)
+	      goto handle_malloc_failure;
+	  }
+	has_mask=0; /* REGION NOW BELOW THRESHOLD */
+      }
+    }
+    else if (!has_mask) { /* START OF REGION ABOVE THRESHOLD */
+      mask_start=bound[i].ipos;
+      has_mask=1;
+    }
+    if (has_mask && sourceOnly && indelCut && bound[i].is_indel
+	&& mask_start<bound[i].ipos) { /* SPLIT SOURCE REGION AT INDEL */
+      nresult=save_group_interval(p_result,&nalloc,nresult,mask_start,
+				  bound[i].ipos,0,0,-1,0);
+      if (nresult<0)
+	goto handle_malloc_failure;
+      mask_start=bound[i].ipos;
+    }
+  }
+  free(bound);
+  free(first);
+  free(last);
+  free(nqueue);
+  free(next);
+  return nresult;
+ handle_malloc_failure:
+  FREE(bound);
+  FREE(first);
+  FREE(last);
+  FREE(nqueue);
+  FREE(next);
+  FREE(*p_result);
+  return -1;
+}
+
+
+
+
 /****************************************************************
  *
  *   FILE-BASED SEARCH FUNCTIONS
@@ -530,104 +1091,580 @@ int read_subheader_block(SublistHeader subheader[],int isub,int nblock,
 
 
 
-
-int find_file_start(IntervalIterator *it,int start,int end,int isub,
-		    IntervalIndex ii[],int nii,
-		    SublistHeader *subheader,int nlists,
-                    SubheaderFile *subheader_file,
-		    int ntop,int div,FILE *ifile)
-{
-  int i_div= -1,offset=0,offset_div=0;
-  if (isub<0)  /* TOP-LEVEL SEARCH: USE THE INDEX */
-    i_div=find_index_start(start,end,ii,nii);
-  else { /* GET PTR TO subheader[isub] */
-#ifdef ON_DEMAND_SUBLIST_HEADER
-    if (isub<subheader_file->start /* isub OUTSIDE OUR CURRENT BLOCK */
-	|| isub>=subheader_file->start+subheader_file->nblock)
-      subheader_file->start=  /* LOAD NEW BLOCK FROM DISK */
-	read_subheader_block(subheader_file->subheader,isub,
-			     subheader_file->nblock,nlists,
-			     subheader_file->ifile);
-    subheader=subheader_file->subheader + (isub-subheader_file->start);
+/* PROCESS-WIDE LRU CACHE OF THE BLOCKS READ BY find_file_intervals(),
+   SHARED BY ALL OPEN DATABASE FILES AND KEYED BY (FILE, RECORD OFFSET).
+   A FILE'S BLOCKS MUST BE DROPPED WITH block_cache_forget() BEFORE IT IS
+   CLOSED; free_interval_dbfile() DOES THIS. */
+#ifdef BUILD_C_LIBRARY
+#define BLOCK_CACHE_DEFAULT_SIZE 0 /* C PROGRAMS OPT IN */
 #else
-    subheader += isub; /* POINT TO OUR SUBHEADER */
+#define BLOCK_CACHE_DEFAULT_SIZE (32*1024*1024)
 #endif
-    if (subheader->len>div) { /* BIG SUBLIST, SO USE THE INDEX */
-      offset=subheader->start;
-      offset_div=offset/div;/* offset GUARANTEED TO BE MULTIPLE OF div */
-      ntop=subheader->len;
-      nii=ntop/div; /* CALCULATE SUBLIST INDEX SIZE */
-      if (ntop%div) /* ONE EXTRA ENTRY FOR PARTIAL BLOCK */
-	nii++;    
-      i_div=find_index_start(start,end,ii+offset_div,nii);
-    }
-  }
+#define BLOCK_CACHE_HASH_BITS 16
 
-  if (!it->im) { /* NO ALLOCATION? ALLOCATE OUR BLOCK SIZE div */
-    CALLOC(it->im,div,IntervalMap); /* ALWAYS ALLOCATE div BUFFERSIZE */
-  }
-  if (i_div>=0) { /* READ A SPECIFIC BLOCK OF SIZE div */
-    it->n=read_imdiv(ifile,it->im,div,i_div+offset_div,ntop+offset);
-    it->ntop=ntop+offset; /* END OF THIS LIST IN THE BINARY FILE */
-    it->nii=nii+offset_div; /* SAVE INFORMATION FOR READING SUBSEQUENT BLOCKS */
-    it->i_div=i_div+offset_div; /* INDEX OF THIS BLOCK IN THE BINARY FILE */
-  }
-  else { /* A SMALL SUBLIST: READ THE WHOLE LIST INTO MEMORY */
-    read_sublist(ifile,subheader,it->im); /* GUARANTEED TO BE <=div ITEMS */
-    it->n=subheader->len;
-    it->nii=1;
-    it->i_div=0; /* INDICATE THAT THERE ARE NO ADDITIONAL BLOCKS TO READ*/
-  }
+typedef struct BlockCacheEntry_S {
+  FILE *ifile;
+  PYGR_OFF_T ipos;
+  int n;
+  IntervalMap *im; /* STORED RIGHT AFTER THE ENTRY ITSELF */
+  struct BlockCacheEntry_S *prev,*next; /* LRU LIST, MOST RECENT FIRST */
+  struct BlockCacheEntry_S *hnext; /* HASH CHAIN */
+} BlockCacheEntry;
 
-  it->i=find_overlap_start(start,end,it->im,it->n);
-  return it->i;
- handle_malloc_failure:
-  return -2; /* SIGNAL THAT MEMORY ERROR OCCURRED */
+static BlockCacheEntry **C_block_cache_hash=NULL;
+static BlockCacheEntry *C_block_cache_head=NULL,*C_block_cache_tail=NULL;
+static BlockCacheStats C_block_cache={0,0,0,0,0,BLOCK_CACHE_DEFAULT_SIZE};
+
+#define BLOCK_CACHE_ENTRY_SIZE(N) (sizeof(BlockCacheEntry)+(N)*sizeof(IntervalMap))
+
+static unsigned block_cache_bucket(FILE *ifile,PYGR_OFF_T ipos)
+{
+  unsigned long long h=(unsigned long long)(size_t)ifile*31
+    +(unsigned long long)ipos;
+  return (unsigned)((h*0x9E3779B97F4A7C15ULL)>>(64-BLOCK_CACHE_HASH_BITS));
+}
+
+static void block_cache_unlink(BlockCacheEntry *e)
+{
+  if (e->prev)
+    e->prev->next=e->next;
+  else
+    C_block_cache_head=e->next;
+  if (e->next)
+    e->next->prev=e->prev;
+  else
+    C_block_cache_tail=e->prev;
 }
 
+static void block_cache_push_front(BlockCacheEntry *e)
+{
+  e->prev=NULL;
+  e->next=C_block_cache_head;
+  if (C_block_cache_head)
+    C_block_cache_head->prev=e;
+  else
+    C_block_cache_tail=e;
+  C_block_cache_head=e;
+}
 
-int find_file_intervals(IntervalIterator *it0,int start,int end,
-			IntervalIndex ii[],int nii,
-			SublistHeader subheader[],int nlists,
-			SubheaderFile *subheader_file,
-			int ntop,int div,FILE *ifile,
-			IntervalMap buf[],int nbuf,
-			int *p_nreturn,IntervalIterator **it_return)
+static void block_cache_remove(BlockCacheEntry *e)
 {
-  IntervalIterator *it=NULL,*it2=NULL;
-  int k,ibuf=0,ori_sign=1,ov=0;
-  if (!it0) { /* ALLOCATE AN ITERATOR IF NOT SUPPLIED*/
-    CALLOC(it,1,IntervalIterator);
+  BlockCacheEntry **p;
+  for (p=C_block_cache_hash+block_cache_bucket(e->ifile,e->ipos);
+       *p!=e;p= &((*p)->hnext))
+    ;
+  *p=e->hnext; /* DROP FROM ITS HASH CHAIN */
+  block_cache_unlink(e);
+  C_block_cache.size-=BLOCK_CACHE_ENTRY_SIZE(e->n);
+  C_block_cache.nblocks--;
+  free(e);
+}
+
+static void block_cache_trim(size_t max_size)
+{
+  while (C_block_cache_tail && C_block_cache.size>max_size) {
+    block_cache_remove(C_block_cache_tail); /* LEAST RECENTLY USED */
+    C_block_cache.evictions++;
   }
-  else 
-    it=it0;
+}
 
-#if defined(ALL_POSITIVE_ORIENTATION) || defined(MERGE_INTERVAL_ORIENTATIONS)
-  if (start<0) { /* NEED TO CONVERT TO POSITIVE ORIENTATION */
-    k=start;
-    start= -end;
-    end= -k;
-    ori_sign = -1;
+/* SET THE CACHE'S BYTE BUDGET, EVICTING BLOCKS IF IT SHRANK.
+   0 DISABLES THE CACHE.  RETURNS THE PREVIOUS BUDGET */
+size_t set_block_cache_size(size_t max_size)
+{
+  size_t old=C_block_cache.max_size;
+  block_cache_trim(max_size);
+  C_block_cache.max_size=max_size;
+  return old;
+}
+
+void get_block_cache_stats(BlockCacheStats *stats)
+{
+  *stats=C_block_cache;
+}
+
+/* EMPTY THE CACHE AND RESET ITS COUNTERS */
+void clear_block_cache(void)
+{
+  block_cache_trim(0);
+  C_block_cache.hits=C_block_cache.misses=C_block_cache.evictions=0;
+}
+
+void block_cache_forget(FILE *ifile)
+{
+  BlockCacheEntry *e,*e_next;
+  for (e=C_block_cache_head;e;e=e_next) {
+    e_next=e->next;
+    if (e->ifile==ifile)
+      block_cache_remove(e);
   }
+}
+
+
+
+/****************************************************************
+ *
+ *   FILE POOL: A BOUNDED SET OF OPEN FILES, SHARED BY ALL OPEN DATABASES
+ *   AND BUILD FILES.  ONCE max_open FILES ARE OPEN, THE LEAST RECENTLY
+ *   USED ONE IS CLOSED, AND REOPENED WHEN IT IS NEXT NEEDED.  SO A FILE
+ *   POINTER FROM file_pool_get() IS ONLY VALID UNTIL THE NEXT CALL FOR A
+ *   DIFFERENT FILE (EXCEPT THAT THE TWO MOST RECENT ARE ALWAYS KEPT OPEN).
+ */
+
+static FilePtrRecord *C_file_pool=NULL;
+static int C_file_pool_nalloc=0,C_file_pool_unused= -1;
+static int C_file_pool_head= -1,C_file_pool_tail= -1; /* LRU LIST, MOST RECENT FIRST */
+static FilePoolStats C_file_pool_stats={0,0,0,0};
+static int C_file_pool_forked=0; /* SET IN THE CHILD BY fork() */
+
+#ifdef PYGR_HAVE_PTHREAD
+static void file_pool_atfork_child(void)
+{
+  C_file_pool_forked=1; /* file_pool_after_fork() RUNS ON THE NEXT CALL */
+}
 #endif
 
-  if (it->n == 0)  /* DEFAULT: SEARCH THE TOP NESTED LIST */
-    if (find_file_start(it,start,end,-1,ii,nii,subheader,nlists,
-			subheader_file,ntop,div,ifile) == FIND_FILE_MALLOC_ERR)
-      goto handle_malloc_failure;
-  
-  do { /* ITERATOR STACK LOOP */
-    while (it->i_div < it->nii) { /* BLOCK ITERATION LOOP */
-      while (it->i>=0 && it->i<it->n /* INDIVIDUAL INTERVAL ITERATION LOOP */
-	     && HAS_OVERLAP_POSITIVE(it->im[it->i],start,end)) { /*OVERLAPS!*/
-	memcpy(buf+ibuf,it->im + it->i,sizeof(IntervalMap)); /*SAVE THIS HIT */
-	ibuf++;
-	k=it->im[it->i].sublist; /* GET SUBLIST OF i IF ANY */
-	it->i++; /* ADVANCE TO NEXT INTERVAL */
-	PUSH_ITERATOR_STACK(it,it2,IntervalIterator); /* RECURSE TO SUBLIST */
-	if (k>=0 && (ov=find_file_start(it2,start,end,k,ii,nii,subheader,nlists,
-					subheader_file,ntop,div,ifile))>=0)
-	  it=it2; /* PUSH THE ITERATOR STACK */
+#define FILE_POOL_CHECK_FORK() if (C_file_pool_forked) file_pool_after_fork()
+
+static void file_pool_unlink(int i)
+{
+  FilePtrRecord *r=C_file_pool+i;
+  if (r->left>=0)
+    C_file_pool[r->left].right=r->right;
+  else
+    C_file_pool_head=r->right;
+  if (r->right>=0)
+    C_file_pool[r->right].left=r->left;
+  else
+    C_file_pool_tail=r->left;
+  r->left=r->right= -1;
+}
+
+static void file_pool_push_front(int i)
+{
+  C_file_pool[i].left= -1;
+  C_file_pool[i].right=C_file_pool_head;
+  if (C_file_pool_head>=0)
+    C_file_pool[C_file_pool_head].left=i;
+  else
+    C_file_pool_tail=i;
+  C_file_pool_head=i;
+}
+
+/* CLOSE FILE i, WHICH STAYS IN THE POOL SO IT CAN BE REOPENED */
+static void file_pool_shut(int i)
+{
+  FilePtrRecord *r=C_file_pool+i;
+  if (!r->ifile)
+    return;
+  file_pool_unlink(i);
+  block_cache_forget(r->ifile); /* ITS BLOCKS ARE NOW INVALID */
+  if (fclose(r->ifile)) /* E.G. FAILED TO FLUSH A WRITE */
+    r->status= -1;
+  r->ifile=NULL;
+  C_file_pool_stats.nopen--;
+}
+
+/* CLOSE LEAST RECENTLY USED FILES UNTIL AT MOST max_open ARE OPEN */
+static void file_pool_trim(int max_open)
+{
+  while (C_file_pool_tail>=0 && C_file_pool_stats.nopen>max_open)
+    file_pool_shut(C_file_pool_tail);
+}
+
+static FILE *file_pool_fopen(FilePtrRecord *r,char mode[],char err_msg[])
+{
+  FILE *ifile;
+  if (r->format>=0) /* AN .idb FILE, WHATEVER ITS STORAGE FORMAT */
+    return open_idb_file(r->filename,r->format,r->div,err_msg);
+  ifile=fopen(r->filename,mode);
+  if (!ifile && err_msg)
+    sprintf(err_msg,"unable to open file %s",r->filename);
+  return ifile;
+}
+
+/* SET THE MAXIMUM #FILES THE POOL KEEPS OPEN, CLOSING FILES IF IT SHRANK.
+   0 MEANS NO LIMIT.  RETURNS THE PREVIOUS SETTING */
+int set_file_pool_size(int max_open)
+{
+  int old=C_file_pool_stats.max_open;
+  FILE_POOL_CHECK_FORK();
+  if (max_open<0)
+    max_open=0;
+  else if (max_open==1) /* A QUERY USES TWO FILES AT ONCE */
+    max_open=2;
+  if (max_open>0)
+    file_pool_trim(max_open);
+  C_file_pool_stats.max_open=max_open;
+  return old;
+}
+
+void get_file_pool_stats(FilePoolStats *stats)
+{
+  FILE_POOL_CHECK_FORK();
+  *stats=C_file_pool_stats;
+}
+
+/* AFTER fork(), THE CHILD SHARES THE FILE POSITIONS OF THE PARENT'S OPEN
+   FILES, SO READS IN ONE PROCESS WOULD MOVE THOSE OF THE OTHER.  CLOSE
+   ALL OF THEM IN THE CHILD, TO BE REOPENED ON DEMAND.  WRITABLE FILES ARE
+   CLOSED WITHOUT FLUSHING, SINCE THEIR BUFFERED DATA BELONGS TO THE
+   PARENT.  WHERE pthread_atfork() IS AVAILABLE THIS IS DONE AUTOMATICALLY.
+   RETURNS THE NUMBER OF FILES CLOSED */
+int file_pool_after_fork(void)
+{
+  int i,n=0;
+  FilePtrRecord *r;
+
+  C_file_pool_forked=0;
+  while ((i=C_file_pool_head)>=0) {
+    r=C_file_pool+i;
+    file_pool_unlink(i);
+    block_cache_forget(r->ifile); /* ITS BLOCKS ARE NOW INVALID */
+#ifdef PYGR_HAVE_FORK
+    if (strpbrk(r->mode,"wa+") && fileno(r->ifile)>=0)
+      close(fileno(r->ifile)); /* THE FILE STRUCTURE ITSELF IS LEAKED */
+    else
+#endif
+      fclose(r->ifile);
+    r->ifile=NULL;
+    C_file_pool_stats.nopen--;
+    n++;
+  }
+  return n;
+}
+
+/* ADD filename TO THE POOL, OPENING IT IN mode.  IF format>=0, filename IS
+   THE filestem OF AN .idb FILE TO OPEN WITH open_idb_file().  A FILE
+   OPENED FOR WRITING IS REOPENED FOR APPENDING.  RETURNS ITS HANDLE,
+   OR -1 ON ERROR */
+int file_pool_open(char filename[],char mode[],int format,int div,
+		   char err_msg[])
+{
+  int i,nalloc;
+  FilePtrRecord *r;
+
+  FILE_POOL_CHECK_FORK();
+  if (C_file_pool_unused<0) { /* GROW THE POOL */
+#ifdef PYGR_HAVE_PTHREAD
+    if (C_file_pool_nalloc==0) /* FIRST USE: WATCH FOR fork() */
+      pthread_atfork(NULL,NULL,file_pool_atfork_child);
+#endif
+    nalloc=C_file_pool_nalloc ? 2*C_file_pool_nalloc : 64;
+    REALLOC(C_file_pool,nalloc,FilePtrRecord);
+    for (i=nalloc-1;i>=C_file_pool_nalloc;i--) { /* ADD TO UNUSED LIST */
+      C_file_pool[i].ifile=NULL;
+      C_file_pool[i].filename=NULL;
+      C_file_pool[i].ihead=C_file_pool_unused;
+      C_file_pool_unused=i;
+    }
+    C_file_pool_nalloc=nalloc;
+  }
+  i=C_file_pool_unused;
+  r=C_file_pool+i;
+  i=(int)strlen(filename)+1;
+  CALLOC(r->filename,i,char);
+  strcpy(r->filename,filename);
+  sprintf(r->mode,"%.3s",mode);
+  if (r->mode[0]=='w') /* DON'T TRUNCATE IT WHEN IT IS REOPENED */
+    r->mode[0]='a';
+  r->format=format;
+  r->div=div;
+  r->status=0;
+  if (C_file_pool_stats.max_open>0) /* MAKE ROOM FOR IT */
+    file_pool_trim(C_file_pool_stats.max_open-1);
+  r->ifile=file_pool_fopen(r,mode,err_msg);
+  if (!r->ifile) {
+    FREE(r->filename);
+    return -1;
+  }
+  i=C_file_pool_unused;
+  C_file_pool_unused=r->ihead;
+  file_pool_push_front(i);
+  C_file_pool_stats.nopen++;
+  C_file_pool_stats.nfiles++;
+  return i;
+ handle_malloc_failure:
+  if (err_msg)
+    sprintf(err_msg,"out of memory opening file %s",filename);
+  return -1;
+}
+
+/* GET AN OPEN FILE POINTER FOR ihandle, REOPENING IT IF NEEDED.  THE
+   FILE POSITION IS NOT PRESERVED, SO SEEK BEFORE READING */
+FILE *file_pool_get(int ihandle,char err_msg[])
+{
+  FilePtrRecord *r=C_file_pool+ihandle;
+  FILE_POOL_CHECK_FORK();
+  if (r->ifile) {
+    if (C_file_pool_head!=ihandle) { /* NOW THE MOST RECENTLY USED */
+      file_pool_unlink(ihandle);
+      file_pool_push_front(ihandle);
+    }
+    return r->ifile;
+  }
+  if (C_file_pool_stats.max_open>0) /* MAKE ROOM FOR IT */
+    file_pool_trim(C_file_pool_stats.max_open-1);
+  r->ifile=file_pool_fopen(r,r->mode,err_msg);
+  if (!r->ifile)
+    return NULL;
+  file_pool_push_front(ihandle);
+  C_file_pool_stats.nopen++;
+  C_file_pool_stats.reopens++;
+  return r->ifile;
+}
+
+/* CLOSE ihandle AND REMOVE IT FROM THE POOL.  RETURNS -1 IF ANY CLOSE OF
+   IT FAILED, OTHERWISE 0 */
+int file_pool_close(int ihandle)
+{
+  FilePtrRecord *r=C_file_pool+ihandle;
+  FILE_POOL_CHECK_FORK();
+  file_pool_shut(ihandle);
+  FREE(r->filename);
+  r->ihead=C_file_pool_unused;
+  C_file_pool_unused=ihandle;
+  C_file_pool_stats.nfiles--;
+  return r->status;
+}
+
+
+/* OPEN A FILE FOR WRITING IntervalMap RECORDS THROUGH THE FILE POOL,
+   BUFFERING UP TO BUILD_FILE_NBUF RECORDS IN MEMORY */
+BuildFile *open_build_file(char filename[],char mode[],char err_msg[])
+{
+  BuildFile *bf=NULL;
+  CALLOC(bf,1,BuildFile);
+  bf->ihandle=file_pool_open(filename,mode,-1,0,err_msg);
+  if (bf->ihandle<0) {
+    free(bf);
+    return NULL;
+  }
+  return bf;
+ handle_malloc_failure:
+  if (err_msg)
+    sprintf(err_msg,"out of memory opening file %s",filename);
+  return NULL;
+}
+
+int flush_build_file(BuildFile *bf)
+{
+  FILE *ifile;
+  if (bf->n>0) {
+    ifile=file_pool_get(bf->ihandle,NULL);
+    if (!ifile || bf->n!=(int)fwrite(bf->im,sizeof(IntervalMap),bf->n,ifile))
+      return -1;
+    bf->n=0;
+  }
+  return 0;
+}
+
+/* RETURNS n, OR -1 ON ERROR */
+int write_build_file(BuildFile *bf,IntervalMap im[],int n)
+{
+  int nalloc;
+  FILE *ifile;
+  if (bf->n+n>bf->nalloc && bf->nalloc<BUILD_FILE_NBUF) { /* GROW BUFFER */
+    nalloc=bf->nalloc ? bf->nalloc : 16; /* SMALL AT FIRST: THERE MAY BE MANY */
+    while (nalloc<bf->n+n && nalloc<BUILD_FILE_NBUF)
+      nalloc*=2;
+    if (nalloc>BUILD_FILE_NBUF)
+      nalloc=BUILD_FILE_NBUF;
+    REALLOC(bf->im,nalloc,IntervalMap);
+    bf->nalloc=nalloc;
+  }
+  if (bf->n+n>bf->nalloc) { /* NO ROOM LEFT */
+    if (flush_build_file(bf))
+      return -1;
+    if (n>bf->nalloc) { /* TOO BIG TO BUFFER, SO JUST WRITE IT */
+      ifile=file_pool_get(bf->ihandle,NULL);
+      if (!ifile || n!=(int)fwrite(im,sizeof(IntervalMap),n,ifile))
+	return -1;
+      return n;
+    }
+  }
+  memcpy(bf->im+bf->n,im,n*sizeof(IntervalMap));
+  bf->n+=n;
+  return n;
+ handle_malloc_failure:
+  return -1;
+}
+
+/* FLUSH AND CLOSE bf, FREEING IT.  RETURNS -1 IF ANY WRITE FAILED */
+int close_build_file(BuildFile *bf)
+{
+  int status;
+  status=flush_build_file(bf);
+  if (file_pool_close(bf->ihandle))
+    status= -1;
+  FREE(bf->im);
+  free(bf);
+  return status;
+}
+
+/* READ n RECORDS STARTING AT RECORD ipos, FROM THE CACHE IF POSSIBLE.
+   A BLOCK THAT CANNOT BE CACHED IS SIMPLY READ FROM DISK */
+static int read_block_cached(FILE *ifile,PYGR_OFF_T ipos,int n,
+			     IntervalMap im[])
+{
+  unsigned ibucket;
+  BlockCacheEntry *e;
+
+  if (C_block_cache.max_size>0 && n>0) {
+    if (!C_block_cache_hash) /* ALLOCATE HASH TABLE ON FIRST USE */
+      C_block_cache_hash=(BlockCacheEntry **)
+	calloc((size_t)1<<BLOCK_CACHE_HASH_BITS,sizeof(BlockCacheEntry *));
+    if (C_block_cache_hash) {
+      ibucket=block_cache_bucket(ifile,ipos);
+      for (e=C_block_cache_hash[ibucket];e;e=e->hnext)
+	if (e->ifile==ifile && e->ipos==ipos && e->n==n) { /* HIT */
+	  memcpy(im,e->im,n*sizeof(IntervalMap));
+	  block_cache_unlink(e); /* NOW THE MOST RECENTLY USED */
+	  block_cache_push_front(e);
+	  C_block_cache.hits++;
+	  return n;
+	}
+      C_block_cache.misses++;
+    }
+  }
+
+  PYGR_FSEEK(ifile,ipos*(PYGR_OFF_T)sizeof(IntervalMap),SEEK_SET);
+  fread(im,sizeof(IntervalMap),n,ifile);
+
+  if (C_block_cache_hash && n>0
+      && BLOCK_CACHE_ENTRY_SIZE(n)<=C_block_cache.max_size
+      && NULL!=(e=(BlockCacheEntry *)malloc(BLOCK_CACHE_ENTRY_SIZE(n)))) {
+    e->ifile=ifile;
+    e->ipos=ipos;
+    e->n=n;
+    e->im=(IntervalMap *)(e+1);
+    memcpy(e->im,im,n*sizeof(IntervalMap));
+    ibucket=block_cache_bucket(ifile,ipos);
+    e->hnext=C_block_cache_hash[ibucket];
+    C_block_cache_hash[ibucket]=e;
+    block_cache_push_front(e);
+    C_block_cache.size+=BLOCK_CACHE_ENTRY_SIZE(n);
+    C_block_cache.nblocks++;
+    block_cache_trim(C_block_cache.max_size);
+  }
+  return n;
+}
+
+/* LIKE read_imdiv(), BUT THROUGH THE BLOCK CACHE */
+static int read_imdiv_cached(FILE *ifile,IntervalMap imdiv[],int div,
+			     int i_div,int ntop)
+{
+  int block;
+  PYGR_OFF_T ipos;
+  ipos=div*i_div; /* CALCULATE POSITION IN RECORDS */
+  if (ipos+div<=ntop) /* GET A WHOLE BLOCK */
+    block=div;
+  else /* JUST READ PARTIAL BLOCK AT END */
+    block=ntop%div;
+  return read_block_cached(ifile,ipos,block,imdiv);
+}
+
+
+
+
+int find_file_start(IntervalIterator *it,IntervalCoord start,IntervalCoord end,int isub,
+		    IntervalIndex ii[],int nii,
+		    SublistHeader *subheader,int nlists,
+                    SubheaderFile *subheader_file,
+		    int ntop,int div,FILE *ifile)
+{
+  int i_div= -1,offset=0,offset_div=0;
+  if (isub<0)  /* TOP-LEVEL SEARCH: USE THE INDEX */
+    i_div=find_index_start(start,end,ii,nii);
+  else { /* GET PTR TO subheader[isub] */
+#ifdef ON_DEMAND_SUBLIST_HEADER
+    if (isub<subheader_file->start /* isub OUTSIDE OUR CURRENT BLOCK */
+	|| isub>=subheader_file->start+subheader_file->nblock)
+      subheader_file->start=  /* LOAD NEW BLOCK FROM DISK */
+	read_subheader_block(subheader_file->subheader,isub,
+			     subheader_file->nblock,nlists,
+			     subheader_file->ifile);
+    subheader=subheader_file->subheader + (isub-subheader_file->start);
+#else
+    subheader += isub; /* POINT TO OUR SUBHEADER */
+#endif
+    if (subheader->len>div) { /* BIG SUBLIST, SO USE THE INDEX */
+      offset=subheader->start;
+      offset_div=offset/div;/* offset GUARANTEED TO BE MULTIPLE OF div */
+      ntop=subheader->len;
+      nii=ntop/div; /* CALCULATE SUBLIST INDEX SIZE */
+      if (ntop%div) /* ONE EXTRA ENTRY FOR PARTIAL BLOCK */
+	nii++;    
+      i_div=find_index_start(start,end,ii+offset_div,nii);
+    }
+  }
+
+  if (!it->im) { /* NO ALLOCATION? ALLOCATE OUR BLOCK SIZE div */
+    CALLOC(it->im,div,IntervalMap); /* ALWAYS ALLOCATE div BUFFERSIZE */
+  }
+  if (i_div>=0) { /* READ A SPECIFIC BLOCK OF SIZE div */
+    it->n=read_imdiv_cached(ifile,it->im,div,i_div+offset_div,ntop+offset);
+    it->ntop=ntop+offset; /* END OF THIS LIST IN THE BINARY FILE */
+    it->nii=nii+offset_div; /* SAVE INFORMATION FOR READING SUBSEQUENT BLOCKS */
+    it->i_div=i_div+offset_div; /* INDEX OF THIS BLOCK IN THE BINARY FILE */
+  }
+  else { /* A SMALL SUBLIST: READ THE WHOLE LIST INTO MEMORY */
+    read_block_cached(ifile,subheader->start,subheader->len,it->im); /* <=div ITEMS */
+    it->n=subheader->len;
+    it->nii=1;
+    it->i_div=0; /* INDICATE THAT THERE ARE NO ADDITIONAL BLOCKS TO READ*/
+  }
+
+  it->i=find_overlap_start(start,end,it->im,it->n);
+  return it->i;
+ handle_malloc_failure:
+  return -2; /* SIGNAL THAT MEMORY ERROR OCCURRED */
+}
+
+
+int find_file_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,
+			IntervalIndex ii[],int nii,
+			SublistHeader subheader[],int nlists,
+			SubheaderFile *subheader_file,
+			int ntop,int div,FILE *ifile,
+			IntervalMap buf[],int nbuf,
+			int *p_nreturn,IntervalIterator **it_return)
+{
+  IntervalIterator *it=NULL,*it2=NULL;
+  int k,ibuf=0,ori_sign=1,ov=0;
+  IntervalCoord tmp;
+  if (!it0) { /* ALLOCATE AN ITERATOR IF NOT SUPPLIED*/
+    CALLOC(it,1,IntervalIterator);
+  }
+  else 
+    it=it0;
+
+#if defined(ALL_POSITIVE_ORIENTATION) || defined(MERGE_INTERVAL_ORIENTATIONS)
+  if (start<0) { /* NEED TO CONVERT TO POSITIVE ORIENTATION */
+    tmp=start;
+    start= -end;
+    end= -tmp;
+    ori_sign = -1;
+  }
+#endif
+
+  if (it->n == 0)  /* DEFAULT: SEARCH THE TOP NESTED LIST */
+    if (find_file_start(it,start,end,-1,ii,nii,subheader,nlists,
+			subheader_file,ntop,div,ifile) == FIND_FILE_MALLOC_ERR)
+      goto handle_malloc_failure;
+  
+  do { /* ITERATOR STACK LOOP */
+    while (it->i_div < it->nii) { /* BLOCK ITERATION LOOP */
+      while (it->i>=0 && it->i<it->n /* INDIVIDUAL INTERVAL ITERATION LOOP */
+	     && HAS_OVERLAP_POSITIVE(it->im[it->i],start,end)) { /*OVERLAPS!*/
+	memcpy(buf+ibuf,it->im + it->i,sizeof(IntervalMap)); /*SAVE THIS HIT */
+	ibuf++;
+	k=it->im[it->i].sublist; /* GET SUBLIST OF i IF ANY */
+	it->i++; /* ADVANCE TO NEXT INTERVAL */
+	PUSH_ITERATOR_STACK(it,it2,IntervalIterator); /* RECURSE TO SUBLIST */
+	if (k>=0 && (ov=find_file_start(it2,start,end,k,ii,nii,subheader,nlists,
+					subheader_file,ntop,div,ifile))>=0)
+	  it=it2; /* PUSH THE ITERATOR STACK */
 	if (FIND_FILE_MALLOC_ERR == ov)
 	  goto handle_malloc_failure;
 	
@@ -637,7 +1674,7 @@ int find_file_intervals(IntervalIterator *it0,int start,int end,
       it->i_div++; /* TRY GOING TO NEXT BLOCK */
       if (it->i == it->n  /* USED WHOLE BLOCK, SO THERE MIGHT BE MORE */
 	  && it->i_div < it->nii) { /* CONTINUE TO NEXT BLOCK */
-	it->n=read_imdiv(ifile,it->im,div,it->i_div,it->ntop); /*READ NEXT BLOCK*/
+	it->n=read_imdiv_cached(ifile,it->im,div,it->i_div,it->ntop); /*READ NEXT BLOCK*/
 	it->i=0; /* PROCESS IT FROM ITS START */
       }
     }
@@ -716,15 +1753,18 @@ int repack_subheaders(IntervalMap im[],int n,int div,
 int write_binary_index(IntervalMap im[],int n,int div,FILE *ifile)
 {
   int i,j,nsave=0;
+#ifdef MERGE_INTERVAL_ORIENTATIONS
+  IntervalCoord tmp;
+#endif
   for (i=0;i<n;i+=div) {
 #ifdef MERGE_INTERVAL_ORIENTATIONS
     if (im[i].start>=0) /* FORWARD ORI */
 #endif
-      fwrite(&(im[i].start),sizeof(int),1,ifile);  /*SAVE start */
+      fwrite(&(im[i].start),sizeof(IntervalCoord),1,ifile);  /*SAVE start */
 #ifdef MERGE_INTERVAL_ORIENTATIONS
     else { /* REVERSE ORI */
-      j= - im[i].end;
-      fwrite(&j,sizeof(int),1,ifile);  /*SAVE start */
+      tmp= - im[i].end;
+      fwrite(&tmp,sizeof(IntervalCoord),1,ifile);  /*SAVE start */
     }
 #endif
     j=i+div-1;
@@ -733,107 +1773,975 @@ int write_binary_index(IntervalMap im[],int n,int div,FILE *ifile)
 #ifdef MERGE_INTERVAL_ORIENTATIONS
     if (im[j].start>=0)  /* FORWARD ORI */
 #endif
-      fwrite(&(im[j].end),sizeof(int),1,ifile);  /*SAVE end */
-#ifdef MERGE_INTERVAL_ORIENTATIONS
-    else { /* REVERSE ORI */
-      j= - im[j].start;
-      fwrite(&j,sizeof(int),1,ifile);  /*SAVE end */
-    }
+      fwrite(&(im[j].end),sizeof(IntervalCoord),1,ifile);  /*SAVE end */
+#ifdef MERGE_INTERVAL_ORIENTATIONS
+    else { /* REVERSE ORI */
+      tmp= - im[j].start;
+      fwrite(&tmp,sizeof(IntervalCoord),1,ifile);  /*SAVE end */
+    }
+#endif
+    nsave++;
+  }
+  return nsave;
+}
+
+
+
+char *write_binary_files(IntervalMap im[],int n,int ntop,int div,
+			 SublistHeader *subheader,int nlists,char filestem[])
+{
+  int i,npad=0,nii;
+  char path[2048];
+  FILE *ifile=NULL,*ifile_subheader=NULL;
+  SublistHeader sh_tmp;
+  static char err_msg[1024];
+
+  if (nlists>0  /* REPACK SMALL SUBLISTS TO END */
+      && repack_subheaders(im,n,div,subheader,nlists)
+      == FIND_FILE_MALLOC_ERR) {
+    sprintf(err_msg,"unable to malloc %d subheaders",nlists);
+    return err_msg;
+  }
+  sprintf(path,"%s.subhead",filestem); /* SAVE THE SUBHEADER LIST */
+  ifile_subheader=fopen(path,"wb"); /* binary file */
+  if (!ifile_subheader) {
+    sprintf(err_msg,"unable to open file %.900s for writing",path);
+    return err_msg;
+  }
+  sprintf(path,"%s.idb",filestem); /* SAVE THE DATABASE */
+  ifile=fopen(path,"wb"); /* binary file */
+  if (!ifile) {
+    sprintf(err_msg,"unable to open file %.900s for writing",path);
+    return err_msg;
+  }
+  npad=write_padded_binary(im,ntop,div,ifile); /* WRITE THE TOP LEVEL LIST */
+  for (i=0;i<nlists;i++) {
+    sh_tmp.start=npad; /* FILE LOCATION WHERE THIS SUBLIST STORED */
+    sh_tmp.len=subheader[i].len; /* SAVE THE TRUE SUBLIST LENGTH, UNPADDED */
+    fwrite(&sh_tmp,sizeof(SublistHeader),1,ifile_subheader);
+    if (subheader[i].len>div) /* BIG LIST: PAD TO EXACT MULTIPLE OF div */
+      npad+=write_padded_binary(im+subheader[i].start,subheader[i].len,div,ifile);
+    else { /* SMALL LIST: SAVE W/O PADDING */
+      fwrite(im+subheader[i].start,sizeof(IntervalMap),subheader[i].len,ifile);
+      npad+=subheader[i].len;
+    }
+  }
+  fclose(ifile);
+  fclose(ifile_subheader);
+
+  sprintf(path,"%s.index",filestem); /* SAVE THE COMPACTED INDEX */
+  ifile=fopen(path,"wb"); /* binary file */
+  if (!ifile) {
+    sprintf(err_msg,"unable to open file %.900s for writing",path);
+    return err_msg;
+  }
+  nii=write_binary_index(im,ntop,div,ifile);
+  for (i=0;i<nlists;i++) /* ALSO STORE INDEX DATA FOR BIG SUBLISTS */
+    if (subheader[i].len>div)
+      nii+=write_binary_index(im+subheader[i].start,subheader[i].len,div,ifile);
+  fclose(ifile);
+
+  sprintf(path,"%s.size",filestem); /* SAVE BASIC SIZE INFO*/
+  ifile=fopen(path,"w"); /* text file */
+  if (!ifile) {
+    sprintf(err_msg,"unable to open file %.900s for writing",path);
+    return err_msg;
+  }
+  fprintf(ifile,"%d %d %d %d %d %d\n",n,ntop,div,nlists,nii,
+	  INTERVAL_COORD_BITS);
+  fclose(ifile);
+
+  return NULL; /* RETURN CODE SIGNALS SUCCESS!! */
+}
+
+
+
+/* EXTERNAL-MEMORY BUILD: SORT THE .build FILE IN RUNS THAT FIT IN max_memory,
+   MERGE THE RUNS WHILE ASSIGNING SUBLISTS, THEN PLACE EACH RECORD AT ITS
+   FINAL LOCATION IN THE .idb FILE.  WRITES THE SAME FILES AS
+   write_binary_files(), BUT NEVER HOLDS THE WHOLE DATABASE IN MEMORY.
+   ONLY THE SUBLIST HEADERS (~20 BYTES PER SUBLIST) STAY IN MEMORY. */
+
+#define MAX_MERGE_RUNS 128 /* MAX #RUN FILES OPEN AT ONCE DURING MERGE */
+#ifdef MERGE_INTERVAL_ORIENTATIONS
+#define BUILD_SORT_CMP im_qsort_cmp
+#else
+#define BUILD_SORT_CMP imstart_qsort_cmp
+#endif
+#define IS_CONTAINED(IM,PARENT) (!(END_POSITIVE(IM)>END_POSITIVE(PARENT) \
+  || (END_POSITIVE(IM)==END_POSITIVE(PARENT) \
+      && START_POSITIVE(IM)==START_POSITIVE(PARENT))))
+#define PADDED_LENGTH(N,DIV) ((N)%(DIV) ? (N)+(DIV)-(N)%(DIV) : (N))
+
+typedef struct {
+  int nrun;
+  FILE **ifile; /* ONE OPEN FILE PER SORTED RUN */
+  IntervalMap *head; /* CURRENT RECORD OF EACH RUN */
+  int *heap; /* HEAP OF RUN INDEXES, ORDERED BY head */
+  int nheap;
+  int (*cmp)(const void *,const void *);
+} RunMerger;
+
+typedef struct {
+  int list; /* SUBLIST THIS RECORD BELONGS TO, OR -1 FOR THE TOP LEVEL */
+  IntervalMap im;
+} ListedInterval;
+
+typedef struct {
+  PYGR_OFF_T ipos; /* RECORD POSITION IN THE .idb FILE */
+  IntervalMap im;
+} PlacedInterval;
+
+
+static void run_merger_sift(RunMerger *m,int i)
+{
+  int j,tmp;
+  while ((j=2*i+1)<m->nheap) {
+    if (j+1<m->nheap && (m->cmp)(m->head+m->heap[j+1],m->head+m->heap[j])<0)
+      j++; /* USE THE SMALLER CHILD */
+    if ((m->cmp)(m->head+m->heap[j],m->head+m->heap[i])>=0)
+      break;
+    tmp=m->heap[i];
+    m->heap[i]=m->heap[j];
+    m->heap[j]=tmp;
+    i=j;
+  }
+}
+
+static int open_run_merger(RunMerger *m,char filestem[],int irun0,int nrun,
+			   int (*cmp)(const void *,const void *))
+{
+  int i;
+  char path[2048];
+  m->nrun=nrun;
+  m->nheap=0;
+  m->cmp=cmp;
+  CALLOC(m->ifile,nrun,FILE *);
+  CALLOC(m->head,nrun,IntervalMap);
+  CALLOC(m->heap,nrun,int);
+  for (i=0;i<nrun;i++) {
+    sprintf(path,"%s.run%d",filestem,irun0+i);
+    if (!(m->ifile[i]=fopen(path,"rb"))) /* binary file */
+      return -1;
+    if (1==fread(m->head+i,sizeof(IntervalMap),1,m->ifile[i]))
+      m->heap[m->nheap++]=i;
+  }
+  for (i=m->nheap/2-1;i>=0;i--) /* HEAPIFY */
+    run_merger_sift(m,i);
+  return 0;
+ handle_malloc_failure:
+  return FIND_FILE_MALLOC_ERR;
+}
+
+static int run_merger_next(RunMerger *m,IntervalMap *im)
+{ /* GET THE NEXT RECORD IN SORTED ORDER; RETURN 0 WHEN ALL RUNS ARE EXHAUSTED */
+  int irun;
+  if (m->nheap<=0)
+    return 0;
+  irun=m->heap[0];
+  *im=m->head[irun];
+  if (1!=fread(m->head+irun,sizeof(IntervalMap),1,m->ifile[irun]))
+    m->heap[0]=m->heap[--m->nheap]; /* THIS RUN IS EXHAUSTED */
+  run_merger_sift(m,0);
+  return 1;
+}
+
+static void close_run_merger(RunMerger *m)
+{
+  int i;
+  if (m->ifile)
+    for (i=0;i<m->nrun;i++)
+      if (m->ifile[i])
+	fclose(m->ifile[i]);
+  FREE(m->ifile);
+  FREE(m->head);
+  FREE(m->heap);
+}
+
+static void remove_run_files(char filestem[],int irun0,int nrun)
+{
+  int i;
+  char path[2048];
+  for (i=irun0;i<nrun;i++) {
+    sprintf(path,"%s.run%d",filestem,i);
+    remove(path);
+  }
+}
+
+static int placed_qsort_cmp(const void *void_a,const void *void_b)
+{
+  PlacedInterval *a=(PlacedInterval *)void_a,*b=(PlacedInterval *)void_b;
+  if (a->ipos<b->ipos)
+    return -1;
+  else if (a->ipos>b->ipos)
+    return 1;
+  else
+    return 0;
+}
+
+static int write_placed_intervals(PlacedInterval placed[],int n,FILE *ifile)
+{ /* WRITE A BATCH OF RECORDS TO THEIR POSITIONS, SEEKING ONLY ACROSS GAPS */
+  int i;
+  PYGR_OFF_T ipos= -1;
+  qsort(placed,n,sizeof(PlacedInterval),placed_qsort_cmp);
+  for (i=0;i<n;i++) {
+    if (placed[i].ipos!=ipos) {
+      ipos=placed[i].ipos;
+      PYGR_FSEEK(ifile,ipos*sizeof(IntervalMap),SEEK_SET);
+    }
+    if (1!=fwrite(&(placed[i].im),sizeof(IntervalMap),1,ifile))
+      return -1;
+    ipos++;
+  }
+  return n;
+}
+
+static int write_index_from_idb(FILE *ifile_idb,int start,int len,int div,
+				IntervalMap buf[],FILE *ifile)
+{ /* SAME AS write_binary_index(), READING THE LIST BACK FROM THE .idb FILE */
+  int i,nread,nsave=0;
+  PYGR_OFF_T ipos;
+  for (i=0;i<len;i+=div) {
+    nread= (len-i<div) ? len-i : div;
+    ipos=start+i;
+    PYGR_FSEEK(ifile_idb,ipos*sizeof(IntervalMap),SEEK_SET);
+    if (nread!=fread(buf,sizeof(IntervalMap),nread,ifile_idb))
+      return -1;
+    nsave+=write_binary_index(buf,nread,div,ifile);
+  }
+  return nsave;
+}
+
+
+char *build_binary_files_external(char buildfile[],int n,int div,
+				  size_t max_memory,char filestem[])
+{
+  int i,j,k,nchunk,nread,irun0=0,nrun=0,ntop=0,nlists=0,nsub_alloc=0;
+  int nstack=0,nstack_alloc=0,has_pending=0,pending_list= -1,next_list;
+  int nplaced=0,nplaced_alloc,npad,nii,ipos,top_ipos=0,*sub_map=NULL,*cursor=NULL;
+  char path[2048],nest_path[2048];
+  FILE *ifile=NULL,*ofile=NULL;
+  IntervalMap *im=NULL,*stack=NULL,pending,next;
+  SublistHeader *subheader=NULL,sh_tmp;
+  ListedInterval li;
+  PlacedInterval *placed=NULL;
+  RunMerger merger;
+  static char err_msg[1024];
+
+  memset(&merger,0,sizeof(RunMerger));
+  sprintf(nest_path,"%s.nest",filestem);
+  if (n<=0) /* NOTHING TO SORT */
+    return write_binary_files(&pending,0,0,div,NULL,0,filestem);
+
+  nchunk=max_memory/sizeof(IntervalMap); /* PHASE 1: WRITE SORTED RUNS */
+  if (nchunk<div)
+    nchunk=div;
+  if (nchunk>n)
+    nchunk=n;
+  CALLOC(im,nchunk,IntervalMap);
+  if (!(ifile=fopen(buildfile,"rb"))) { /* binary file */
+    sprintf(err_msg,"unable to open %.900s",buildfile);
+    goto handle_build_error;
+  }
+  for (i=0;i<n;i+=nread) {
+    nread= (n-i<nchunk) ? n-i : nchunk;
+    if (nread!=fread(im,sizeof(IntervalMap),nread,ifile)) {
+      sprintf(err_msg,"%.900s: IntervalMap file corrupted?",buildfile);
+      goto handle_build_error;
+    }
+#ifdef ALL_POSITIVE_ORIENTATION
+    reorient_intervals(nread,im,1); /* FORCE ALL INTERVALS INTO POSITIVE ORI */
+#endif
+    sort_intervals(im,nread,BUILD_SORT_CMP);
+    sprintf(path,"%s.run%d",filestem,nrun++);
+    if (!(ofile=fopen(path,"wb"))
+	|| nread!=fwrite(im,sizeof(IntervalMap),nread,ofile)) {
+      sprintf(err_msg,"unable to write %.900s",path);
+      goto handle_build_error;
+    }
+    fclose(ofile);
+    ofile=NULL;
+  }
+  fclose(ifile);
+  ifile=NULL;
+  FREE(im); /* RELEASE SORT BUFFER BEFORE MERGING */
+
+  while (nrun-irun0>MAX_MERGE_RUNS) { /* TOO MANY RUNS: MERGE SOME OF THEM */
+    if ((i=open_run_merger(&merger,filestem,irun0,MAX_MERGE_RUNS,BUILD_SORT_CMP))
+	==FIND_FILE_MALLOC_ERR)
+      goto handle_malloc_failure;
+    sprintf(path,"%s.run%d",filestem,nrun);
+    if (i<0 || !(ofile=fopen(path,"wb"))) {
+      sprintf(err_msg,"unable to open run files for %.900s",filestem);
+      goto handle_build_error;
+    }
+    nrun++;
+    while (run_merger_next(&merger,&next))
+      if (1!=fwrite(&next,sizeof(IntervalMap),1,ofile)) {
+	sprintf(err_msg,"unable to write %.900s",path);
+	goto handle_build_error;
+      }
+    fclose(ofile);
+    ofile=NULL;
+    close_run_merger(&merger);
+    remove_run_files(filestem,irun0,irun0+MAX_MERGE_RUNS);
+    irun0+=MAX_MERGE_RUNS;
+  }
+
+  /* PHASE 2: MERGE, ASSIGNING EACH RECORD TO ITS LIST.  A RECORD HAS A
+     SUBLIST IFF THE NEXT RECORD IN SORTED ORDER IS CONTAINED IN IT */
+  if ((i=open_run_merger(&merger,filestem,irun0,nrun-irun0,BUILD_SORT_CMP))
+      ==FIND_FILE_MALLOC_ERR)
+    goto handle_malloc_failure;
+  if (i<0 || !(ofile=fopen(nest_path,"wb"))) {
+    sprintf(err_msg,"unable to open run files for %.900s",filestem);
+    goto handle_build_error;
+  }
+  while (run_merger_next(&merger,&next)) {
+    next_list= -1; /* DEFAULT: TOP LEVEL */
+    if (has_pending) {
+      if (IS_CONTAINED(next,pending)) { /* START A NEW SUBLIST */
+	if (nstack>=nstack_alloc) {
+	  nstack_alloc= nstack_alloc ? 2*nstack_alloc : 1024;
+	  REALLOC(stack,nstack_alloc,IntervalMap);
+	}
+	if (nlists>=nsub_alloc) {
+	  nsub_alloc= nsub_alloc ? 2*nsub_alloc : 1024;
+	  REALLOC(subheader,nsub_alloc,SublistHeader);
+	}
+	subheader[nlists].len=0;
+	pending.sublist=nlists++;
+	stack[nstack++]=pending; /* PUSH pending ONTO STACK OF PARENTS */
+      }
+      else {
+	pending.sublist= -1;
+	while (nstack>0 && !IS_CONTAINED(next,stack[nstack-1]))
+	  nstack--; /* POP PARENTS THAT DON'T CONTAIN next */
+      }
+      if (nstack>0)
+	next_list=stack[nstack-1].sublist;
+      li.list=pending_list;
+      li.im=pending;
+      if (1!=fwrite(&li,sizeof(ListedInterval),1,ofile)) {
+	sprintf(err_msg,"unable to write %.900s",nest_path);
+	goto handle_build_error;
+      }
+    }
+    if (next_list<0)
+      ntop++;
+    else
+      subheader[next_list].len++;
+    pending=next;
+    pending_list=next_list;
+    has_pending=1;
+  }
+  pending.sublist= -1; /* LAST RECORD HAS NO SUBLIST */
+  li.list=pending_list;
+  li.im=pending;
+  if (1!=fwrite(&li,sizeof(ListedInterval),1,ofile)) {
+    sprintf(err_msg,"unable to write %.900s",nest_path);
+    goto handle_build_error;
+  }
+  fclose(ofile);
+  ofile=NULL;
+  close_run_merger(&merger);
+  remove_run_files(filestem,irun0,nrun);
+  irun0=nrun;
+  FREE(stack);
+
+  /* PHASE 3: PLACE SUBLISTS LIKE write_binary_files(): TOP LEVEL LIST,
+     THEN SUBLISTS W/ len>div, THEN SMALL SUBLISTS; BIG LISTS ARE PADDED */
+  if (nlists>0) {
+    CALLOC(sub_map,nlists,int);
+    CALLOC(cursor,nlists,int);
+  }
+  npad=PADDED_LENGTH(ntop,div);
+  for (k=j=0;k<2;k++) /* k=0: BIG SUBLISTS, k=1: SMALL SUBLISTS */
+    for (i=0;i<nlists;i++)
+      if ((subheader[i].len>div) == (k==0)) {
+	sub_map[i]=j++;
+	subheader[i].start=cursor[i]=npad;
+	if (k==0)
+	  npad+=PADDED_LENGTH(subheader[i].len,div);
+	else
+	  npad+=subheader[i].len;
+      }
+
+  nplaced_alloc=max_memory/sizeof(PlacedInterval);
+  if (nplaced_alloc<2*div)
+    nplaced_alloc=2*div;
+  CALLOC(placed,nplaced_alloc,PlacedInterval);
+  sprintf(path,"%s.idb",filestem);
+  if (!(ifile=fopen(nest_path,"rb")) || !(ofile=fopen(path,"wb"))) {
+    sprintf(err_msg,"unable to open %.900s for writing",path);
+    goto handle_build_error;
+  }
+  while (1==fread(&li,sizeof(ListedInterval),1,ifile)) {
+    if (li.im.sublist>=0) /* ADJUST TO REPACKED SUBLIST ORDER */
+      li.im.sublist=sub_map[li.im.sublist];
+    if (li.list<0) { /* TOP LEVEL LIST IS ALWAYS PADDED */
+      ipos=top_ipos++;
+      j= (ipos==0) ? PADDED_LENGTH(ntop,div)-ntop : 0;
+    }
+    else {
+      ipos=cursor[li.list]++;
+      j= (ipos==subheader[li.list].start && subheader[li.list].len>div) ?
+	PADDED_LENGTH(subheader[li.list].len,div)-subheader[li.list].len : 0;
+    }
+    if (nplaced+1+j>nplaced_alloc) { /* BUFFER FULL, SO WRITE IT */
+      if (write_placed_intervals(placed,nplaced,ofile)<0) {
+	sprintf(err_msg,"unable to write %.900s",path);
+	goto handle_build_error;
+      }
+      nplaced=0;
+    }
+    placed[nplaced].ipos=ipos;
+    placed[nplaced++].im=li.im;
+    if (j>0) { /* PAD WITH COPIES OF THE LIST'S 1ST RECORD */
+      ipos+= (li.list<0) ? ntop : subheader[li.list].len;
+      for (;j>0;j--) {
+	placed[nplaced].ipos=ipos++;
+	placed[nplaced++].im=li.im;
+      }
+    }
+  }
+  if (write_placed_intervals(placed,nplaced,ofile)<0) {
+    sprintf(err_msg,"unable to write %.900s",path);
+    goto handle_build_error;
+  }
+  fclose(ifile);
+  ifile=NULL;
+  fclose(ofile);
+  ofile=NULL;
+  remove(nest_path);
+  FREE(placed);
+  FREE(cursor);
+
+  sprintf(path,"%s.subhead",filestem); /* SAVE THE SUBHEADER LIST */
+  if (!(ofile=fopen(path,"wb"))) { /* binary file */
+    sprintf(err_msg,"unable to open file %.900s for writing",path);
+    goto handle_build_error;
+  }
+  for (k=0;k<2;k++)
+    for (i=0;i<nlists;i++)
+      if ((subheader[i].len>div) == (k==0)) {
+	sh_tmp.start=subheader[i].start; /* FILE LOCATION OF THIS SUBLIST */
+	sh_tmp.len=subheader[i].len;
+	fwrite(&sh_tmp,sizeof(SublistHeader),1,ofile);
+      }
+  fclose(ofile);
+  ofile=NULL;
+
+  CALLOC(im,div,IntervalMap); /* SAVE THE INDEX, READING BACK THE .idb */
+  sprintf(path,"%s.idb",filestem);
+  ifile=fopen(path,"rb");
+  sprintf(path,"%s.index",filestem);
+  if (!ifile || !(ofile=fopen(path,"wb"))) {
+    sprintf(err_msg,"unable to open file %.900s for writing",path);
+    goto handle_build_error;
+  }
+  nii=write_index_from_idb(ifile,0,ntop,div,im,ofile);
+  for (i=0;i<nlists && nii>=0;i++) /* ALSO INDEX BIG SUBLISTS */
+    if (subheader[i].len>div) {
+      j=write_index_from_idb(ifile,subheader[i].start,subheader[i].len,div,im,ofile);
+      nii= (j<0) ? j : nii+j;
+    }
+  fclose(ifile);
+  ifile=NULL;
+  fclose(ofile);
+  ofile=NULL;
+  if (nii<0) {
+    sprintf(err_msg,"error reading %.900s.idb",filestem);
+    goto handle_build_error;
+  }
+
+  sprintf(path,"%s.size",filestem); /* SAVE BASIC SIZE INFO*/
+  if (!(ofile=fopen(path,"w"))) { /* text file */
+    sprintf(err_msg,"unable to open file %.900s for writing",path);
+    goto handle_build_error;
+  }
+  fprintf(ofile,"%d %d %d %d %d %d\n",n,ntop,div,nlists,nii,
+	  INTERVAL_COORD_BITS);
+  fclose(ofile);
+
+  FREE(im);
+  FREE(sub_map);
+  FREE(subheader);
+  return NULL; /* RETURN CODE SIGNALS SUCCESS!! */
+ handle_malloc_failure:
+  sprintf(err_msg,"out of memory building %.900s",filestem);
+ handle_build_error:
+  if (ifile)
+    fclose(ifile);
+  if (ofile)
+    fclose(ofile);
+  close_run_merger(&merger);
+  remove_run_files(filestem,irun0,nrun);
+  remove(nest_path);
+  FREE(im);
+  FREE(stack);
+  FREE(subheader);
+  FREE(sub_map);
+  FREE(cursor);
+  FREE(placed);
+  return err_msg;
+}
+
+
+
+/* COMPRESSED .idb FORMAT: EACH BLOCK OF div RECORDS IS STORED AS ZIGZAG
+   VARINTS, DELTA-ENCODED AGAINST THE PREVIOUS RECORD IN THE BLOCK, SO ANY
+   BLOCK CAN BE DECODED ON ITS OWN.  filestem.blocks HOLDS THE RECORD COUNT
+   FOLLOWED BY THE BYTE OFFSET OF EVERY BLOCK PLUS THE END OF FILE. */
+#define ZIGZAG_ENCODE(V) (((unsigned long long)(V)<<1) ^ ((V)<0 ? ~0ULL : 0ULL))
+#define ZIGZAG_DECODE(U) ((long long)((U)>>1) ^ -(long long)((U)&1))
+#define PACKED_BLOCK_MAX(DIV) (60*(DIV)) /* 6 FIELDS x 10 BYTES PER RECORD */
+
+static unsigned char *put_varint(unsigned char *p,long long v)
+{
+  unsigned long long u=ZIGZAG_ENCODE(v);
+  while (u>=0x80) {
+    *p++ = (unsigned char)(u|0x80);
+    u>>=7;
+  }
+  *p++ = (unsigned char)u;
+  return p;
+}
+
+static unsigned char *get_varint(unsigned char *p,unsigned char *end,
+				 long long *pv)
+{
+  int shift;
+  unsigned long long u=0;
+  for (shift=0;p<end && shift<64;shift+=7) {
+    u|=(unsigned long long)(*p&0x7f)<<shift;
+    if (!(*p++ & 0x80)) {
+      *pv=ZIGZAG_DECODE(u);
+      return p;
+    }
+  }
+  return NULL; /* TRUNCATED OR CORRUPT BLOCK */
+}
+
+/* ENCODE n RECORDS INTO buf, WHICH MUST HOLD PACKED_BLOCK_MAX(n) BYTES.
+   RETURNS THE NUMBER OF BYTES USED */
+static int pack_block(IntervalMap im[],int n,unsigned char buf[])
+{
+  int i;
+  long long len;
+  unsigned char *p=buf;
+  IntervalMap last={0,0,0,0,0,-1};
+  for (i=0;i<n;i++) {
+    len=(long long)im[i].end-im[i].start;
+    p=put_varint(p,(long long)im[i].start-last.start);
+    p=put_varint(p,len);
+    p=put_varint(p,(long long)im[i].target_id-last.target_id);
+    p=put_varint(p,(long long)im[i].target_start-last.target_start);
+    p=put_varint(p,(long long)im[i].target_end-im[i].target_start-len);
+    p=put_varint(p,(long long)im[i].sublist-last.sublist);
+    last=im[i];
+  }
+  return (int)(p-buf);
+}
+
+static int unpack_block(unsigned char *p,unsigned char *end,
+			IntervalMap im[],int n)
+{
+  int i,j;
+  long long v[6],start=0,target_id=0,target_start=0,sublist= -1;
+  for (i=0;i<n;i++) {
+    for (j=0;j<6;j++)
+      if (NULL==(p=get_varint(p,end,v+j)))
+	return -1;
+    start+=v[0];
+    target_id+=v[2];
+    target_start+=v[3];
+    sublist+=v[5];
+    im[i].start=start;
+    im[i].end=start+v[1];
+    im[i].target_id=(int)target_id;
+    im[i].target_start=target_start;
+    im[i].target_end=target_start+v[1]+v[4];
+    im[i].sublist=(int)sublist;
+  }
+  return 0;
+}
+
+
+/* REWRITE filestem.idb IN IDB_FORMAT_PACKED, ONE BLOCK PER div RECORDS.
+   THE .index AND .subhead FILES ARE UNCHANGED, AND QUERIES READ THE
+   COMPRESSED FILE THROUGH open_idb_file() */
+int compress_binary_files(char filestem[],char err_msg[])
+{
+  int n,ntop,div,nlists,nii,format,nread,nbyte,nblock=0,nalloc=1024;
+  long long nrec=0,offset=0,*block_offset=NULL;
+  char path[2048],tmp_path[2048];
+  IntervalMap *im=NULL;
+  unsigned char *packed=NULL;
+  FILE *ifile=NULL,*ofile=NULL;
+
+  if (read_size_file(filestem,&n,&ntop,&div,&nlists,&nii,&format,err_msg))
+    return -1;
+  if (format==IDB_FORMAT_PACKED) /* NOTHING TO DO */
+    return 0;
+  CALLOC(im,div,IntervalMap);
+  CALLOC(packed,PACKED_BLOCK_MAX(div),unsigned char);
+  CALLOC(block_offset,nalloc,long long);
+
+  sprintf(path,"%s.idb",filestem);
+  ifile=fopen(path,"rb"); /* binary file */
+  if (!ifile)
+    goto unable_to_open_file;
+  sprintf(tmp_path,"%s.idb.tmp",filestem);
+  ofile=fopen(tmp_path,"wb"); /* binary file */
+  if (!ofile) {
+    strcpy(path,tmp_path);
+    goto unable_to_open_file;
+  }
+  while ((nread=(int)fread(im,sizeof(IntervalMap),div,ifile))>0) {
+    if (nblock+2>nalloc) { /* LEAVE ROOM FOR THE END OFFSET */
+      nalloc*=2;
+      REALLOC(block_offset,nalloc,long long);
+    }
+    block_offset[nblock++]=offset;
+    nbyte=pack_block(im,nread,packed);
+    if (nbyte!=(int)fwrite(packed,1,nbyte,ofile))
+      goto write_error_occurred;
+    offset+=nbyte;
+    nrec+=nread;
+  }
+  block_offset[nblock]=offset; /* END OF THE LAST BLOCK */
+  if (ferror(ifile)) {
+    sprintf(err_msg,"error reading file %s",path);
+    goto handle_error;
+  }
+  fclose(ifile);
+  ifile=NULL;
+  if (fclose(ofile)) {
+    ofile=NULL;
+    goto write_error_occurred;
+  }
+  ofile=NULL;
+
+  sprintf(path,"%s.blocks",filestem); /* SAVE THE BLOCK OFFSETS */
+  ofile=fopen(path,"wb"); /* binary file */
+  if (!ofile)
+    goto unable_to_open_file;
+  if (1!=fwrite(&nrec,sizeof(long long),1,ofile)
+      || nblock+1!=(int)fwrite(block_offset,sizeof(long long),nblock+1,ofile)
+      || fclose(ofile)) {
+    ofile=NULL;
+    goto write_error_occurred;
+  }
+  ofile=NULL;
+
+  sprintf(path,"%s.idb",filestem); /* REPLACE THE RAW .idb */
+  if (rename(tmp_path,path)) {
+    remove(path); /* WINDOWS WON'T RENAME ONTO AN EXISTING FILE */
+    if (rename(tmp_path,path)) {
+      sprintf(err_msg,"unable to rename %s to %s",tmp_path,path);
+      goto handle_error;
+    }
+  }
+  sprintf(path,"%s.size",filestem); /* RECORD THE NEW FORMAT */
+  ofile=fopen(path,"w"); /* text file */
+  if (!ofile)
+    goto unable_to_open_file;
+  fprintf(ofile,"%d %d %d %d %d %d %d\n",n,ntop,div,nlists,nii,
+	  INTERVAL_COORD_BITS,IDB_FORMAT_PACKED);
+  fclose(ofile);
+  FREE(im);
+  FREE(packed);
+  FREE(block_offset);
+  return 0;
+ unable_to_open_file:
+  sprintf(err_msg,"unable to open file %s",path);
+  goto handle_error;
+ write_error_occurred:
+  sprintf(err_msg,"error writing file %s! out of disk space?",path);
+  goto handle_error;
+ handle_malloc_failure:
+  sprintf(err_msg,"out of memory compressing %s",filestem);
+ handle_error:
+  if (ifile)
+    fclose(ifile);
+  if (ofile)
+    fclose(ofile);
+  FREE(im);
+  FREE(packed);
+  FREE(block_offset);
+  return -1;
+}
+
+
+
+#if defined(PYGR_HAVE_FOPENCOOKIE) || defined(PYGR_HAVE_FUNOPEN)
+#define PYGR_HAVE_COOKIE_IO 1
+
+/* STATE OF A COMPRESSED .idb OPENED AS A STDIO STREAM.  THE STREAM PRESENTS
+   THE DECODED RECORDS, SO fseek() / fread() CALLERS SUCH AS read_imdiv()
+   WORK UNCHANGED, DECODING ONE BLOCK AT A TIME */
+typedef struct {
+  FILE *ifile;
+  long long *offset; /* BYTE OFFSETS OF BLOCKS IN ifile, PLUS END OF FILE */
+  long long nrec;
+  long long pos; /* CURRENT POSITION IN THE DECODED STREAM, IN BYTES */
+  int div;
+  int nblock;
+  int iblock; /* BLOCK CURRENTLY DECODED IN im, OR -1 */
+  int nblock_rec;
+  IntervalMap *im;
+  unsigned char *packed;
+} PackedIDB;
+
+static void free_packed_idb(PackedIDB *pidb)
+{
+  if (pidb->ifile)
+    fclose(pidb->ifile);
+  FREE(pidb->offset);
+  FREE(pidb->im);
+  FREE(pidb->packed);
+  free(pidb);
+}
+
+static int load_packed_block(PackedIDB *pidb,int iblock)
+{
+  long long nbyte=pidb->offset[iblock+1]-pidb->offset[iblock];
+  long long nrec=pidb->nrec-(long long)iblock*pidb->div;
+
+  if (nrec>pidb->div)
+    nrec=pidb->div;
+  pidb->iblock= -1;
+  if (nbyte<0 || nbyte>PACKED_BLOCK_MAX(pidb->div)
+      || PYGR_FSEEK(pidb->ifile,(PYGR_OFF_T)pidb->offset[iblock],SEEK_SET)
+      || nbyte!=(long long)fread(pidb->packed,1,(size_t)nbyte,pidb->ifile)
+      || unpack_block(pidb->packed,pidb->packed+nbyte,pidb->im,(int)nrec))
+    return -1;
+  pidb->iblock=iblock;
+  pidb->nblock_rec=(int)nrec;
+  return 0;
+}
+
+static long long packed_idb_read_bytes(PackedIDB *pidb,char buf[],
+				       long long size)
+{
+  int iblock;
+  long long nread=0,skip,ncopy;
+  long long block_size=(long long)pidb->div*sizeof(IntervalMap);
+  long long total=pidb->nrec*(long long)sizeof(IntervalMap);
+
+  while (nread<size && pidb->pos<total) {
+    iblock=(int)(pidb->pos/block_size);
+    if (iblock!=pidb->iblock && load_packed_block(pidb,iblock))
+      return -1;
+    skip=pidb->pos-iblock*block_size;
+    ncopy=pidb->nblock_rec*(long long)sizeof(IntervalMap)-skip;
+    if (ncopy>size-nread)
+      ncopy=size-nread;
+    memcpy(buf+nread,(char *)pidb->im+skip,(size_t)ncopy);
+    nread+=ncopy;
+    pidb->pos+=ncopy;
+  }
+  return nread;
+}
+
+static long long packed_idb_seek_to(PackedIDB *pidb,long long offset,
+				    int whence)
+{
+  switch (whence) {
+  case SEEK_SET:
+    break;
+  case SEEK_CUR:
+    offset+=pidb->pos;
+    break;
+  case SEEK_END:
+    offset+=pidb->nrec*(long long)sizeof(IntervalMap);
+    break;
+  default:
+    return -1;
+  }
+  if (offset<0)
+    return -1;
+  pidb->pos=offset;
+  return offset;
+}
+
+#ifdef PYGR_HAVE_FOPENCOOKIE
+static ssize_t packed_idb_read(void *cookie,char *buf,size_t size)
+{
+  return (ssize_t)packed_idb_read_bytes((PackedIDB *)cookie,buf,
+					(long long)size);
+}
+
+static int packed_idb_seek(void *cookie,off64_t *offset,int whence)
+{
+  long long pos=packed_idb_seek_to((PackedIDB *)cookie,
+				   (long long)*offset,whence);
+  if (pos<0)
+    return -1;
+  *offset=(off64_t)pos;
+  return 0;
+}
+#else
+static int packed_idb_read(void *cookie,char *buf,int size)
+{
+  return (int)packed_idb_read_bytes((PackedIDB *)cookie,buf,
+				    (long long)size);
+}
+
+static fpos_t packed_idb_seek(void *cookie,fpos_t offset,int whence)
+{
+  return (fpos_t)packed_idb_seek_to((PackedIDB *)cookie,
+				    (long long)offset,whence);
+}
+#endif
+
+static int packed_idb_close(void *cookie)
+{
+  free_packed_idb((PackedIDB *)cookie);
+  return 0;
+}
+
+static FILE *open_packed_idb(char filestem[],int div,char err_msg[])
+{
+  int nblock;
+  long long nrec;
+  char path[2048];
+  PackedIDB *pidb=NULL;
+  FILE *ifile=NULL;
+#ifdef PYGR_HAVE_FOPENCOOKIE
+  cookie_io_functions_t funcs={packed_idb_read,NULL,packed_idb_seek,
+			       packed_idb_close};
+#endif
+
+  CALLOC(pidb,1,PackedIDB);
+  sprintf(path,"%s.blocks",filestem); /* READ THE BLOCK OFFSETS */
+  ifile=fopen(path,"rb"); /* binary file */
+  if (!ifile)
+    goto unable_to_open_file;
+  if (1!=fread(&nrec,sizeof(long long),1,ifile))
+    goto fread_error_occurred;
+  nblock=(int)((nrec+div-1)/div);
+  CALLOC(pidb->offset,nblock+1,long long);
+  if (nblock+1!=(int)fread(pidb->offset,sizeof(long long),nblock+1,ifile))
+    goto fread_error_occurred;
+  fclose(ifile);
+  ifile=NULL;
+  CALLOC(pidb->im,div,IntervalMap);
+  CALLOC(pidb->packed,PACKED_BLOCK_MAX(div),unsigned char);
+  pidb->nrec=nrec;
+  pidb->div=div;
+  pidb->nblock=nblock;
+  pidb->iblock= -1; /* NO BLOCK LOADED */
+
+  sprintf(path,"%s.idb",filestem);
+  pidb->ifile=fopen(path,"rb"); /* binary file */
+  if (!pidb->ifile)
+    goto unable_to_open_file;
+#ifdef PYGR_HAVE_FOPENCOOKIE
+  ifile=fopencookie(pidb,"rb",funcs);
+#else
+  ifile=funopen(pidb,packed_idb_read,NULL,packed_idb_seek,packed_idb_close);
+#endif
+  if (!ifile)
+    goto unable_to_open_file;
+  setvbuf(ifile,NULL,_IONBF,0); /* READERS ALREADY REQUEST WHOLE BLOCKS */
+  return ifile; /* CLOSING ifile FREES pidb */
+ unable_to_open_file:
+  if (err_msg)
+    sprintf(err_msg,"unable to open file %s",path);
+  goto handle_error;
+ fread_error_occurred:
+  if (err_msg)
+    sprintf(err_msg,"error or EOF reading file %s",path);
+ handle_malloc_failure:
+ handle_error:
+  if (ifile)
+    fclose(ifile);
+  if (pidb)
+    free_packed_idb(pidb);
+  return NULL;
+}
+#endif
+
+
+/* OPEN filestem.idb FOR fseek() / fread() OF IntervalMap RECORDS, WHATEVER
+   ITS STORAGE FORMAT */
+FILE *open_idb_file(char filestem[],int format,int div,char err_msg[])
+{
+  char path[2048];
+  FILE *ifile=NULL;
+
+  if (format==IDB_FORMAT_PACKED) {
+#ifdef PYGR_HAVE_COOKIE_IO
+    return open_packed_idb(filestem,div,err_msg);
+#else
+    if (err_msg)
+      sprintf(err_msg,"%s.idb is compressed, which is not supported on this platform",
+	      filestem);
+    return NULL;
 #endif
-    nsave++;
   }
-  return nsave;
+  sprintf(path,"%s.idb",filestem);
+  ifile=fopen(path,"rb"); /* binary file */
+  if (!ifile && err_msg)
+    sprintf(err_msg,"unable to open file %s",path);
+  return ifile;
 }
 
 
 
-char *write_binary_files(IntervalMap im[],int n,int ntop,int div,
-			 SublistHeader *subheader,int nlists,char filestem[])
+/* READ THE .size FILE, CHECKING THAT ITS COORDINATE SIZE MATCHES OURS */
+int read_size_file(char filestem[],int *p_n,int *p_ntop,int *p_div,
+		   int *p_nlists,int *p_nii,int *p_format,char err_msg[])
 {
-  int i,npad=0,nii;
+  int nfield,coord_bits=32;
   char path[2048];
-  FILE *ifile=NULL,*ifile_subheader=NULL;
-  SublistHeader sh_tmp;
-  static char err_msg[1024];
+  FILE *ifile=NULL;
 
-  if (nlists>0  /* REPACK SMALL SUBLISTS TO END */
-      && repack_subheaders(im,n,div,subheader,nlists)
-      == FIND_FILE_MALLOC_ERR) {
-    sprintf(err_msg,"unable to malloc %d subheaders",nlists);
-    return err_msg;
-  }
-  sprintf(path,"%s.subhead",filestem); /* SAVE THE SUBHEADER LIST */
-  ifile_subheader=fopen(path,"wb"); /* binary file */
-  if (!ifile_subheader) {
-    sprintf(err_msg,"unable to open file %s for writing",path);
-    return err_msg;
-  }
-  sprintf(path,"%s.idb",filestem); /* SAVE THE DATABASE */
-  ifile=fopen(path,"wb"); /* binary file */
+  sprintf(path,"%s.size",filestem); /* READ BASIC SIZE INFO*/
+  ifile=fopen(path,"r"); /* text file */
   if (!ifile) {
-    sprintf(err_msg,"unable to open file %s for writing",path);
-    return err_msg;
-  }
-  npad=write_padded_binary(im,ntop,div,ifile); /* WRITE THE TOP LEVEL LIST */
-  for (i=0;i<nlists;i++) {
-    sh_tmp.start=npad; /* FILE LOCATION WHERE THIS SUBLIST STORED */
-    sh_tmp.len=subheader[i].len; /* SAVE THE TRUE SUBLIST LENGTH, UNPADDED */
-    fwrite(&sh_tmp,sizeof(SublistHeader),1,ifile_subheader);
-    if (subheader[i].len>div) /* BIG LIST: PAD TO EXACT MULTIPLE OF div */
-      npad+=write_padded_binary(im+subheader[i].start,subheader[i].len,div,ifile);
-    else { /* SMALL LIST: SAVE W/O PADDING */
-      fwrite(im+subheader[i].start,sizeof(IntervalMap),subheader[i].len,ifile);
-      npad+=subheader[i].len;
-    }
+    if (err_msg)
+      sprintf(err_msg,"unable to open file %s",path);
+    return -1;
   }
+  *p_format=IDB_FORMAT_RAW; /* OLDER FILES LACK coord_bits AND format */
+  nfield=fscanf(ifile,"%d %d %d %d %d %d %d",p_n,p_ntop,p_div,p_nlists,p_nii,
+		&coord_bits,p_format);
   fclose(ifile);
-  fclose(ifile_subheader);
-
-  sprintf(path,"%s.index",filestem); /* SAVE THE COMPACTED INDEX */
-  ifile=fopen(path,"wb"); /* binary file */
-  if (!ifile) {
-    sprintf(err_msg,"unable to open file %s for writing",path);
-    return err_msg;
+  if (nfield<5) {
+    if (err_msg)
+      sprintf(err_msg,"error or EOF reading file %s",path);
+    return -1;
   }
-  nii=write_binary_index(im,ntop,div,ifile);
-  for (i=0;i<nlists;i++) /* ALSO STORE INDEX DATA FOR BIG SUBLISTS */
-    if (subheader[i].len>div)
-      nii+=write_binary_index(im+subheader[i].start,subheader[i].len,div,ifile);
-  fclose(ifile);
-
-  sprintf(path,"%s.size",filestem); /* SAVE BASIC SIZE INFO*/
-  ifile=fopen(path,"w"); /* text file */
-  if (!ifile) {
-    sprintf(err_msg,"unable to open file %s for writing",path);
-    return err_msg;
+  if (coord_bits!=INTERVAL_COORD_BITS) {
+    if (err_msg)
+      sprintf(err_msg,"%s uses %d-bit coordinates, but this pygr was built with %d-bit coordinates",
+	      path,coord_bits,INTERVAL_COORD_BITS);
+    return -1;
   }
-  fprintf(ifile,"%d %d %d %d %d\n",n,ntop,div,nlists,nii);
-  fclose(ifile);
-
-  return NULL; /* RETURN CODE SIGNALS SUCCESS!! */
+  if (*p_format!=IDB_FORMAT_RAW && *p_format!=IDB_FORMAT_PACKED) {
+    if (err_msg)
+      sprintf(err_msg,"%s: unknown .idb format %d",path,*p_format);
+    return -1;
+  }
+  return 0;
 }
 
 
-
 IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
 				  int subheader_nblock)
 {
-  int n,ntop,div,nlists,nii;
+  int n,ntop,div,nlists,nii,format;
   char path[2048];
   IntervalIndex *ii=NULL;
   SublistHeader *subheader=NULL;
   IntervalDBFile *idb_file=NULL;
   FILE *ifile=NULL;
 
-  sprintf(path,"%s.size",filestem); /* READ BASIC SIZE INFO*/
-  ifile=fopen(path,"r"); /* text file */
-  if (!ifile) {
-    if (err_msg)
-      sprintf(err_msg,"unable to open file %s",path);
+  if (read_size_file(filestem,&n,&ntop,&div,&nlists,&nii,&format,err_msg))
     return NULL;
-  }
-  fscanf(ifile,"%d %d %d %d %d",&n,&ntop,&div,&nlists,&nii);
-  fclose(ifile);
 
   CALLOC(ii,nii+1,IntervalIndex);
   if (nii>0) {
@@ -849,21 +2757,25 @@ IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
   }
 
   CALLOC(idb_file,1,IntervalDBFile);
+  idb_file->idb_handle=idb_file->subheader_handle= -1;
   if(nlists>0){
     sprintf(path,"%s.subhead",filestem); /* SAVE THE SUBHEADER LIST */
-    ifile=fopen(path,"rb"); /* binary file */
-    if (!ifile) {
-      if (err_msg)
-	sprintf(err_msg,"unable to open file %s",path);
-      return NULL;
-    }
 #ifdef ON_DEMAND_SUBLIST_HEADER
+    idb_file->subheader_handle=file_pool_open(path,"rb",-1,0,err_msg);
+    if (idb_file->subheader_handle<0)
+      return NULL;
     CALLOC(subheader,subheader_nblock,SublistHeader);
     idb_file->subheader_file.subheader=subheader;
     idb_file->subheader_file.nblock=subheader_nblock;
     idb_file->subheader_file.start = -subheader_nblock; /* NO BLOCK LOADED */
-    idb_file->subheader_file.ifile=ifile;
+    /* subheader_file.ifile IS SET FROM THE FILE POOL BEFORE EACH QUERY */
 #else
+    ifile=fopen(path,"rb"); /* binary file */
+    if (!ifile) {
+      if (err_msg)
+	sprintf(err_msg,"unable to open file %s",path);
+      return NULL;
+    }
     CALLOC(subheader,nlists,SublistHeader); /* LOAD THE ENTIRE SUBHEADER */
     fread(subheader,sizeof(SublistHeader),nlists,ifile);  /*SAVE LIST */
     fclose(ifile);
@@ -879,14 +2791,16 @@ IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
     idb_file->nii++; /* ONE EXTRA ENTRY FOR PARTIAL BLOCK */
   idb_file->ii=ii;
   idb_file->subheader=subheader;
-  sprintf(path,"%s.idb",filestem); /* OPEN THE DATABASE */
-  idb_file->ifile_idb=fopen(path,"rb"); /* binary file */
-  if (!idb_file->ifile_idb) {
-    if (err_msg)
-      sprintf(err_msg,"unable to open file %s",path);
+  idb_file->is_compressed=(format==IDB_FORMAT_PACKED);
+  idb_file->idb_handle=file_pool_open(filestem,"rb",format,div,err_msg); /* OPEN THE DATABASE */
+  if (idb_file->idb_handle<0) {
     free(idb_file);
     return NULL;
   }
+  if (read_delta_file(idb_file,filestem,err_msg)) { /* ANY APPENDED INTERVALS */
+    free_interval_dbfile(idb_file);
+    return NULL;
+  }
   return idb_file;
  handle_malloc_failure:
   FREE(ii); /* DUMP OUR MEMORY */
@@ -897,14 +2811,221 @@ IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
 
 
 
+static void free_delta(IntervalDBFile *db_file)
+{
+  FREE(db_file->delta_im);
+  FREE(db_file->delta_subheader);
+  db_file->delta_n=db_file->delta_ntop=db_file->delta_nlists=0;
+}
+
+
+/* LOAD filestem.delta, THE LOG OF INTERVALS APPENDED SINCE THE INDEX WAS
+   BUILT, AS A SMALL IN-MEMORY NESTED LIST THAT find_dbfile_intervals()
+   SEARCHES ALONG WITH THE MAIN INDEX.  NO .delta FILE MEANS NOTHING WAS
+   APPENDED.  RELOADS THE DELTA IF CALLED AGAIN. */
+int read_delta_file(IntervalDBFile *db_file,char filestem[],char err_msg[])
+{
+  int n=0,nread,nalloc=1024,ntop,nlists;
+  char path[2048];
+  IntervalMap *im=NULL;
+  SublistHeader *subheader=NULL;
+  FILE *ifile=NULL;
+
+  free_delta(db_file);
+  sprintf(path,"%s.delta",filestem);
+  ifile=fopen(path,"rb"); /* binary file */
+  if (!ifile) /* NOTHING APPENDED */
+    return 0;
+  CALLOC(im,nalloc,IntervalMap);
+  while ((nread=(int)fread(im+n,sizeof(IntervalMap),nalloc-n,ifile))>0) {
+    n+=nread;
+    if (n==nalloc) { /* MAKE ROOM FOR MORE */
+      nalloc*=2;
+      REALLOC(im,nalloc,IntervalMap);
+    }
+  }
+  if (ferror(ifile)) {
+    if (err_msg)
+      sprintf(err_msg,"error reading file %s",path);
+    fclose(ifile);
+    FREE(im);
+    return -1;
+  }
+  fclose(ifile);
+  ifile=NULL;
+  if (n==0) { /* EMPTY LOG */
+    FREE(im);
+    return 0;
+  }
+  subheader=build_nested_list_inplace(im,n,&ntop,&nlists);
+  if (!subheader)
+    goto handle_malloc_failure;
+  db_file->delta_im=im;
+  db_file->delta_subheader=subheader;
+  db_file->delta_n=n;
+  db_file->delta_ntop=ntop;
+  db_file->delta_nlists=nlists;
+  return 0;
+ handle_malloc_failure:
+  if (ifile)
+    fclose(ifile);
+  FREE(im);
+  if (err_msg)
+    sprintf(err_msg,"out of memory reading %s",path);
+  return -1;
+}
+
+
+/* APPEND n INTERVALS TO filestem.delta.  OPEN IntervalDBFiles SEE THEM
+   AFTER read_delta_file() */
+int append_intervals(char filestem[],IntervalMap im[],int n,char err_msg[])
+{
+  char path[2048];
+  FILE *ofile=NULL;
+
+  sprintf(path,"%s.delta",filestem);
+  ofile=fopen(path,"ab"); /* binary file */
+  if (!ofile) {
+    if (err_msg)
+      sprintf(err_msg,"unable to open file %s for writing",path);
+    return -1;
+  }
+  if (n!=(int)fwrite(im,sizeof(IntervalMap),n,ofile)) {
+    fclose(ofile);
+    goto write_error_occurred;
+  }
+  if (fclose(ofile))
+    goto write_error_occurred;
+  return 0;
+ write_error_occurred:
+  if (err_msg)
+    sprintf(err_msg,"error writing file %s! out of disk space?",path);
+  return -1;
+}
+
+
+/* COPY n RECORDS FROM THE CURRENT POSITION OF ifile TO ofile, OR ALL THE
+   REST OF ifile IF n<0.  RETURNS #RECORDS COPIED, OR -1 ON WRITE ERROR */
+static int copy_interval_records(FILE *ifile,int n,FILE *ofile,
+				 IntervalMap buf[],int nbuf)
+{
+  int i,nread,ncopy=0;
+  while (n<0 || ncopy<n) {
+    nread=(n<0 || n-ncopy>nbuf) ? nbuf : n-ncopy;
+    nread=(int)fread(buf,sizeof(IntervalMap),nread,ifile);
+    if (nread<=0)
+      break;
+    for (i=0;i<nread;i++)
+      buf[i].sublist= -1; /* UNSORTED DATA FOR A NEW BUILD */
+    if (nread!=(int)fwrite(buf,sizeof(IntervalMap),nread,ofile))
+      return -1;
+    ncopy+=nread;
+  }
+  return ncopy;
+}
+
+
+/* WRITE EVERY INTERVAL OF filestem, PLUS ITS .delta LOG, TO buildfile AS
+   UNSORTED RECORDS FOR REBUILDING THE INDEX.  *p_format IS SET TO THE
+   CURRENT .idb FORMAT.  RETURNS THE #INTERVALS WRITTEN, OR -1 ON ERROR */
+int write_compaction_file(char filestem[],char buildfile[],int *p_format,
+			  char err_msg[])
+{
+  int i,n,ntop,div,nlists,nii,ncopy,ntotal=0;
+  char path[2048];
+  IntervalMap buf[1024];
+  SublistHeader subheader;
+  FILE *ifile=NULL,*subfile=NULL,*ofile=NULL;
+
+  if (read_size_file(filestem,&n,&ntop,&div,&nlists,&nii,p_format,err_msg))
+    return -1;
+  ifile=open_idb_file(filestem,*p_format,div,err_msg);
+  if (!ifile)
+    return -1;
+  ofile=fopen(buildfile,"wb"); /* binary file */
+  if (!ofile) {
+    strcpy(path,buildfile);
+    goto unable_to_open_file;
+  }
+  sprintf(path,"%s.idb",filestem);
+  PYGR_FSEEK(ifile,0,SEEK_SET); /* TOP-LEVEL LIST */
+  if ((ncopy=copy_interval_records(ifile,ntop,ofile,buf,1024))<0)
+    goto write_error_occurred;
+  ntotal+=ncopy;
+  if (nlists>0) { /* THEN EACH SUBLIST */
+    sprintf(path,"%s.subhead",filestem);
+    subfile=fopen(path,"rb"); /* binary file */
+    if (!subfile)
+      goto unable_to_open_file;
+    for (i=0;i<nlists;i++) {
+      if (1!=fread(&subheader,sizeof(SublistHeader),1,subfile))
+	goto fread_error_occurred;
+      PYGR_FSEEK(ifile,subheader.start*(PYGR_OFF_T)sizeof(IntervalMap),
+		 SEEK_SET);
+      if ((ncopy=copy_interval_records(ifile,subheader.len,ofile,buf,1024))<0)
+	goto write_error_occurred;
+      ntotal+=ncopy;
+    }
+    fclose(subfile);
+    subfile=NULL;
+  }
+  if (ntotal!=n) {
+    sprintf(path,"%s.idb",filestem);
+    goto fread_error_occurred;
+  }
+  fclose(ifile);
+  ifile=NULL;
+  sprintf(path,"%s.delta",filestem); /* APPENDED INTERVALS, IF ANY */
+  ifile=fopen(path,"rb"); /* binary file */
+  if (ifile) {
+    if ((ncopy=copy_interval_records(ifile,-1,ofile,buf,1024))<0)
+      goto write_error_occurred;
+    ntotal+=ncopy;
+    fclose(ifile);
+    ifile=NULL;
+  }
+  if (fclose(ofile)) {
+    ofile=NULL;
+    strcpy(path,buildfile);
+    goto write_error_occurred;
+  }
+  return ntotal;
+ unable_to_open_file:
+  if (err_msg)
+    sprintf(err_msg,"unable to open file %s",path);
+  goto handle_error;
+ fread_error_occurred:
+  if (err_msg)
+    sprintf(err_msg,"error or EOF reading file %s",path);
+  goto handle_error;
+ write_error_occurred:
+  if (err_msg)
+    sprintf(err_msg,"error writing output file! out of disk space?");
+ handle_error:
+  if (ifile)
+    fclose(ifile);
+  if (subfile)
+    fclose(subfile);
+  if (ofile)
+    fclose(ofile);
+  return -1;
+}
+
+
+
 int free_interval_dbfile(IntervalDBFile *db_file)
 {
-  if (db_file->ifile_idb)
-    fclose(db_file->ifile_idb);
-#ifdef ON_DEMAND_SUBLIST_HEADER
-  if (db_file->subheader_file.ifile)
-    fclose(db_file->subheader_file.ifile);
+  if (db_file->idb_handle>=0) /* ALSO DROPS ITS CACHED BLOCKS */
+    file_pool_close(db_file->idb_handle);
+  if (db_file->subheader_handle>=0)
+    file_pool_close(db_file->subheader_handle);
+#ifdef PYGR_HAVE_MMAP
+  if (db_file->im_map)
+    munmap((void *)db_file->im_map,db_file->im_map_size);
+  if (db_file->subheader_map)
+    munmap((void *)db_file->subheader_map,db_file->subheader_map_size);
 #endif
+  free_delta(db_file);
   FREE(db_file->ii);
   FREE(db_file->subheader);
   free(db_file);
@@ -913,24 +3034,182 @@ int free_interval_dbfile(IntervalDBFile *db_file)
 
 
 
+#ifdef PYGR_HAVE_MMAP
+/* MAP A WHOLE FILE READ-ONLY.  RETURNS NULL IF FILE IS EMPTY OR ON ERROR;
+   *p_size IS SET TO -1 ON ERROR */
+static void *map_file_readonly(char path[],size_t *p_size)
+{
+  int fd;
+  struct stat st;
+  void *p=NULL;
+
+  *p_size=0;
+  fd=open(path,O_RDONLY);
+  if (fd<0)
+    goto error_return;
+  if (fstat(fd,&st)<0) {
+    close(fd);
+    goto error_return;
+  }
+  if (st.st_size>0) { /* mmap() OF AN EMPTY FILE IS AN ERROR */
+    p=mmap(NULL,(size_t)st.st_size,PROT_READ,MAP_SHARED,fd,0);
+    if (p==MAP_FAILED) {
+      close(fd);
+      goto error_return;
+    }
+    *p_size=(size_t)st.st_size;
+  }
+  close(fd); /* MAPPING REMAINS VALID AFTER THE DESCRIPTOR IS CLOSED */
+  return p;
+ error_return:
+  *p_size=(size_t)-1;
+  return NULL;
+}
+#endif
+
+
+/* SWITCH AN OPEN IntervalDBFile TO SEARCHING MEMORY-MAPPED .idb AND
+   .subhead FILES.  THE FILE FORMAT IS UNCHANGED.  THE STDIO HANDLES ARE
+   CLOSED, SINCE ALL SUBSEQUENT READS GO THROUGH THE MAPPINGS. */
+int mmap_binary_files(IntervalDBFile *db_file,char filestem[],char err_msg[])
+{
+#ifdef PYGR_HAVE_MMAP
+  char path[2048];
+  IntervalMap *im_map=NULL;
+  SublistHeader *subheader_map=NULL;
+  size_t im_size=0,subheader_size=0;
+
+  if (db_file->is_compressed) { /* NOTHING TO SEARCH IN PLACE */
+    if (err_msg)
+      sprintf(err_msg,"%s.idb is compressed and cannot be memory-mapped",
+	      filestem);
+    return -1;
+  }
+  sprintf(path,"%s.idb",filestem);
+  im_map=(IntervalMap *)map_file_readonly(path,&im_size);
+  if (im_size==(size_t)-1)
+    goto map_error;
+  if (db_file->nlists>0) {
+    sprintf(path,"%s.subhead",filestem);
+    subheader_map=(SublistHeader *)map_file_readonly(path,&subheader_size);
+    if (subheader_size==(size_t)-1) {
+      if (im_map)
+	munmap((void *)im_map,im_size);
+      goto map_error;
+    }
+  }
+#ifdef MADV_RANDOM
+  if (im_map) /* NESTED LIST QUERIES JUMP AROUND THE FILE */
+    madvise((void *)im_map,im_size,MADV_RANDOM);
+#endif
+
+  if (db_file->idb_handle>=0) { /* NO LONGER NEEDED */
+    file_pool_close(db_file->idb_handle);
+    db_file->idb_handle= -1;
+    db_file->ifile_idb=NULL;
+  }
+  if (db_file->subheader_handle>=0) {
+    file_pool_close(db_file->subheader_handle);
+    db_file->subheader_handle= -1;
+    db_file->subheader_file.ifile=NULL;
+  }
+  FREE(db_file->ii); /* ONLY USED FOR READING BLOCKS FROM THE FILES */
+  FREE(db_file->subheader);
+  db_file->subheader_file.subheader=NULL;
+  db_file->im_map=im_map;
+  db_file->im_map_size=im_size;
+  db_file->subheader_map=subheader_map;
+  db_file->subheader_map_size=subheader_size;
+  db_file->is_mapped=1;
+  return 0;
+ map_error:
+  if (err_msg)
+    sprintf(err_msg,"unable to mmap file %s",path);
+  return -1;
+#else
+  if (err_msg)
+    sprintf(err_msg,"mmap is not supported on this platform");
+  return -1;
+#endif
+}
+
+
+/* SEARCH AN IntervalDBFile, USING ITS MEMORY MAPPING IF PRESENT,
+   OTHERWISE READING BLOCKS FROM DISK.  HITS FROM ITS DELTA (APPENDED
+   INTERVALS) FOLLOW THE HITS FROM THE MAIN INDEX */
+int find_dbfile_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,
+			  IntervalDBFile *db_file,
+			  IntervalMap buf[],int nbuf,
+			  int *p_nreturn,IntervalIterator **it_return)
+{
+  int nmain,ndelta;
+  IntervalIterator *top=it0;
+
+  if (top) {
+    ITERATOR_STACK_TOP(top);
+    if (top->in_delta) /* MAIN INDEX ALREADY EXHAUSTED */
+      return find_intervals(it0,start,end,db_file->delta_im,db_file->delta_ntop,
+			    db_file->delta_subheader,db_file->delta_nlists,
+			    buf,nbuf,p_nreturn,it_return);
+  }
+  if (db_file->is_mapped) { /* SEARCH THE MAPPED ARRAY DIRECTLY */
+    if (find_intervals(it0,start,end,db_file->im_map,db_file->ntop,
+		       db_file->subheader_map,db_file->nlists,
+		       buf,nbuf,p_nreturn,it_return))
+      return -1;
+  }
+  else {
+    if (db_file->subheader_handle>=0 /* (RE)OPEN ITS FILES IF NEEDED */
+	&& !(db_file->subheader_file.ifile=
+	     file_pool_get(db_file->subheader_handle,NULL)))
+      return -1;
+    if (!(db_file->ifile_idb=file_pool_get(db_file->idb_handle,NULL)))
+      return -1;
+    if (find_file_intervals(it0,start,end,db_file->ii,db_file->nii,
+			    db_file->subheader,db_file->nlists,
+			    &(db_file->subheader_file),
+			    db_file->ntop,db_file->div,
+			    db_file->ifile_idb,buf,nbuf,
+			    p_nreturn,it_return))
+      return -1;
+  }
+  if (*it_return || !db_file->delta_im) /* NOTHING MORE TO DO FOR NOW */
+    return 0;
+
+  if (!top && !(top=interval_iterator_alloc())) /* NEED ONE FOR THE DELTA */
+    return -1;
+  top=reset_interval_iterator(top); /* START THE DELTA FROM ITS TOP LIST */
+  top->in_delta=1;
+  nmain= *p_nreturn;
+  if (nmain>=nbuf) { /* BUFFER FULL: SEARCH THE DELTA ON THE NEXT CALL */
+    *it_return=top;
+    return 0;
+  }
+  if (find_intervals(top,start,end,db_file->delta_im,db_file->delta_ntop,
+		     db_file->delta_subheader,db_file->delta_nlists,
+		     buf+nmain,nbuf-nmain,&ndelta,it_return))
+    return -1;
+  *p_nreturn=nmain+ndelta;
+  if (!it0 && !*it_return) /* FREE THE ITERATOR WE CREATED */
+    free_interval_iterator(top);
+  return 0;
+}
+
+
+
 
 int save_text_file(char filestem[],char basestem[],
 		   char err_msg[],FILE *ofile)
 {
-  int i,n,ntop,div,nlists,nii,npad;
+  int i,n,ntop,div,nlists,nii,npad,format;
   char path[2048];
   IntervalMap im;
   IntervalIndex ii;
   SublistHeader subheader;
   FILE *ifile=NULL;
 
-  sprintf(path,"%s.size",filestem); /* READ BASIC SIZE INFO*/
-  ifile=fopen(path,"r"); /* text file */
-  if (!ifile) 
-    goto unable_to_open_file;
-  if (5!=fscanf(ifile,"%d %d %d %d %d",&n,&ntop,&div,&nlists,&nii))
-    goto fread_error_occurred;
-  fclose(ifile);
+  if (read_size_file(filestem,&n,&ntop,&div,&nlists,&nii,&format,err_msg))
+    return -1;
   npad=ntop%div;
   if (npad>0) /* PAD TO AN EXACT MULTIPLE OF div */
     npad=ntop+(div-npad);
@@ -949,7 +3228,7 @@ int save_text_file(char filestem[],char basestem[],
     for (i=0;i<nii;i++) {
       if (1!=fread(&ii,sizeof(IntervalIndex),1,ifile))
 	goto fread_error_occurred;
-      if (fprintf(ofile,"I %d %d\n",ii.start,ii.end)<0)
+      if (fprintf(ofile,"I "COORD_FMT" "COORD_FMT"\n",ii.start,ii.end)<0)
 	goto write_error_occurred;
     }
     fclose(ifile);
@@ -972,13 +3251,14 @@ int save_text_file(char filestem[],char basestem[],
 
   if (npad>0) {
     sprintf(path,"%s.idb",filestem); /* READ THE DATABASE */
-    ifile=fopen(path,"rb"); /* binary file */
+    ifile=open_idb_file(filestem,format,div,err_msg); /* MAY BE COMPRESSED */
     if (!ifile) 
-      goto unable_to_open_file;
+      return -1;
     for (i=0;i<npad;i++) {
       if (1!=fread(&im,sizeof(IntervalMap),1,ifile))
 	goto fread_error_occurred;
-      if (fprintf(ofile,"M %d %d %d %d %d %d\n",im.start,im.end,
+      if (fprintf(ofile,"M "COORD_FMT" "COORD_FMT" %d "COORD_FMT" "COORD_FMT" %d\n",
+		  im.start,im.end,
 		  im.target_id,im.target_start,
 		  im.target_end,im.sublist)<0)
 	goto write_error_occurred;
@@ -1013,14 +3293,20 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
 
   if (NULL==fgets(line,32767,infile))
     goto fread_error_occurred;
-  if (6!=sscanf(line,"SIZE\t%s\t%d %d %d %d %d",
+  if (strlen(buildpath)>1000) {
+    if (err_msg)
+      sprintf(err_msg,"build path too long: %.900s",buildpath);
+    return -1;
+  }
+  if (6!=sscanf(line,"SIZE\t%1000s\t%d %d %d %d %d",
 		filestem,&n,&ntop,&div,&nlists,&nii))
     goto fread_error_occurred;
-  sprintf(path,"%s%s.size",buildpath,filestem); /* SAVE BASIC SIZE INFO*/
+  sprintf(path,"%.1000s%.1000s.size",buildpath,filestem); /* SAVE BASIC SIZE INFO*/
   ifile=fopen(path,"w"); /* text file */
   if (!ifile) 
     goto unable_to_open_file;
-  if (fprintf(ifile,"%d %d %d %d %d\n",n,ntop,div,nlists,nii)<0)
+  if (fprintf(ifile,"%d %d %d %d %d %d\n",n,ntop,div,nlists,nii,
+	      INTERVAL_COORD_BITS)<0)
     goto write_error_occurred;
   fclose(ifile);
   npad=ntop%div;
@@ -1030,14 +3316,14 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
     npad=ntop;
 
   if (nii>0) {
-    sprintf(path,"%s%s.index",buildpath,filestem); /* SAVE INDEX INFO*/
+    sprintf(path,"%.1000s%.1000s.index",buildpath,filestem); /* SAVE INDEX INFO*/
     ifile=fopen(path,"wb"); /* binary file */
     if (!ifile) 
       goto unable_to_open_file;
     for (i=0;i<nii;i++) {
       if (NULL==fgets(line,32767,infile))
 	goto fread_error_occurred;
-      if (2!=sscanf(line,"I %d %d",&(ii.start),&(ii.end)))
+      if (2!=sscanf(line,"I "COORD_FMT" "COORD_FMT,&(ii.start),&(ii.end)))
 	goto fread_error_occurred;
       if (1!=fwrite(&ii,sizeof(IntervalIndex),1,ifile))
 	goto write_error_occurred;
@@ -1046,7 +3332,7 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
   }
 
   if(nlists>0){
-    sprintf(path,"%s%s.subhead",buildpath,filestem); /* SAVE THE SUBHEADER LIST */
+    sprintf(path,"%.1000s%.1000s.subhead",buildpath,filestem); /* SAVE THE SUBHEADER LIST */
     ifile=fopen(path,"wb"); /* binary file */
     if (!ifile) 
       goto unable_to_open_file;
@@ -1062,14 +3348,15 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
     fclose(ifile);
   }
 
-  sprintf(path,"%s%s.idb",buildpath,filestem); /* SAVE THE ACTUAL INTERVAL DB*/
+  sprintf(path,"%.1000s%.1000s.idb",buildpath,filestem); /* SAVE THE ACTUAL INTERVAL DB*/
   ifile=fopen(path,"wb"); /* binary file */
   if (!ifile) 
     goto unable_to_open_file;
   for (i=0;i<npad;i++) {
     if (NULL==fgets(line,32767,infile))
       goto fread_error_occurred;
-    if (6!=sscanf(line,"M %d %d %d %d %d %d",&(im.start),&(im.end),
+    if (6!=sscanf(line,"M "COORD_FMT" "COORD_FMT" %d "COORD_FMT" "COORD_FMT" %d",
+		  &(im.start),&(im.end),
 		  &(im.target_id),&(im.target_start),
 		  &(im.target_end),&(im.sublist)))
       goto fread_error_occurred;
@@ -1081,7 +3368,7 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
   return 0; /* INDICATES NO ERROR OCCURRED */
  unable_to_open_file:
   if (err_msg)
-    sprintf(err_msg,"unable to open file %s",path);
+    sprintf(err_msg,"unable to open file %.900s",path);
   return -1;
  fread_error_occurred:
   if (err_msg)
@@ -1089,7 +3376,7 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
   return -1;
  write_error_occurred:
   if (err_msg)
-    sprintf(err_msg,"error writing file %s! out of disk space?",
+    sprintf(err_msg,"error writing file %.900s! out of disk space?",
 	    path);
   return -1;
 }
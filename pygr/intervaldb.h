@@ -6,19 +6,39 @@
 
 extern int C_int_max;
 
+/* COORDINATE TYPE.  COMPILE WITH -DINTERVALDB_64BIT FOR 64-BIT COORDINATES,
+   e.g. FOR UNIONS OR LPOS LARGER THAN 2 GB.  THE COORDINATE SIZE IS SAVED
+   IN THE .size FILE, AND FILES OF THE OTHER SIZE WILL REFUSE TO OPEN. */
+#ifdef INTERVALDB_64BIT
+typedef long long IntervalCoord;
+#define INTERVAL_COORD_MAX LLONG_MAX
+#define COORD_FMT "%lld"
+#else
+typedef int IntervalCoord;
+#define INTERVAL_COORD_MAX INT_MAX
+#define COORD_FMT "%d"
+#endif
+#define INTERVAL_COORD_BITS ((int)(8*sizeof(IntervalCoord)))
+
+/* STORAGE FORMATS FOR THE .idb FILE, SAVED AS THE LAST FIELD OF .size */
+#define IDB_FORMAT_RAW 0 /* PLAIN IntervalMap RECORDS */
+#define IDB_FORMAT_PACKED 1 /* DELTA/VARINT-ENCODED BLOCKS, INDEXED BY .blocks */
+
+extern IntervalCoord C_coord_max;
+
 typedef struct {
-  int start;
-  int end;
+  IntervalCoord start;
+  IntervalCoord end;
   int target_id;
-  int target_start;
-  int target_end;
+  IntervalCoord target_start;
+  IntervalCoord target_end;
   int sublist;
 } IntervalMap;
 
 
 typedef struct {
-  int start;
-  int end;
+  IntervalCoord start;
+  IntervalCoord end;
 } IntervalIndex;
 
 typedef struct {
@@ -51,6 +71,19 @@ typedef struct {
   SublistHeader *subheader;
   SubheaderFile subheader_file;
   FILE *ifile_idb;
+  int idb_handle; /* FILE POOL HANDLES OF THE .idb AND .subhead FILES */
+  int subheader_handle;
+  int is_compressed; /* NON-ZERO IF .idb IS STORED IN IDB_FORMAT_PACKED */
+  int is_mapped; /* NON-ZERO IF .idb AND .subhead ARE MEMORY-MAPPED */
+  IntervalMap *im_map; /* READ-ONLY MAPPING OF THE WHOLE .idb FILE */
+  SublistHeader *subheader_map; /* READ-ONLY MAPPING OF THE WHOLE .subhead FILE */
+  size_t im_map_size;
+  size_t subheader_map_size;
+  IntervalMap *delta_im; /* INTERVALS APPENDED TO filestem.delta, IN MEMORY */
+  SublistHeader *delta_subheader;
+  int delta_n;
+  int delta_ntop;
+  int delta_nlists;
 } IntervalDBFile;
 
 typedef struct IntervalIterator_S {
@@ -62,20 +95,62 @@ typedef struct IntervalIterator_S {
   IntervalMap *im;
   struct IntervalIterator_S *up;
   struct IntervalIterator_S *down;
+  int in_delta; /* SET ON THE TOP ITERATOR ONCE THE DELTA IS BEING SEARCHED */
 } IntervalIterator;
 
 
-typedef struct {
-  FILE *ifile;
-  int left;
-  int right;
-  int ihead;
+typedef struct { /* ONE FILE IN THE FILE POOL, SEE file_pool_get() */
+  FILE *ifile; /* NULL WHILE IT IS CLOSED */
+  int left; /* LRU LIST OF OPEN FILES: MORE RECENTLY USED NEIGHBOUR, OR -1 */
+  int right; /* LESS RECENTLY USED NEIGHBOUR, OR -1 */
+  int ihead; /* NEXT UNUSED RECORD, WHILE THIS RECORD IS UNUSED */
   char *filename;
+  char mode[4]; /* fopen() MODE FOR REOPENING IT */
+  int format; /* -1, OR THE FORMAT OF AN .idb OPENED BY open_idb_file() */
+  int div;
+  int status; /* -1 IF CLOSING IT FAILED, E.G. A FAILED WRITE */
 } FilePtrRecord;
 
+typedef struct { /* COUNTERS FOR THE SHARED FILE POOL */
+  int nfiles; /* #FILES IN THE POOL */
+  int nopen; /* #CURRENTLY OPEN */
+  int max_open; /* 0 MEANS NO LIMIT */
+  long long reopens;
+} FilePoolStats;
+
+typedef struct { /* INTERVALS BUFFERED FOR APPENDING TO A POOLED FILE */
+  int ihandle;
+  int n;
+  int nalloc;
+  IntervalMap *im;
+} BuildFile;
+
+#define BUILD_FILE_NBUF 512 /* #RECORDS TO BUFFER BEFORE WRITING */
+
+typedef struct { /* COUNTERS FOR THE SHARED BLOCK CACHE */
+  long long hits;
+  long long misses;
+  long long evictions;
+  int nblocks;
+  size_t size; /* BYTES CURRENTLY CACHED */
+  size_t max_size; /* BYTE BUDGET; 0 MEANS DISABLED */
+} BlockCacheStats;
+
+typedef struct { /* ONE INTERVAL REPORTED BY group_sequences() */
+  IntervalCoord start;
+  IntervalCoord end;
+  IntervalCoord target_start;
+  IntervalCoord target_end;
+  int ival; /* INDEX OF ITS INPUT INTERVAL, OR -1 FOR A SOURCE INTERVAL */
+  int clip; /* 1: CLIPPED AT start, 2: CLIPPED TO [start,end), 0: NOT CLIPPED */
+} GroupInterval;
+
 extern int imstart_qsort_cmp(const void *void_a,const void *void_b);
 extern int target_qsort_cmp(const void *void_a,const void *void_b);
 extern IntervalMap *read_intervals(int n,FILE *ifile);
+extern int set_sort_threads(int nthreads);
+extern int sort_intervals(IntervalMap im[],int n,int (*cmp)(const void *,const void *));
+
 extern SublistHeader *build_nested_list(IntervalMap im[],int n,
 					int *p_n,int *p_nlists);
 extern SublistHeader *build_nested_list_inplace(IntervalMap im[],int n,
@@ -85,22 +160,70 @@ extern IntervalDB *build_interval_db(IntervalMap im[],int n);
 extern IntervalIterator *interval_iterator_alloc(void);
 extern int free_interval_iterator(IntervalIterator *it);
 extern IntervalIterator *reset_interval_iterator(IntervalIterator *it);
-extern int find_intervals(IntervalIterator *it0,int start,int end,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return);
+extern int find_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return);
+extern int find_intervals_batch(int nquery,IntervalCoord starts[],IntervalCoord ends[],
+				IntervalMap im[],int n,
+				SublistHeader subheader[],int nlists,
+				IntervalDBFile *db_file,
+				IntervalMap **p_buf,int *p_nbuf,int offsets[]);
+extern int interval_coverage(IntervalMap hits[],int nhit,IntervalCoord start,
+			     IntervalCoord end,int binsize,int depth[]);
+extern int find_coverage(IntervalCoord start,IntervalCoord end,int binsize,
+			 IntervalMap im[],int n,
+			 SublistHeader subheader[],int nlists,
+			 IntervalDBFile *db_file,int depth[]);
+extern int group_sequences(IntervalMap ivals[],int n,int nseq,int sourceOnly,
+			   int indelCut,int minAligned,double pMinAligned,
+			   GroupInterval **p_result);
 extern int read_imdiv(FILE *ifile,IntervalMap imdiv[],int div,int i_div,int ntop);
 extern IntervalMap *read_sublist(FILE *ifile,SublistHeader *subheader,IntervalMap *im);
-extern int find_file_intervals(IntervalIterator *it0,int start,int end,
+extern int find_file_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,
 			       IntervalIndex ii[],int nii,
 			       SublistHeader subheader[],int nlists,
 			       SubheaderFile *subheader_file,
 			       int ntop,int div,FILE *ifile,
 			       IntervalMap buf[],int nbuf,
 			       int *p_nreturn,IntervalIterator **it_return);
+extern size_t set_block_cache_size(size_t max_size);
+extern void get_block_cache_stats(BlockCacheStats *stats);
+extern void clear_block_cache(void);
+extern void block_cache_forget(FILE *ifile);
+extern int set_file_pool_size(int max_open);
+extern void get_file_pool_stats(FilePoolStats *stats);
+extern int file_pool_open(char filename[],char mode[],int format,int div,
+			  char err_msg[]);
+extern FILE *file_pool_get(int ihandle,char err_msg[]);
+extern int file_pool_close(int ihandle);
+extern int file_pool_after_fork(void);
+extern BuildFile *open_build_file(char filename[],char mode[],char err_msg[]);
+extern int write_build_file(BuildFile *bf,IntervalMap im[],int n);
+extern int flush_build_file(BuildFile *bf);
+extern int close_build_file(BuildFile *bf);
 extern int write_padded_binary(IntervalMap im[],int n,int div,FILE *ifile);
 extern char *write_binary_files(IntervalMap im[],int n,int ntop,int div,
 				SublistHeader *subheader,int nlists,char filestem[]);
+
+extern char *build_binary_files_external(char buildfile[],int n,int div,
+					 size_t max_memory,char filestem[]);
+extern int compress_binary_files(char filestem[],char err_msg[]);
+extern FILE *open_idb_file(char filestem[],int format,int div,char err_msg[]);
+extern int read_size_file(char filestem[],int *p_n,int *p_ntop,int *p_div,
+			  int *p_nlists,int *p_nii,int *p_format,char err_msg[]);
 extern IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
 					 int subheader_nblock);
+extern int read_delta_file(IntervalDBFile *db_file,char filestem[],
+			   char err_msg[]);
+extern int append_intervals(char filestem[],IntervalMap im[],int n,
+			    char err_msg[]);
+extern int write_compaction_file(char filestem[],char buildfile[],
+				 int *p_format,char err_msg[]);
 extern int free_interval_dbfile(IntervalDBFile *db_file);
+extern int mmap_binary_files(IntervalDBFile *db_file,char filestem[],
+			     char err_msg[]);
+extern int find_dbfile_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,
+				 IntervalDBFile *db_file,
+				 IntervalMap buf[],int nbuf,
+				 int *p_nreturn,IntervalIterator **it_return);
 
 extern int save_text_file(char filestem[],char err_msg[],
 			  char basestem[],FILE *ofile);
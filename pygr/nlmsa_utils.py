@@ -1,5 +1,5 @@
 import classutil, logger
-import os, types
+import os, types, mmap, struct, array, UserDict
 
 class NLMSASeqList(list):
     def __init__(self, nlmsaSeqDict):
@@ -78,7 +78,196 @@ class EmptySlice:
         return cmp(self.seq, other.seq)
     def rawIvals(self):
         return []
+    def raw_table(self, seq=None):
+        from cnestedlist import coord_typecode
+        return (array.array(coord_typecode), array.array(coord_typecode),
+                array.array('i'), array.array(coord_typecode),
+                array.array(coord_typecode), array.array('i'))
+    def to_arrays(self, seqIntervals=None, **kwargs):
+        return self.raw_table()
     
+_seqIndexHeader = '<8siiii' # magic, version, #seqs, first nlmsaID, #nlmsaIDs
+_seqIndexRecord = '<qiiq' # seqID string offset, length, nsID, offset
+_seqIndexMagic = 'NLMSAIDX'
+
+def write_seq_index(filename, seqIDdict):
+    '''save seqIDdict, a mapping of seqID to (nlmsaID, nsID, offset), as
+    an NLMSAIDIndex file: a header, then a table of seqID, nsID, offset
+    indexed by nlmsaID, then the nlmsaIDs sorted by seqID, then the seqIDs'''
+    l = [(seqID, t[0], t[1], t[2]) for seqID, t in seqIDdict.iteritems()]
+    l.sort()
+    if l:
+        minID = min([t[1] for t in l])
+        nID = max([t[1] for t in l]) - minID + 1
+    else:
+        minID = nID = 0
+    table = [struct.pack(_seqIndexRecord, 0, 0, -1, 0)] * nID # UNUSED IDs
+    sortedIDs = []
+    strOffset = 0
+    for seqID, nlmsaID, nsID, offset in l:
+        table[nlmsaID - minID] = struct.pack(_seqIndexRecord, strOffset,
+                                             len(seqID), nsID, offset)
+        sortedIDs.append(struct.pack('<i', nlmsaID))
+        strOffset += len(seqID)
+    ifile = file(filename, 'wb')
+    try:
+        ifile.write(struct.pack(_seqIndexHeader, _seqIndexMagic, 1, len(l),
+                                minID, nID))
+        ifile.write(''.join(table))
+        ifile.write(''.join(sortedIDs))
+        for t in l:
+            ifile.write(t[0])
+    finally:
+        ifile.close()
+
+def save_seq_index(pathstem):
+    '''save the pathstem.seqIDdict shelve of an NLMSA built by an older
+    version of pygr as the NLMSAIDIndex pathstem.seqIndex'''
+    seqIDdict = classutil.open_shelve(pathstem + '.seqIDdict', 'r')
+    try:
+        write_seq_index(pathstem + '.seqIndex', seqIDdict)
+    finally:
+        seqIDdict.close()
+
+def open_seq_id_dict(pathstem):
+    '''open the seqID -> (nlmsaID, nsID, offset) index of an NLMSA, read-only.
+    NLMSAs built by older versions of pygr only have the shelve version.'''
+    if os.access(pathstem + '.seqIndex', os.R_OK):
+        return NLMSAIDIndex(pathstem + '.seqIndex')
+    return classutil.open_shelve(pathstem + '.seqIDdict', 'r')
+
+
+class NLMSAIDIndex(object, UserDict.DictMixin):
+    '''read-only dict of seqID -> (nlmsaID, nsID, offset), from a file
+    saved by write_seq_index().  The file is memory-mapped rather than
+    read, so opening it takes constant time regardless of the number of
+    sequences; seqID lookups are a binary search, with no unpickling.
+    Its IDdict attribute gives the str(nlmsaID) -> (seqID, nsID) mapping.'''
+    def __init__(self, filename):
+        ifile = file(filename, 'rb')
+        try:
+            self.data = mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            ifile.close()
+        headerSize = struct.calcsize(_seqIndexHeader)
+        magic, version, self.n, self.minID, self.nID = \
+               struct.unpack(_seqIndexHeader, self.data[:headerSize])
+        if magic != _seqIndexMagic or version != 1:
+            self.data.close()
+            raise IOError('%s: not an NLMSA sequence index file' % filename)
+        self.recordSize = struct.calcsize(_seqIndexRecord)
+        self.tableStart = headerSize
+        self.sortedStart = self.tableStart + self.nID * self.recordSize
+        self.stringStart = self.sortedStart + 4 * self.n
+        self.IDdict = _NLMSAIDIndexByID(self)
+
+    def get_record(self, nlmsaID):
+        'return seqID, nsID, offset for nlmsaID'
+        i = nlmsaID - self.minID
+        if i < 0 or i >= self.nID:
+            raise KeyError('nlmsaID %d not found' % nlmsaID)
+        start = self.tableStart + i * self.recordSize
+        strOffset, strLen, nsID, offset = \
+                   struct.unpack(_seqIndexRecord,
+                                 self.data[start:start + self.recordSize])
+        if nsID < 0: # UNUSED nlmsaID
+            raise KeyError('nlmsaID %d not found' % nlmsaID)
+        start = self.stringStart + strOffset
+        return self.data[start:start + strLen], nsID, offset
+
+    def get_sorted(self, i):
+        'return the i-th nlmsaID in seqID order, and its record'
+        start = self.sortedStart + 4 * i
+        nlmsaID = struct.unpack('<i', self.data[start:start + 4])[0]
+        return nlmsaID, self.get_record(nlmsaID)
+
+    def __getitem__(self, seqID):
+        left, right = 0, self.n
+        while left < right: # BINARY SEARCH OF THE SORTED seqIDs
+            mid = (left + right) / 2
+            nlmsaID, (midID, nsID, offset) = self.get_sorted(mid)
+            if midID == seqID:
+                return nlmsaID, nsID, offset
+            elif midID < seqID:
+                left = mid + 1
+            else:
+                right = mid
+        raise KeyError('%s not found' % seqID)
+
+    def __len__(self):
+        return self.n
+
+    def iteritems(self):
+        for i in xrange(self.n):
+            nlmsaID, (seqID, nsID, offset) = self.get_sorted(i)
+            yield seqID, (nlmsaID, nsID, offset)
+
+    def __iter__(self):
+        for seqID, t in self.iteritems():
+            yield seqID
+
+    def keys(self):
+        return list(self)
+
+    def close(self):
+        self.data.close()
+
+
+class _NLMSAIDIndexByID(object, UserDict.DictMixin):
+    'str(nlmsaID) -> (seqID, nsID) view of an NLMSAIDIndex, like idDict'
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, k):
+        try:
+            nlmsaID = int(k)
+        except ValueError:
+            raise KeyError('%s not found' % k)
+        seqID, nsID, offset = self.index.get_record(nlmsaID)
+        return seqID, nsID
+
+    def __len__(self):
+        return self.index.n
+
+    def __iter__(self):
+        for seqID, t in self.index.iteritems():
+            yield str(t[0])
+
+    def keys(self):
+        return list(self)
+
+    def close(self):
+        pass # THE INDEX IS CLOSED BY ITS OWNER
+
+
+class IndexCache(object):
+    """keep at most maxOpen NLMSASequence indexes loaded, unloading the
+    least recently used one when another is opened.  An unloaded index
+    stays open until queries using it are done, and is reopened on its
+    next query."""
+    def __init__(self, maxOpen):
+        if maxOpen < 1:
+            raise ValueError('maxOpenIndexes must be >= 1')
+        self.maxOpen = maxOpen
+        self.lastUse = {} # {nsID:(tick, NLMSASequence)}
+        self.tick = 0
+
+    def __len__(self):
+        return len(self.lastUse)
+
+    def touch(self, ns):
+        'mark ns as the most recently used index'
+        self.tick += 1
+        self.lastUse[ns.id] = (self.tick, ns)
+
+    def opened(self, ns):
+        'record that ns was just opened, unloading others if over budget'
+        self.touch(ns)
+        while len(self.lastUse) > self.maxOpen:
+            tick, oldest = min(self.lastUse.values())
+            del self.lastUse[oldest.id]
+            oldest.unload()
+
 class NLMSASeqDict(dict):
     'index sequences by pathForward, and use list to keep reverse mapping'
     def __init__(self, nlmsa, filename, mode, maxID=1000000, idDictClass=None):
@@ -91,7 +280,14 @@ class NLMSASeqDict(dict):
             idDictClass = dict
         elif mode == 'w': # new database
             mode = 'n'
-        if idDictClass is None: # use persistent id dictionary storage
+        if idDictClass is None and mode == 'n': # reopenReadOnly() saves them
+            self.seqIDdict = {}
+            self.IDdict = {}
+        elif idDictClass is None and mode == 'r' \
+               and os.access(filename + '.seqIndex', os.R_OK):
+            self.seqIDdict = NLMSAIDIndex(filename + '.seqIndex')
+            self.IDdict = self.seqIDdict.IDdict
+        elif idDictClass is None: # use persistent id dictionary storage
             self.seqIDdict = classutil.open_shelve(filename + '.seqIDdict', mode)
             self.IDdict = classutil.open_shelve(filename + '.idDict', mode)
         else: # user supplied class for id dictionary storage
@@ -171,11 +367,38 @@ class NLMSASeqDict(dict):
         do_close() # close both shelve objects
         self.IDdict.close()
         
+    def after_fork(self):
+        '''reopen shelve indexes in a child process after fork(), since a
+        bsddb handle must not be shared between processes.  An NLMSAIDIndex
+        is memory-mapped, so it can be shared as is'''
+        if isinstance(self.seqIDdict, NLMSAIDIndex):
+            return
+        try:
+            self.seqIDdict.close
+        except AttributeError:
+            return # not a shelve
+        self.seqIDdict = classutil.open_shelve(self.filename + '.seqIDdict',
+                                               'r')
+        self.IDdict = classutil.open_shelve(self.filename + '.idDict', 'r')
+
     def reopenReadOnly(self, mode='r'):
-        'save existing data and reopen in read-only mode'
-        self.close()
-        self.seqIDdict = classutil.open_shelve(self.filename + '.seqIDdict', mode)
-        self.IDdict = classutil.open_shelve(self.filename + '.idDict', mode)
+        '''save sequences added since the last call as a new NLMSAIDIndex,
+        and reopen it read-only.  mode='w' copies the index into memory
+        for adding sequences'''
+        if mode == 'r':
+            if isinstance(self.seqIDdict, NLMSAIDIndex):
+                return # NOTHING ADDED, SO ALREADY SAVED
+            write_seq_index(self.filename + '.seqIndex', self.seqIDdict)
+            self.close()
+            self.seqIDdict = NLMSAIDIndex(self.filename + '.seqIndex')
+            self.IDdict = self.seqIDdict.IDdict
+        else:
+            seqIDdict = dict(self.seqIDdict.iteritems())
+            IDdict = dict([(str(t[0]), (seqID, t[1]))
+                           for seqID, t in seqIDdict.iteritems()])
+            self.close()
+            self.seqIDdict = seqIDdict
+            self.IDdict = IDdict
         
     def getUnionSlice(self, seq):
         'get union coords for this seq interval, adding seq to index if needed'
@@ -359,13 +582,413 @@ class SeqCacheOwner(object):
       self.cachedSeqs[seq.id] = seq
 
 
+def _build_index_worker(args):
+    'build one NLMSASequence index in a worker process'
+    from cnestedlist import build_index_files
+    filestem, nbuild, kwargs = args
+    return build_index_files(filestem, nbuild, **kwargs)
+
+def build_index_files_parallel(seqlist, nWorkers=0, **kwargs):
+    """build the nested list index of each NLMSASequence in seqlist from
+    its .build file, using a pool of nWorkers processes (0 means one per
+    CPU).  An index holding more than 1/nWorkers of all the intervals
+    would hold up the pool, so it is built first in this process instead,
+    sorting with nWorkers threads.  Returns the total #intervals."""
+    from cnestedlist import build_index_files, set_sort_threads
+    try:
+        import multiprocessing
+    except ImportError: # python < 2.6: build serially, but sort in parallel
+        multiprocessing = None
+    if not nWorkers:
+        if multiprocessing is not None:
+            nWorkers = multiprocessing.cpu_count()
+        else:
+            nWorkers = 1
+    tasks = []
+    ntotal = 0
+    for ns in seqlist:
+        nbuild = ns.closeBuildFile()
+        tasks.append((nbuild, ns.filestem))
+        ntotal += nbuild
+    tasks.sort()
+    tasks.reverse() # BIGGEST FIRST, SO THE POOL FINISHES EVENLY
+    oldThreads = set_sort_threads(nWorkers)
+    try:
+        while tasks and (multiprocessing is None
+                         or tasks[0][0] * nWorkers > ntotal):
+            nbuild, filestem = tasks.pop(0)
+            logger.info('Building index %s (%d intervals)' % (filestem, nbuild))
+            build_index_files(filestem, nbuild, **kwargs)
+    finally:
+        set_sort_threads(oldThreads)
+    if tasks:
+        logger.info('Building %d indexes with %d processes'
+                    % (len(tasks), nWorkers))
+        pool = multiprocessing.Pool(min(nWorkers, len(tasks)))
+        try:
+            pool.map(_build_index_worker,
+                     [(filestem, nbuild, kwargs) for nbuild,filestem in tasks],
+                     1)
+        finally:
+            pool.close()
+            pool.join()
+    return ntotal
+
+def get_seq_lengths(seqDict):
+    'get list of (id, length) for every sequence in seqDict'
+    return [(id, seqInfo.length)
+            for id, seqInfo in seqDict.seqInfoDict.iteritems()]
+
+def split_maf_files(mafFiles, nchunk):
+    '''split mafFiles into about nchunk byte ranges of whole MAF blocks.
+    Returns a list of (filename, start, end), in file order.  A gzip or
+    bzip2 compressed file cannot be split, so is returned as a single
+    range (filename, 0, -1).'''
+    from cnestedlist import find_maf_block, is_compressed_file
+    sizes = []
+    for filename in mafFiles:
+        if is_compressed_file(filename): # HEADER IS CHECKED AS IT IS READ
+            sizes.append(None)
+            continue
+        ifile = file(filename)
+        try:
+            if not ifile.readline().startswith('##maf'): # HEADER LINE
+                raise IOError('%s: not a MAF file? Bad format.' % filename)
+        finally:
+            ifile.close()
+        sizes.append(os.stat(filename).st_size)
+    chunkSize = max(1, sum([size for size in sizes if size is not None])
+                    / max(1, nchunk))
+    ranges = []
+    for filename, size in zip(mafFiles, sizes):
+        if size is None: # READ THE WHOLE COMPRESSED FILE
+            ranges.append((filename, 0, -1))
+            continue
+        offsets = [find_maf_block(filename, 0)]
+        for offset in range(chunkSize, size, chunkSize): # SPLIT AT BLOCKS
+            offset = find_maf_block(filename, offset)
+            if offset > offsets[-1]:
+                offsets.append(offset)
+        if offsets[-1] < size:
+            offsets.append(size)
+        for i in range(len(offsets) - 1):
+            ranges.append((filename, offsets[i], offsets[i + 1]))
+    return ranges
+
+_mafSeqLengths = None
+
+def _init_maf_worker(seqLengths):
+    'save seqLengths for this worker process, so it is only sent once'
+    global _mafSeqLengths
+    _mafSeqLengths = seqLengths
+
+def _maf_shard_worker(args):
+    'parse one byte range of a MAF file in a worker process'
+    from cnestedlist import write_maf_shard
+    filename, start, end, shardFile = args
+    return write_maf_shard(filename, start, end, _mafSeqLengths, shardFile)
+
+def read_maf_files_parallel(mafFiles, seqLengths, pathstem, nWorkers=0):
+    '''parse mafFiles using a pool of nWorkers processes (0 means one per
+    CPU).  The files are split into byte ranges of whole blocks, and each
+    range is saved to a shard file named pathstem.mafN.  Returns
+    (shardFiles, linecodeCounts), with shardFiles in file order so that
+    reading them back in order is equivalent to reading the MAF files.'''
+    try:
+        import multiprocessing
+    except ImportError: # python < 2.6: parse in this process
+        multiprocessing = None
+    if not nWorkers:
+        if multiprocessing is not None:
+            nWorkers = multiprocessing.cpu_count()
+        else:
+            nWorkers = 1
+    ranges = split_maf_files(mafFiles, 4 * nWorkers) # SO THE POOL FINISHES EVENLY
+    tasks = [(filename, start, end, '%s.maf%d' % (pathstem, i))
+             for i, (filename, start, end) in enumerate(ranges)]
+    if not tasks: # NO BLOCKS TO READ
+        return [], [0] * 256
+    logger.info('Processing %d MAF files in %d pieces with %d processes'
+                % (len(mafFiles), len(tasks), nWorkers))
+    try:
+        if multiprocessing is None or nWorkers == 1:
+            _init_maf_worker(seqLengths)
+            results = map(_maf_shard_worker, tasks)
+        else:
+            pool = multiprocessing.Pool(min(nWorkers, len(tasks)),
+                                        _init_maf_worker, (seqLengths,))
+            try:
+                results = pool.map(_maf_shard_worker, tasks, 1)
+            finally:
+                pool.close()
+                pool.join()
+    except:
+        for t in tasks: # DON'T LEAVE PARTIAL SHARDS BEHIND
+            if os.access(t[3], os.F_OK):
+                os.remove(t[3])
+        raise
+    linecodeCounts = [0] * 256
+    for counts in results:
+        for i in range(256):
+            linecodeCounts[i] += counts[i]
+    return [t[3] for t in tasks], linecodeCounts
+
+class TextfileSectionWriter(object):
+    """write the sections of an NLMSA textfile, recording the offset where
+    each starts.  If compress is 'gzip' or 'bzip2', each section is
+    compressed as a separate stream, so that it can be decompressed
+    starting from its offset; the whole file still decompresses to the
+    usual textfile."""
+    def __init__(self, filename, compress=None):
+        if compress is True:
+            compress = 'gzip'
+        if compress not in (None, False, 'gzip', 'bzip2'):
+            raise ValueError('compress must be gzip or bzip2: %s' % compress)
+        self.filename = filename
+        self.compress = compress
+        self.ofile = file(filename, 'wb')
+        self.proc = None
+        self.offsets = []
+
+    def start(self):
+        'start a new section, returning the file to write it to'
+        self.end()
+        self.offsets.append(os.lseek(self.ofile.fileno(), 0, 1))
+        if not self.compress:
+            return self.ofile
+        import subprocess
+        self.proc = subprocess.Popen([self.compress, '-c'], bufsize=-1,
+                                     stdin=subprocess.PIPE, stdout=self.ofile)
+        return self.proc.stdin
+
+    def end(self):
+        'finish writing the current section'
+        if self.proc is not None:
+            proc = self.proc
+            self.proc = None
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise IOError('%s failed writing %s'
+                              % (self.compress, self.filename))
+        else:
+            self.ofile.flush()
+
+    def close(self):
+        self.end()
+        self.ofile.close()
+
+    def abort(self):
+        'close without checking for errors, after an error'
+        if self.proc is not None:
+            self.proc.stdin.close()
+            self.proc.wait()
+            self.proc = None
+        self.ofile.close()
+
+def write_textfile_sections(filename, sections):
+    'save list of (offset, NLMSAindex line) for NLMSA textfile filename'
+    ofile = file(filename + '.sections', 'w')
+    try:
+        for offset, line in sections:
+            ofile.write('%d\t%s' % (offset, line))
+    finally:
+        ofile.close()
+
+def read_textfile_sections(filename):
+    'get list of (offset, NLMSAindex line) for NLMSA textfile filename'
+    sections = []
+    ifile = file(filename + '.sections', 'rU')
+    try:
+        for line in ifile:
+            offset, line = line.split('\t', 1)
+            sections.append((int(offset), line))
+    finally:
+        ifile.close()
+    return sections
+
+def _restore_sigpipe():
+    'let a child process die quietly if we close its pipe early'
+    import signal
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+def _feed_pipe(filename, offset, length, bufsize=65536):
+    """fork a process writing length bytes of filename from offset to a
+    pipe, returning (its pid, the pipe's read fd).  A process, not a
+    thread, because our C readers hold the GIL while reading the pipe."""
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid: # PARENT
+        os.close(wfd)
+        return pid, rfd
+    status = 0
+    try:
+        try:
+            os.close(rfd)
+            fd = os.open(filename, os.O_RDONLY)
+            os.lseek(fd, offset, 0)
+            while length > 0:
+                s = os.read(fd, min(length, bufsize))
+                if not s:
+                    break
+                length -= len(s)
+                while s:
+                    s = s[os.write(wfd, s):]
+        except OSError: # THE READER EXITED WITHOUT READING IT ALL
+            pass
+        except:
+            status = 1
+    finally:
+        os._exit(status)
+
+def decompress_from(filename, offset, compress, length=None):
+    """start compress ('gzip' or 'bzip2') decompressing length bytes
+    (None: to the end of the file) of filename from offset, returning its
+    Popen object; read the output from its stdout, then reap the process
+    feeding it with os.waitpid(proc.feederPid, 0) after waiting for it."""
+    import subprocess
+    if length is None:
+        length = os.stat(filename).st_size - offset
+    pid, fd = _feed_pipe(filename, offset, length)
+    try:
+        try:
+            proc = subprocess.Popen([compress, '-dc'], bufsize=-1, stdin=fd,
+                                    stdout=subprocess.PIPE, close_fds=True,
+                                    preexec_fn=_restore_sigpipe)
+        finally:
+            os.close(fd)
+    except:
+        os.waitpid(pid, 0)
+        raise
+    proc.feederPid = pid
+    return proc
+
+def _textfile_section_worker(args):
+    'convert one NLMSASequence section of a textfile in a worker process'
+    from cnestedlist import textfile_section_to_binaries
+    filename, offset, buildpath, length = args
+    return textfile_section_to_binaries(filename, offset, buildpath, length)
+
+def textfile_sections_to_binaries(filename, offsets, buildpath, nWorkers=0):
+    """convert the NLMSASequence sections of NLMSA textfile filename
+    starting at offsets to binary index files, using a pool of nWorkers
+    processes (0 means one per CPU)."""
+    try:
+        import multiprocessing
+    except ImportError: # python < 2.6: convert in this process
+        multiprocessing = None
+    if not nWorkers:
+        if multiprocessing is not None:
+            nWorkers = multiprocessing.cpu_count()
+        else:
+            nWorkers = 1
+    ends = list(offsets[1:]) + [os.stat(filename).st_size]
+    tasks = [(end - offset, offset) for offset, end in zip(offsets, ends)]
+    tasks.sort()
+    tasks.reverse() # BIGGEST FIRST, SO THE POOL FINISHES EVENLY
+    tasks = [(filename, offset, buildpath, size) for size, offset in tasks]
+    if not tasks:
+        return
+    logger.info('Saving %d NLMSA binary indexes with %d processes'
+                % (len(tasks), nWorkers))
+    if multiprocessing is None or nWorkers == 1:
+        map(_textfile_section_worker, tasks)
+    else:
+        pool = multiprocessing.Pool(min(nWorkers, len(tasks)))
+        try:
+            pool.map(_textfile_section_worker, tasks, 1)
+        finally:
+            pool.close()
+            pool.join()
+
 def generate_nlmsa_edges(self, *args, **kwargs):
-    """iterate over all edges for all sequences in the alignment.
-    Very slow for a big alignment!"""
-    for seq in self.seqs:
-        myslice = self[seq]
-        for results in myslice.edges(*args, **kwargs):
-            yield results
+    """iterate over all edges (srcIval,destIval,edge) in the alignment,
+    walking the index of each sequence union in coordinate order, so
+    only the intervals aligned to one stored interval are held in memory.
+    Each stored interval is reported whole, as a 1:1 Seq2SeqEdge; an
+    interval aligned to an LPO is joined to the sequences aligned there,
+    one edge per LPO interval it overlaps.
+    uniqueEdges=True reports each pair of aligned intervals only once,
+    from the sequence with the lower nlmsaID, for alignments that store
+    both directions (bidirectional, or multiple alignments).
+    skipLPO=True skips intervals aligned to an LPO instead of joining them,
+    reporting only intervals stored directly between two sequences.
+    Other arguments, e.g. mergeMost, are grouping options that need the
+    full join, so with them each sequence is sliced and its
+    NLMSASlice.edges() reported, as before."""
+    uniqueEdges = kwargs.pop('uniqueEdges', False)
+    skipLPO = kwargs.pop('skipLPO', False)
+    if args or kwargs: # GROUP EDGES OVER THE SLICE OF EACH WHOLE SEQUENCE
+        for seq in self.seqs:
+            for results in self[seq].edges(*args, **kwargs):
+                if not uniqueEdges or \
+                       _first_report(self.seqs.getID(results[0]), results[0],
+                                     self.seqs.getID(results[1]), results[1]):
+                    yield results
+        return
+    import bisect, sequence
+    from cnestedlist import IntervalFileDBIterator
+    unions = {} # SORTED (offset,nlmsaID) OF THE SEQUENCES IN EACH UNION
+    for seqID, (nlmsaID, nsID, offset) in self.seqs.seqIDdict.iteritems():
+        unions.setdefault(nsID, []).append((offset, nlmsaID))
+    for ns in self.seqlist:
+        if ns.is_lpo or ns.id not in unions:
+            continue
+        seqOffsets = unions.pop(ns.id)
+        seqOffsets.sort()
+        offsets = [t[0] for t in seqOffsets]
+        if self.pairwiseMode == 1: # ITS VIRTUAL LPO HOLDS ITS INTERVALS
+            index = self.seqlist[ns.id - 1]
+        else:
+            index = ns
+        length = max(ns.length, index.length)
+        seqs = {} # CACHE THE SEQUENCES ALIGNED TO THE CURRENT SOURCE
+        for start, stop, targetID, targetStart, targetStop \
+                in IntervalFileDBIterator(-length, length, ns=index):
+            if start < 0: # FIND THE SEQUENCE CONTAINING THIS INTERVAL
+                offset, srcID = seqOffsets[bisect.bisect(offsets, -stop) - 1]
+                start, stop = start + offset, stop + offset
+            else:
+                offset, srcID = seqOffsets[bisect.bisect(offsets, start) - 1]
+                start, stop = start - offset, stop - offset
+            if srcID not in seqs:
+                seqs = {srcID:self.seqlist.getSeq(srcID)}
+            if not self.seqlist.is_lpo(targetID): # STORED DIRECTLY
+                hits = [(start, stop, targetID, targetStart, targetStop)]
+            elif skipLPO:
+                continue
+            else: # JOIN TO THE SEQUENCES ALIGNED TO THIS LPO INTERVAL
+                hits = []
+                for lpoStart, lpoStop, destID, destStart, destStop \
+                        in IntervalFileDBIterator(targetStart, targetStop,
+                                                  ns=self.seqlist[targetID]):
+                    lo = max(targetStart, lpoStart)
+                    hi = min(targetStop, lpoStop)
+                    s = start + lo - targetStart
+                    s2 = destStart + lo - lpoStart
+                    if destID != srcID or s != s2: # DISCARD SELF-MATCH
+                        hits.append((s, start + hi - targetStart, destID,
+                                     s2, destStart + hi - lpoStart))
+            for s, e, destID, s2, e2 in hits:
+                if s < 0: # REPORT SOURCE IN FORWARD ORIENTATION
+                    s, e, s2, e2 = -e, -s, -e2, -s2
+                if destID not in seqs:
+                    seqs[destID] = self.seqlist.getSeq(destID)
+                src = sequence.absoluteSlice(seqs[srcID], s, e)
+                dest = sequence.absoluteSlice(seqs[destID], s2, e2)
+                if not uniqueEdges or _first_report(srcID, src, destID, dest):
+                    yield src, dest, sequence.Seq2SeqEdge(None, dest, src,
+                                                          None)
+
+def _first_report(id, src, id2, dest):
+    """True if the edge src --> dest (nlmsaIDs id, id2) is the one of its
+    pair reported by uniqueEdges: src has the lower nlmsaID or start"""
+    return id < id2 or (id == id2 and src.start <= _forward_start(dest))
+
+def _forward_start(ival):
+    'start of ival on the forward strand'
+    if ival.orientation < 0:
+        return -ival.stop
+    return ival.start
 
 def get_interval(seq,start,end,ori):
     "trivial function to get the interval seq[start:end] with requested ori"
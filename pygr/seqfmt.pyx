@@ -15,8 +15,13 @@ cdef extern from "ctype.h":
     int isprint(int)
 
 cdef extern from "string.h":
+    ctypedef unsigned long size_t
     char *strcpy(char *,char *)
 
+cdef extern from "stdlib.h":
+    void *malloc(size_t)
+    void free(void *)
+
 
 
 def read_fasta_lengths(d, pyfile, filename):
@@ -58,3 +63,122 @@ def read_fasta_lengths(d, pyfile, filename):
         d[id]=seqLength,offset # SAVE THIS SEQ LENGTH
     fclose(ifile2)
     
+
+
+cdef int check_block(long long i1,long long i2,long long n,
+                     long long len1,long long len2) except -1:
+    'check that block [i1:i1+n], [i2:i2+n] lies within both strings'
+    if i1<0 or i2<0 or n<0 or i1+n>len1 or i2+n>len2:
+        raise IndexError('aligned block out of range')
+    return 0
+
+def count_identity(s1, s2, blocks):
+    '''count identical letters of strings s1 and s2 over the aligned blocks
+    given as a list of (i1,i2,n), i.e. s1[i1:i1+n] aligned to s2[i2:i2+n]'''
+    cdef long long i,i1,i2,n,len1,len2,nid
+    cdef char *p1,*p2
+    p1=s1
+    p2=s2
+    len1=len(s1)
+    len2=len(s2)
+    nid=0
+    for i1,i2,n in blocks:
+        check_block(i1,i2,n,len1,len2)
+        for i from 0 <= i < n:
+            if p1[i1+i]==p2[i2+i]:
+                nid=nid+1
+    return nid
+
+def identity_segments(s1, s2, blocks):
+    '''find the unbroken runs of identical letters of strings s1 and s2
+    over the aligned blocks given as for count_identity().  Returns list of
+    (i1,i2,length,#mismatches since the previous run)'''
+    cdef long long i,i1,i2,j1,j2,n,len1,len2,seg1,seg2,last1,last2,nmis
+    cdef int inseg
+    cdef char *p1,*p2
+    p1=s1
+    p2=s2
+    len1=len(s1)
+    len2=len(s2)
+    segment=[]
+    inseg=0
+    nmis=0
+    for i1,i2,n in blocks:
+        check_block(i1,i2,n,len1,len2)
+        for i from 0 <= i < n:
+            j1=i1+i
+            j2=i2+i
+            if p1[j1]==p2[j2]: # EXACT MATCH
+                if not inseg: # START NEW IDENTITY-SEGMENT
+                    seg1=j1
+                    seg2=j2
+                    inseg=1
+                elif last1+1!=j1 or last2+1!=j2: # NOT CONTIGUOUS, SO BREAK
+                    segment.append((seg1,seg2,last1+1-seg1,nmis))
+                    nmis=0
+                    seg1=j1
+                    seg2=j2
+                last1=j1
+                last2=j2
+            else: # MISMATCH
+                if inseg: # BREAK PREVIOUS SEGMENT
+                    segment.append((seg1,seg2,last1+1-seg1,nmis))
+                    inseg=0
+                    nmis=0
+                nmis=nmis+1
+    if inseg:
+        segment.append((seg1,seg2,last1+1-seg1,nmis))
+    return segment
+
+def longest_segment(segment, double pIdentityMin, mode=max):
+    '''find the longest run of segments (as returned by identity_segments())
+    with identity >= pIdentityMin, measuring its length as mode(length1,
+    length2) of its lengths on the two sequences.  max and min are computed
+    in C; any other mode is called for each run.  Returns
+    (start1,end1,start2,end2,#aligned letters) or None'''
+    cdef int i,j,n,useMax
+    cdef long long ni,nm,l,l2,best
+    cdef long long *seg
+    cdef double length
+    if mode is max:
+        useMax=1
+    elif mode is min:
+        useMax=0
+    else: # CALL mode() FOR EACH RUN
+        useMax= -1
+    n=len(segment)
+    seg=<long long *>malloc((4*n+1)*sizeof(long long))
+    if seg==NULL:
+        raise MemoryError('out of memory')
+    try:
+        i=0
+        for t in segment:
+            seg[4*i]=t[0]
+            seg[4*i+1]=t[1]
+            seg[4*i+2]=t[2]
+            seg[4*i+3]=t[3]
+            i=i+1
+        best= -1
+        for i from 0 <= i < n:
+            ni=0 # IDENTITY COUNT
+            nm=0 # MISMATCH COUNT
+            for j from i >= j >= 0:
+                ni=ni+seg[4*j+2]
+                l=seg[4*i]+seg[4*i+2]-seg[4*j]
+                l2=seg[4*i+1]+seg[4*i+2]-seg[4*j+1]
+                if useMax<0:
+                    length=mode(l,l2)
+                elif (useMax and l2>l) or (not useMax and l2<l):
+                    length=l2
+                else:
+                    length=l
+                if ni/length>=pIdentityMin and ni+nm>best:
+                    best=ni+nm
+                    besthit=(seg[4*j],seg[4*i]+seg[4*i+2],
+                             seg[4*j+1],seg[4*i+1]+seg[4*i+2],ni+nm)
+                nm=nm+seg[4*j+3]
+    finally:
+        free(seg)
+    if best<0:
+        return None
+    return besthit
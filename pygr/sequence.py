@@ -2,6 +2,7 @@
 from __future__ import generators
 import types
 from sequtil import *
+import seqfmt
 
 
 NOT_ON_SAME_PATH= -2
@@ -632,19 +633,18 @@ class Seq2SeqEdge(object):
         'get length of source vs. target interval according to mode'
         return mode(len(self.sourcePath),len(self.targetPath))
 
-    def pIdentity(self,mode=max,trapOverflow=True):
-        "calculate fractional identity for this pairwise alignment"
-        nid=0
+    def _aligned_blocks(self):
+        'get list of (isrc,idest,length) of 1:1 matches, relative to our ends'
         start1=self.sourcePath.start
-        s1=str(self.sourcePath).upper()
         start2=self.targetPath.start
-        s2=str(self.targetPath).upper()
-        for srcPath,destPath in self.items():
-            isrc=srcPath.start-start1
-            idest=destPath.start-start2
-            for i in xrange(len(srcPath)):
-                if s1[isrc+i]==s2[idest+i]:
-                    nid+=1
+        return [(srcPath.start-start1,destPath.start-start2,len(srcPath))
+                for srcPath,destPath in self.items()]
+
+    def pIdentity(self,mode=max,trapOverflow=True):
+        "calculate fractional identity for this pairwise alignment"
+        nid=seqfmt.count_identity(str(self.sourcePath).upper(),
+                                  str(self.targetPath).upper(),
+                                  self._aligned_blocks()) # LETTER LOOP IN C
         x=nid/float(self.length(mode))
         if trapOverflow and x>1.:
             raise ValueError('''pIdentity overflow due to multiple hits (see docs)?
@@ -653,19 +653,7 @@ class Seq2SeqEdge(object):
 
     def longestSegment(self,segment,pIdentityMin=.9,minAlignSize=1,
                        mode=max,**kwargs):
-        besthit=None
-        for i in xrange(len(segment)):
-            ni=0 # IDENTITY COUNT 
-            nm=0 # MISMATCH COUNT
-            for j in xrange(i,-1,-1):
-                ni+=segment[j][2]
-                l=mode(segment[i][0]+segment[i][2]-segment[j][0],
-                       segment[i][1]+segment[i][2]-segment[j][1])
-                pIdentity=float(ni)/l
-                if pIdentity>=pIdentityMin and (besthit is None or ni+nm>besthit[4]):
-                    besthit=(segment[j][0],segment[i][0]+segment[i][2],
-                             segment[j][1],segment[i][1]+segment[i][2],ni+nm)
-                nm+=segment[j][3]
+        besthit=seqfmt.longest_segment(segment,pIdentityMin,mode) # LOOP IN C
         if besthit is None:
             return None
         elif besthit[4]>=minAlignSize:
@@ -676,36 +664,12 @@ class Seq2SeqEdge(object):
     def conservedSegment(self,**kwargs):
         "calculate fractional identity for this pairwise alignment"
         start1=self.sourcePath.start
-        s1=str(self.sourcePath).upper()
         start2=self.targetPath.start
-        s2=str(self.targetPath).upper()
-        i1=None
-        segment=[]
-        n=0
-        for srcPath,destPath in self.items(): # FIND UNBROKEN IDENTITY SEGMENTS
-            isrc=srcPath.start-start1
-            idest=destPath.start-start2
-            for i in xrange(len(srcPath)):
-                if s1[isrc+i]==s2[idest+i]: # EXACT MATCH
-                    if i1 is None: # START NEW IDENTITY-SEGMENT
-                        seg1,i1=isrc+i,isrc+i
-                        seg2,i2=idest+i,idest+i
-                    elif i1+1!=isrc+i or i2+1!=idest+i: # NOT CONTIGUOUS, SO BREAK
-                        segment.append((seg1+start1,seg2+start2,i1+1-seg1,n))
-                        n=0 # RESET MISMATCH COUNT
-                        seg1,i1=isrc+i,isrc+i
-                        seg2,i2=idest+i,idest+i
-                    else:
-                        i1=isrc+i
-                        i2=idest+i
-                else: # MISMATCH
-                    if i1 is not None: # BREAK PREVIOUS SEGMENT
-                        segment.append((seg1+start1,seg2+start2,i1+1-seg1,n))
-                        i1=None
-                        n=0 # RESET MISMATCH COUNT
-                    n+=1 # COUNT MISMATCH
-        if i1 is not None:
-            segment.append((seg1+start1,seg2+start2,i1+1-seg1,n))
+        segment=[] # FIND UNBROKEN IDENTITY SEGMENTS, IN C
+        for seg1,seg2,n,nmis in seqfmt.identity_segments(
+                str(self.sourcePath).upper(),str(self.targetPath).upper(),
+                self._aligned_blocks()):
+            segment.append((seg1+start1,seg2+start2,n,nmis))
         return self.longestSegment(segment,**kwargs)
 
     def pAligned(self,mode=max,trapOverflow=True):
@@ -77,6 +77,11 @@ nested_src = [ os.path.join('pygr', 'intervaldb.c'),
               os.path.join('pygr', 'cnestedlist.%s' % ext),
               os.path.join('pygr', 'apps', 'maf2nclist.c') ]
 
+# set PYGR_NLMSA_64BIT=1 to build the interval engine with 64-bit coordinates
+nested_macros = []
+if os.environ.get('PYGR_NLMSA_64BIT'):
+    nested_macros.append(('INTERVALDB_64BIT', '1'))
+
 def main():
     setup(
         name = PYGR_NAME ,
@@ -94,7 +99,8 @@ def main():
         ext_modules = [
             Extension( 'pygr.seqfmt', seqfmt_src ),
             Extension( 'pygr.cdict',  cdict_src ),
-            Extension( 'pygr.cnestedlist', nested_src), 
+            Extension( 'pygr.cnestedlist', nested_src,
+                       define_macros=nested_macros ), 
         ],
 
         cmdclass = cmdclass,
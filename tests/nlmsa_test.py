@@ -1,4 +1,4 @@
-import unittest
+import unittest, array, os
 from testlib import testutil, PygrTestProgram
 from pygr import cnestedlist, nlmsa_utils, seqdb, sequence
 
@@ -20,6 +20,54 @@ class NestedList_Test(unittest.TestCase):
         assert self.db.find_overlap_list(-11,-7) == \
                          [(-10, 0, 1, 100, 110), (-20, -5, 2, 300, 315)]
 
+    def test_batch(self):
+        "NestedList batch query"
+        starts = array.array(cnestedlist.coord_typecode, [-11, 0, 30])
+        ends = array.array(cnestedlist.coord_typecode, [-7, 10, 40])
+        hits, offsets = self.db.find_overlaps_batch(starts, ends)
+        assert list(offsets) == [0, 2, 4, 4]
+        assert list(hits) == [-10, 0, 1, 100, 110, -20, -5, 2, 300, 315,
+                              0, 10, 1, -110, -100, 5, 20, 2, -315, -300]
+
+    def test_batch_nested(self):
+        "NestedList batch query of sorted queries through sublists"
+        db = cnestedlist.IntervalDB()
+        db.save_tuples([(0, 100, 1, 0, 100), (10, 20, 2, 0, 10),
+                        (15, 50, 3, 0, 35), (30, 40, 4, 0, 10),
+                        (60, 70, 5, 0, 10), (90, 120, 6, 0, 30)])
+        queries = [(0, 5), (12, 16), (18, 35), (45, 65), (65, 95), (110, 130)]
+        starts = array.array(cnestedlist.coord_typecode,
+                             [s for s, e in queries])
+        ends = array.array(cnestedlist.coord_typecode,
+                           [e for s, e in queries])
+        hits, offsets = db.find_overlaps_batch(starts, ends)
+        for i, (start, end) in enumerate(queries):
+            l = [tuple(hits[5 * j:5 * j + 5])
+                 for j in range(offsets[i], offsets[i + 1])]
+            l.sort()
+            expected = db.find_overlap_list(start, end)
+            expected.sort()
+            assert l == expected
+
+    def test_buffer(self):
+        "NestedList buffer query"
+        buf = self.db.find_overlap_buffer(0,10)
+        assert len(buf) == 2
+        assert list(buf) == [(0, 10, 1, -110, -100), (5, 20, 2, -315, -300)]
+        s = str(buffer(buf))
+        assert len(s) == 2 * buf.itemsize
+        a = array.array(cnestedlist.coord_typecode, s)
+        assert buf.offsets[0:2] == [0, a.itemsize]
+        assert list(a[0:2]) == [0, 10]
+        assert len(self.db.find_overlap_buffer(30,40)) == 0
+
+    def test_coverage(self):
+        "NestedList coverage"
+        assert self.db.coverage(0,20).tolist() == [1]*5 + [2]*5 + [1]*10
+        assert self.db.coverage(0,20,5).tolist() == [5, 10, 5, 5]
+        assert self.db.coverage(-12,-2,4).tolist() == [6, 7, 2]
+        assert self.db.coverage(30,40,20).tolist() == [0]
+
     def test_filedb(self):
         "NestedList filedb"
         tempdir  = testutil.TempDir('nlmsa-test')
@@ -30,10 +78,129 @@ class NestedList_Test(unittest.TestCase):
                          [(0, 10, 1, -110, -100), (5, 20, 2, -315, -300)]
         assert fdb.find_overlap_list(-11,-7) == \
                          [(-10, 0, 1, 100, 110), (-20, -5, 2, 300, 315)]
+        typecode = cnestedlist.coord_typecode
+        hits, offsets = fdb.find_overlaps_batch(array.array(typecode, [0, 30]),
+                                                array.array(typecode, [10, 40]))
+        assert list(offsets) == [0, 2, 2]
+        assert list(hits) == [0, 10, 1, -110, -100, 5, 20, 2, -315, -300]
+        assert list(fdb.find_overlap_buffer(-11,-7)) == \
+                         [(-10, 0, 1, 100, 110), (-20, -5, 2, 300, 315)]
+        # .size records the coordinate width after the five counts
+        size = open(filename + '.size').read().split()
+        assert int(size[5]) == 8 * array.array(typecode).itemsize
         
         # fails on windows
         #tempdir.remove()  @CTB
 
+    def test_filedb_mmap(self):
+        "NestedList filedb, memory-mapped"
+        tempdir  = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        self.db.write_binaries(filename)
+        fdb=cnestedlist.IntervalFileDB(filename, useMmap=True)
+        assert fdb.find_overlap_list(0,10) == \
+                         [(0, 10, 1, -110, -100), (5, 20, 2, -315, -300)]
+        assert fdb.find_overlap_list(-11,-7) == \
+                         [(-10, 0, 1, 100, 110), (-20, -5, 2, 300, 315)]
+        assert list(fdb.find_overlap(0,10)) == \
+                         [(0, 10, 1, -110, -100), (5, 20, 2, -315, -300)]
+        fdb.close()
+
+    def test_filedb_coord_bits(self):
+        "NestedList filedb written with the other coordinate size is refused"
+        tempdir  = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        self.db.write_binaries(filename)
+        size = open(filename + '.size').read().split()
+        bits = 8 * array.array(cnestedlist.coord_typecode).itemsize
+        assert int(size[5]) == bits
+        size[5] = str(96 - bits) # 32 <--> 64
+        ofile = file(filename + '.size', 'w')
+        ofile.write(' '.join(size) + '\n')
+        ofile.close()
+        try:
+            cnestedlist.IntervalFileDB(filename)
+            raise AssertionError('failed to trap wrong coordinate size!')
+        except IOError:
+            pass
+
+    def test_big_coords(self):
+        "NestedList coordinates past 2**31 in a 64-bit coordinate build"
+        if array.array(cnestedlist.coord_typecode).itemsize < 8:
+            return # ONLY BUILT WITH PYGR_NLMSA_64BIT
+        big = 2**40
+        db = cnestedlist.IntervalDB()
+        db.save_tuples([(big, big + 10, 1, 0, 10), (0, 10, 2, big, big + 10)])
+        assert db.find_overlap_list(big + 5, big + 6) == \
+               [(big, big + 10, 1, 0, 10)]
+        tempdir  = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        db.write_binaries(filename)
+        fdb = cnestedlist.IntervalFileDB(filename)
+        assert fdb.find_overlap_list(0, 1) == [(0, 10, 2, big, big + 10)]
+        assert fdb.find_overlap_list(big, big + 1) == \
+               [(big, big + 10, 1, 0, 10)]
+        fdb.close()
+
+    def test_filedb_compressed(self):
+        "NestedList filedb, compressed blocks"
+        tempdir  = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        self.db.write_binaries(filename, compress=True)
+        size = open(filename + '.size').read().split()
+        assert int(size[6]) == 1 # .idb format: compressed
+        fdb=cnestedlist.IntervalFileDB(filename)
+        assert fdb.find_overlap_list(0,10) == \
+                         [(0, 10, 1, -110, -100), (5, 20, 2, -315, -300)]
+        assert fdb.find_overlap_list(-11,-7) == \
+                         [(-10, 0, 1, 100, 110), (-20, -5, 2, 300, 315)]
+        fdb.close()
+        try:
+            cnestedlist.IntervalFileDB(filename, useMmap=True)
+            raise AssertionError('failed to trap mmap of compressed file!')
+        except IOError:
+            pass
+
+    def test_filedb_cache(self):
+        "NestedList filedb, shared block cache"
+        tempdir  = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        self.db.write_binaries(filename)
+        fdb=cnestedlist.IntervalFileDB(filename)
+        oldSize = cnestedlist.set_block_cache_size(1 << 20)
+        try:
+            cnestedlist.clear_block_cache()
+            for i in range(2): # SECOND QUERY SHOULD HIT THE CACHE
+                assert fdb.find_overlap_list(0,10) == \
+                       [(0, 10, 1, -110, -100), (5, 20, 2, -315, -300)]
+            stats = cnestedlist.get_block_cache_stats()
+            assert stats['misses'] > 0
+            assert stats['hits'] == stats['misses']
+            fdb.close() # DROPS ITS BLOCKS
+            assert cnestedlist.get_block_cache_stats()['nblocks'] == 0
+        finally:
+            cnestedlist.set_block_cache_size(oldSize)
+
+    def test_filedb_append(self):
+        "NestedList filedb, append and compact"
+        tempdir  = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        self.db.write_binaries(filename)
+        fdb=cnestedlist.IntervalFileDB(filename)
+        assert fdb.append_intervals([(3,8,3,0,5), (40,50,4,0,10)]) == 2
+        assert fdb.find_overlap_list(0,10) == [(0, 10, 1, -110, -100),
+                                               (5, 20, 2, -315, -300),
+                                               (3, 8, 3, 0, 5)]
+        assert fdb.find_overlap_list(45,46) == [(40, 50, 4, 0, 10)]
+        assert fdb.compact() == 4
+        assert not os.path.exists(filename + '.delta')
+        l = fdb.find_overlap_list(0,10)
+        l.sort()
+        assert l == [(0, 10, 1, -110, -100), (3, 8, 3, 0, 5),
+                     (5, 20, 2, -315, -300)]
+        assert fdb.find_overlap_list(45,46) == [(40, 50, 4, 0, 10)]
+        fdb.close()
+
 class NLMSA_SimpleTests(unittest.TestCase):
 
     def setUp(self):
@@ -106,11 +273,64 @@ class NLMSA_Test(unittest.TestCase):
         r = repr(slice)
         assert 'seq=b' in r
 
+    def test_edge_stats(self):
+        "Seq2SeqEdge identity statistics and sequence grouping"
+        s = sequence.Sequence('ATGGACAGAG', 'x')
+        s2 = sequence.Sequence('ATGGTCAGAC', 'y')
+        nlmsa = cnestedlist.NLMSA('bar', mode='memory', pairwiseMode=True)
+        nlmsa += s
+        nlmsa[s] += s2
+        nlmsa.build()
+
+        (src, dest, e), = nlmsa[s].edges()
+        assert e.pIdentity() == 0.8
+        assert e.pAligned() == 1.
+        assert e.conservedSegment(pIdentityMin=.9) == (0, 4, 0, 4)
+        assert e.conservedSegment(pIdentityMin=.8) == (0, 9, 0, 9)
+        mean = lambda x, y: (x + y) / 2.
+        assert e.conservedSegment(pIdentityMin=.8, mode=mean) == (0, 9, 0, 9)
+        assert e.conservedSegment(pIdentityMin=.9, mode=mean) == (0, 4, 0, 4)
+
+        slice = nlmsa[s]
+        si = slice.groupByIntervals()
+        assert slice.groupBySequences(si, sourceOnly=True) == [s]
+        assert slice.groupBySequences(si, minAligned=2) == []
+
 class NLMSA_BuildWithAlignedIntervals_Test(unittest.TestCase):
+    alignedIvalsAttrs = dict(id=0, start=1, stop=2, idDest=0, startDest=1,
+                             stopDest=2, ori=3, oriDest=3)
+    ivals = [(('a', 0, 8, 1), ('b', 0, 8, 1),),
+             (('a', 12, 20, 1), ('c', 0, 8, 1)),]
+
     def setUp(self):
         seqdb_name = testutil.datafile('alignments.fa')
         self.db = seqdb.SequenceFileDB(seqdb_name)
 
+    def _build_ivals(self, filename, ivals=None, buildArgs={}, **kwargs):
+        "build a pairwise NLMSA from ivals (default: self.ivals)"
+        if ivals is None:
+            ivals = self.ivals
+        n = cnestedlist.NLMSA(filename, pairwiseMode=True, **kwargs)
+        cti = nlmsa_utils.CoordsToIntervals(self.db, self.db,
+                                            self.alignedIvalsAttrs)
+        n.add_aligned_intervals(cti(ivals))
+        n.build(**buildArgs)
+        return n
+
+    def _write_maf(self, tempdir):
+        "save mafText in tempdir, returning its path"
+        mafFile = tempdir.subfile('test.maf')
+        ofile = file(mafFile, 'w')
+        ofile.write(self.mafText)
+        ofile.close()
+        return mafFile
+
+    def _build_maf(self, tempdir, **kwargs):
+        "build an on-disk NLMSA tempdir/nlmsa from mafText"
+        return cnestedlist.NLMSA(tempdir.subfile('nlmsa'), mode='w',
+                                 seqDict=self.db,
+                                 mafFiles=[self._write_maf(tempdir)], **kwargs)
+
     def _check_results(self, n):
         db = self.db
         
@@ -145,6 +365,383 @@ class NLMSA_BuildWithAlignedIntervals_Test(unittest.TestCase):
 
         self._check_results(n)
 
+    def test_memory_buffer(self):
+        "in-memory NLMSA build growing its interval buffer"
+        ivals = self.ivals + [(('a', 30, 38, 1), ('c', 0, 8, 1))] * 1500
+        n = self._build_ivals('test', ivals, mode='memory')
+
+        self._check_results(n)
+        c = self.db['c']
+        assert n[self.db['a'][30:38]].keys() == [c[0:8]] * 1500
+
+    def test_parallel_build(self):
+        "NLMSA on-disk build with a pool of worker processes"
+        tempdir = testutil.TempDir('nlmsa-parallel')
+        n = self._build_ivals(tempdir.subfile('nlmsa'), mode='w', nWorkers=2)
+
+        self._check_results(n)
+
+    mafText = """##maf version=1
+a score=1.0
+s a 0 8 + 38 atggcagg
+s b 0 8 + 8 atggcagg
+
+a score=1.0
+s a 12 8 + 38 accagatg
+s c 0 8 + 8 accagatg
+
+"""
+
+    def test_maf_parallel(self):
+        "NLMSA built from a MAF file parsed by a pool of worker processes"
+        tempdir = testutil.TempDir('nlmsa-maf')
+        mafFile = self._write_maf(tempdir)
+
+        ranges = nlmsa_utils.split_maf_files([mafFile], 4)
+        assert len(ranges) == 2 # NEVER SPLITS A BLOCK
+        assert ranges[-1][2] == os.stat(mafFile).st_size
+
+        filename = tempdir.subfile('nlmsa')
+        n = cnestedlist.NLMSA(filename, mode='w', seqDict=self.db,
+                              mafFiles=[mafFile], nWorkers=2)
+        self._check_results(n)
+
+    def test_maf_compressed(self):
+        "NLMSA built directly from a gzip compressed MAF file"
+        import gzip
+        tempdir = testutil.TempDir('nlmsa-mafgz')
+        mafFile = tempdir.subfile('test.maf.gz')
+        ofile = gzip.open(mafFile, 'wb')
+        ofile.write(self.mafText)
+        ofile.close()
+
+        assert cnestedlist.is_compressed_file(mafFile)
+        assert nlmsa_utils.split_maf_files([mafFile], 4) == [(mafFile, 0, -1)]
+        for nWorkers in (1, 2):
+            filename = tempdir.subfile('nlmsa%d' % nWorkers)
+            n = cnestedlist.NLMSA(filename, mode='w', seqDict=self.db,
+                                  mafFiles=[mafFile], nWorkers=nWorkers)
+            self._check_results(n)
+
+    def test_projection(self):
+        "NLMSA projection index gives the same slices as the LPO join"
+        tempdir = testutil.TempDir('nlmsa-proj')
+        n = self._build_maf(tempdir)
+        a = self.db['a']
+        ivals = [a[0:8], a[2:14], a[6:16], a[12:20], a[3:18], -a[5:15]]
+        joined = [n[ival].keys() for ival in ivals]
+        # WINDOWS SPLIT BOTH BLOCKS, WHICH MUST BE JOINED BACK TOGETHER
+        assert n.build_projection(a, windowSize=4) == 2
+        assert len(n.projections) == 1
+        assert [n[ival].keys() for ival in ivals] == joined
+        self._check_results(n)
+        n.close()
+
+        n = cnestedlist.NLMSA(tempdir.subfile('nlmsa'), seqDict=self.db)
+        assert len(n.projections) == 1 # SAVED IN .attrDict
+        self._check_results(n)
+        assert n[-a[2:10]].keys() == [-self.db['b'][2:8]]
+
+    def test_slice_many(self):
+        "NLMSA batch query gives the same slices as single queries"
+        tempdir = testutil.TempDir('nlmsa-slicemany')
+        n = self._build_maf(tempdir)
+        a, b = self.db['a'], self.db['b']
+        ivals = [a[12:20], b[2:6], a[0:8], a[22:30], -a[5:15], a[3:18]]
+        for maxgap in (0, 1000):
+            results = list(n.slice_many(ivals, maxgap=maxgap))
+            assert len(results) == len(ivals)
+            for ival, s in results:
+                assert s.keys() == n[ival].keys()
+        for ival, s in results:
+            if ival == a[22:30]:
+                assert s.keys() == [] # NOT ALIGNED
+            elif ival == b[2:6]:
+                assert s.keys() == [a[2:6]]
+
+    def test_slice_many_throughput(self):
+        "NLMSA batch query is faster than looping over single queries"
+        import time
+        a = sequence.Sequence('ACGT' * 25000, 'a')
+        b = sequence.Sequence('ACGT' * 25000, 'b')
+        n = cnestedlist.NLMSA('throughput', mode='memory', pairwiseMode=True)
+        n += a
+        for i in range(0, len(a), 100):
+            n[a[i:i + 80]] += b[i:i + 80]
+        n.build()
+        ivals = [a[i:i + 50] for i in range(0, len(a) - 50, 37)]
+        loopTime = batchTime = None
+        for i in range(3): # BEST OF 3, TO IGNORE SYSTEM NOISE
+            t = time.time()
+            loop = [n[ival] for ival in ivals]
+            t = time.time() - t
+            if loopTime is None or t < loopTime:
+                loopTime = t
+            t = time.time()
+            batch = list(n.slice_many(ivals))
+            t = time.time() - t
+            if batchTime is None or t < batchTime:
+                batchTime = t
+        assert [s.keys() for ival, s in batch] == [s.keys() for s in loop]
+        assert batchTime < loopTime, \
+               'slice_many %.3fs, nlmsa[ival] loop %.3fs for %d intervals' \
+               % (batchTime, loopTime, len(ivals))
+
+    def test_lazy_slice(self):
+        "NLMSA lazy slice joins only the sequences asked for"
+        tempdir = testutil.TempDir('nlmsa-lazy')
+        n = self._build_maf(tempdir)
+        a, b, c = self.db['a'], self.db['b'], self.db['c']
+        ival = a[2:16]
+        assert n.lazy_slice(ival).matchIntervals(b) == n[ival].matchIntervals(b)
+        assert n.lazy_slice(ival).findSeqEnds(c) == n[ival].findSeqEnds(c)
+        filterSeqs = sequence.SeqFilterDict([b])
+        assert n.lazy_slice(ival).keys(filterSeqs=filterSeqs) == [b[2:8]]
+        s = n.lazy_slice(ival)
+        assert len(s) == len(n[ival]) == 2
+        assert s.keys() == n[ival].keys()
+        assert n.lazy_slice(a[22:30]).keys() == [] # NOT ALIGNED
+
+    def test_mmap(self):
+        "NLMSA opened for reading with memory-mapped indexes"
+        tempdir = testutil.TempDir('nlmsa-mmap')
+        self._build_maf(tempdir).close()
+
+        a, b, c = self.db['a'], self.db['b'], self.db['c']
+        ivals = [a, a[0:8], a[2:14], a[12:20], -a[5:15], a[22:30], b[2:6], c]
+        n = cnestedlist.NLMSA(tempdir.subfile('nlmsa'), seqDict=self.db)
+        m = cnestedlist.NLMSA(tempdir.subfile('nlmsa'), seqDict=self.db,
+                              useMmap=True)
+        assert not n.useMmap and m.useMmap
+        for ival in ivals:
+            assert m[ival].keys() == n[ival].keys()
+            assert m[ival].matchIntervals() == n[ival].matchIntervals()
+        self._check_results(m)
+
+    def test_edges(self):
+        "NLMSA whole-alignment edges streamed from its indexes"
+        tempdir = testutil.TempDir('nlmsa-edges')
+        n = self._build_maf(tempdir)
+        def coords(edges):
+            return set([(src.id, src.start, src.stop,
+                         dest.id, dest.start, dest.stop)
+                        for src, dest, e in edges])
+        expected = set([('a', 0, 8, 'b', 0, 8), ('a', 12, 20, 'c', 0, 8),
+                        ('b', 0, 8, 'a', 0, 8), ('c', 0, 8, 'a', 12, 20)])
+        edges = list(n.edges())
+        assert len(edges) == 4 # ONE WHOLE EDGE PER ALIGNED INTERVAL
+        assert coords(edges) == expected
+        for src, dest, e in edges:
+            assert e.items() == [(src, dest)]
+        assert coords(n.edges(mergeMost=True)) == expected # SLICE GROUPING
+        l = [(src, dest) for src, dest, e in n.edges(uniqueEdges=True)]
+        assert len(l) == 2
+        for src, dest in l:
+            assert n.seqs.getID(src) < n.seqs.getID(dest)
+        assert list(n.edges(skipLPO=True)) == [] # ALL ALIGNED VIA THE LPO
+
+        n = self._build_ivals(tempdir.subfile('pairwise'), mode='w',
+                              ivals=[(('a', 12, 20, 1), ('b', 0, 8, -1))])
+        edges = list(n.edges(skipLPO=True)) # NO LPO IN A PAIRWISE NLMSA
+        assert coords(edges) == set([('a', 12, 20, 'b', -8, 0),
+                                     ('b', 0, 8, 'a', -20, -12)])
+        assert coords(n.edges(uniqueEdges=True)) == \
+               set([('a', 12, 20, 'b', -8, 0)])
+
+    def test_raw_table(self):
+        "NLMSASlice match intervals as column arrays"
+        tempdir = testutil.TempDir('nlmsa-table')
+        n = self._build_maf(tempdir)
+        a, b = self.db['a'], self.db['b']
+        s = n[a[2:16]]
+        t = s.raw_table()
+        rows = zip(*t)
+        rows.sort()
+        matches = [(ival1.start, ival1.stop, n.seqs.getSeqID(ival2),
+                    ival2.start, ival2.stop)
+                   for ival1, ival2 in s.matchIntervals()]
+        matches.sort()
+        assert [r[:2] + (r[3], r[4]) for r in rows] == \
+               [m[:2] + m[3:] for m in matches]
+        assert n.seq_ids([r[2] for r in rows]) == [m[2] for m in matches]
+        assert list(t[5]) == [1, 1]
+        t = s.raw_table(b)
+        assert (list(t[0]), list(t[1]), list(t[3]), list(t[4])) == \
+               ([2], [8], [2], [8])
+        t = s.to_arrays(mergeAll=True)
+        assert len(t[0]) == len(s.keys(mergeAll=True))
+        assert [len(c) for c in n[a[22:30]].raw_table()] == [0] * 6
+
+    def test_aligned_arrays(self):
+        "NLMSA bulk build from coordinate arrays"
+        tempdir = testutil.TempDir('nlmsa-arrays')
+        for mode in ('w', 'memory'):
+            n = cnestedlist.NLMSA(tempdir.subfile('nlmsa'), mode=mode,
+                                  seqDict=self.db, pairwiseMode=True)
+            ct = cnestedlist.coord_typecode
+            assert n.add_aligned_arrays(['a', 'b', 'c'], array.array('i', [0, 0]),
+                                        array.array(ct, [0, 12]),
+                                        array.array(ct, [8, 20]),
+                                        array.array('i', [1, 2]),
+                                        array.array(ct, [0, 0]),
+                                        array.array(ct, [8, 8])) == 2
+            n.build()
+            self._check_results(n)
+
+        try: # dest interval past the end of sequence b
+            n = cnestedlist.NLMSA('test', mode='memory', seqDict=self.db,
+                                  pairwiseMode=True)
+            n.add_aligned_arrays(['a', 'b'], array.array('i', [0]),
+                                 array.array(ct, [0]), array.array(ct, [8]),
+                                 array.array('i', [1]), array.array(ct, [0]),
+                                 array.array(ct, [9]))
+            raise AssertionError('failed to trap bad coordinates')
+        except ValueError:
+            pass
+
+    def test_external_build(self):
+        "NLMSA on-disk build, sorting on disk within a memory limit"
+        tempdir = testutil.TempDir('nlmsa-external')
+        # maxMemory=1 FORCES EVERY INDEX TO BE SORTED ON DISK
+        n = self._build_ivals(tempdir.subfile('nlmsa'), mode='w',
+                              buildArgs=dict(maxMemory=1))
+
+        self._check_results(n)
+
+    def test_append(self):
+        "NLMSA append to a built alignment, then compact"
+        tempdir = testutil.TempDir('nlmsa-append')
+        filename = tempdir.subfile('nlmsa')
+        n = self._build_ivals(filename, self.ivals[:1], mode='w')
+        cti = nlmsa_utils.CoordsToIntervals(self.db, self.db,
+                                            self.alignedIvalsAttrs)
+        n.append_aligned_intervals(cti(self.ivals[1:]))
+        self._check_results(n)
+        assert n.compact() > 0
+
+        self._check_results(n)
+        n.close()
+        n = cnestedlist.NLMSA(filename, seqDict=n.seqDict)
+        self._check_results(n)
+
+    def test_seq_index(self):
+        "NLMSA opened for reading uses the memory-mapped sequence index"
+        tempdir = testutil.TempDir('nlmsa-seqindex')
+        filename = tempdir.subfile('nlmsa')
+        n = self._build_ivals(filename, mode='w')
+        n.close()
+        assert not [s for s in os.listdir(tempdir.path)
+                    if s.startswith('nlmsa.seqIDdict')] # NO SHELVE WRITTEN
+
+        n = cnestedlist.NLMSA(filename, seqDict=n.seqDict)
+        seqIDdict = n.seqs.seqIDdict
+        assert isinstance(seqIDdict, nlmsa_utils.NLMSAIDIndex)
+        assert len(seqIDdict) == 3
+        for seqID, (nlmsaID, nsID, offset) in seqIDdict.iteritems():
+            assert seqIDdict[seqID] == (nlmsaID, nsID, offset)
+            assert n.seqs.IDdict[str(nlmsaID)] == (seqID, nsID)
+        assert 'nonexistent' not in seqIDdict
+        self._check_results(n)
+
+    def test_max_open_indexes(self):
+        "NLMSA in read mode keeping at most one index loaded"
+        tempdir = testutil.TempDir('nlmsa-maxopen')
+        filename = tempdir.subfile('nlmsa')
+        n = self._build_ivals(filename, mode='w',
+                              maxlen=40) # a AND b CANNOT SHARE A UNION
+        n.close()
+
+        n = cnestedlist.NLMSA(filename, seqDict=n.seqDict, maxOpenIndexes=1)
+        assert len(n.indexCache) == 0 # NOTHING OPENED YET
+        self._check_results(n)
+        assert len(n.indexCache) == 1
+        b = self.db['b'] # IN ANOTHER UNION, SO UNLOADS THE INDEX FOR a
+        (result,) = n[b[0:8]].keys()
+        assert result == self.db['a'][0:8]
+        assert len(n.indexCache) == 1
+        self._check_results(n) # REOPENS THE INDEX FOR a
+        assert len(n.indexCache) == 1
+
+    def test_preload_fork(self):
+        "NLMSA preloaded, then queried from a forked process"
+        tempdir = testutil.TempDir('nlmsa-fork')
+        filename = tempdir.subfile('nlmsa')
+        n = self._build_ivals(filename, mode='w', seqDict=self.db)
+        n.close()
+
+        n = cnestedlist.NLMSA(filename, seqDict=self.db)
+        assert n.preload() == len(n.seqlist)
+        assert n.preload() == 0 # ALREADY OPEN
+        if not hasattr(os, 'fork'):
+            return
+        pid = os.fork()
+        if pid == 0: # CHILD PROCESS
+            try:
+                n.after_fork()
+                self._check_results(n)
+            except:
+                os._exit(1)
+            os._exit(0)
+        self._check_results(n)
+        assert os.waitpid(pid, 0)[1] == 0
+
+    def test_file_pool(self):
+        "NLMSA build and query keeping at most two files open"
+        tempdir = testutil.TempDir('nlmsa-filepool')
+        n = cnestedlist.NLMSA(tempdir.subfile('nlmsa'), mode='w',
+                              pairwiseMode=True,
+                              maxlen=40) # a AND b CANNOT SHARE A UNION
+        # NLMSA() SETS THE POOL SIZE, SO SHRINK IT BEFORE BUILDING
+        oldSize = cnestedlist.set_file_pool_size(2)
+        try:
+            cti = nlmsa_utils.CoordsToIntervals(self.db, self.db,
+                                                self.alignedIvalsAttrs)
+            n.add_aligned_intervals(cti(self.ivals))
+            n.build()
+            assert len(n.seqlist) >= 4
+            self._check_results(n)
+            self._check_results(n) # REOPENS EVERY INDEX
+            stats = cnestedlist.get_file_pool_stats()
+            assert stats['maxOpen'] == 2
+            assert stats['nopen'] <= 2
+            assert stats['reopens'] > 0
+        finally:
+            cnestedlist.set_file_pool_size(oldSize)
+
+    def test_textfile_sections(self):
+        "NLMSA compressed textfile dump, restored in parallel"
+        tempdir = testutil.TempDir('nlmsa-textfile')
+        filename = tempdir.subfile('nlmsa')
+        n = self._build_ivals(filename, mode='w', seqDict=self.db,
+                              buildArgs=dict(saveSeqDict=True))
+        n.close()
+
+        textfile = tempdir.subfile('nlmsa.txt.gz')
+        cnestedlist.dump_textfile(filename, textfile, compress='gzip')
+        assert cnestedlist.is_compressed_file(textfile)
+        sections = nlmsa_utils.read_textfile_sections(textfile)
+        assert len(sections) == len(file(filename + '.NLMSAindex').readlines())
+        proc = nlmsa_utils.decompress_from(textfile, 0, 'gzip', sections[0][0])
+        header = proc.stdout.read() # STOPS AT THE FIRST SECTION
+        assert proc.wait() == 0
+        os.waitpid(proc.feederPid, 0)
+        assert header.startswith('PATHSTEM') and 'NLMSASequence' not in header
+        for nWorkers in (1, 2):
+            buildpath = tempdir.subfile('restore%d' % nWorkers)
+            os.mkdir(buildpath)
+            path = cnestedlist.textfile_to_binaries(textfile, seqDict=self.db,
+                                                    buildpath=buildpath,
+                                                    nWorkers=nWorkers)
+            self._check_results(cnestedlist.NLMSA(path, seqDict=self.db))
+
+    def test_coverage(self):
+        "NLMSASlice coverage"
+        n = self._build_ivals('test', mode='memory')
+
+        a = self.db['a']
+        assert n[a[0:20]].coverage().tolist() == [1]*8 + [0]*4 + [1]*8
+        assert n[a[0:20]].coverage(10).tolist() == [8, 8]
+
     def test_simple_no_ori(self):
         # first set of intervals
         ivals = [(('a', 0, 8,), ('b', 0, 8,),),